@@ -0,0 +1,62 @@
+"""
+Agent技能与卡片定义
+模块加载时构建一次，供服务端各处复用
+"""
+
+import os
+
+from a2a.types import (
+    AgentCapabilities,
+    AgentCard,
+    AgentSkill,
+)
+
+# 服务地址在导入时计算一次
+_HOST = os.getenv('SERVER_HOST', 'localhost')
+_PORT = int(os.getenv('SERVER_PORT', '9999'))
+
+BASIC_SKILL = AgentSkill(
+    id='prompt_optimization',
+    name='Prompt优化服务',
+    description='通过多Agent协作优化prompt，支持角色定义、基本要求和可选示例',
+    tags=['prompt engineering', 'optimization', 'multi-agent'],
+    examples=[
+        '为软件开发者优化代码生成prompt，包含基本编码规范和最佳实践',
+        '为内容创作者优化写作prompt，定义创作风格和结构要求',
+        '为数据分析师优化数据处理prompt，设定分析标准和输出格式'
+    ],
+)
+
+ADVANCED_SKILL = AgentSkill(
+    id='advanced_prompt_optimization',
+    name='高级Prompt优化服务',
+    description='提供深度定制的prompt优化服务，包含详细的角色分析、任务分解和性能评估',
+    tags=['prompt engineering', 'optimization', 'multi-agent', 'advanced', 'deep-analysis'],
+    examples=[
+        '基于详细的角色分析和任务要求进行多轮迭代优化',
+        '针对特定业务场景的深度定制，包含完整的任务分解和评估标准',
+        '结合性能指标和用户反馈的综合优化方案'
+    ],
+)
+
+PUBLIC_CARD = AgentCard(
+    name='Prompt优化器 Agent',
+    description='智能Prompt优化系统，支持角色定义、基本要求和示例，帮助用户生成高质量的prompt',
+    url=f'http://{_HOST}:{_PORT}/',
+    version='1.0.0',
+    defaultInputModes=['text'],
+    defaultOutputModes=['text'],
+    capabilities=AgentCapabilities(streaming=True),
+    skills=[BASIC_SKILL],
+    supportsAuthenticatedExtendedCard=True,
+)
+
+# 认证扩展agent卡片 - 包含高级功能
+EXTENDED_CARD = PUBLIC_CARD.model_copy(
+    update={
+        'name': 'Prompt优化器 Agent - 专业版',
+        'description': '专业级Prompt优化系统，提供深度角色分析、任务分解和定制化优化服务',
+        'version': '1.1.0',
+        'skills': [BASIC_SKILL, ADVANCED_SKILL],  # 包含基础和高级技能
+    }
+)
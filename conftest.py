@@ -0,0 +1,28 @@
+"""
+pytest共享夹具：模型和工作流实例在同一测试模块内复用
+"""
+
+import pytest
+
+from prompt_optimizer import Config, ModelFactory, PromptImproverAgent, PromptOptimizerWorkflow
+
+
+@pytest.fixture(scope="module")
+def gemini_model():
+    """模块内共享的Gemini模型实例（未配置API密钥时跳过）"""
+    if not Config.GOOGLE_API_KEY:
+        pytest.skip("未配置GOOGLE_API_KEY")
+    ModelFactory.clear_cache()
+    return ModelFactory.create_model("gemini")
+
+
+@pytest.fixture(scope="module")
+def workflow():
+    """模块内共享的工作流实例，模型在首次调用时才创建"""
+    return PromptOptimizerWorkflow(model_type="gemini")
+
+
+@pytest.fixture(scope="session")
+def improver():
+    """整个测试会话共享的改进Agent，仅测试解析逻辑时不会创建模型"""
+    return PromptImproverAgent(model_type="openai")
@@ -7,263 +7,368 @@ Prompt优化器演示脚本
 import asyncio
 import json
 import os
-from prompt_optimizer import PromptOptimizerWorkflow, PromptRequest
+import re
+import sys
+from functools import partial
+from prompt_cache import ExactCache, SemanticCache
+from prompt_optimizer import Config, ModelFactory, OptimizeResult, PromptOptimizerWorkflow, PromptRequest, install_uvloop
 
+# 优先使用orjson序列化示例输入，未安装时退回标准库json
+try:
+    import orjson
 
-async def demo_software_development_gemini():
-    """演示为软件开发优化prompt - 使用Gemini模型"""
-    print("🔧 演示：软件开发prompt优化 - Gemini模型")
-    print("=" * 60)
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _dumps = partial(json.dumps, separators=(",", ":"), ensure_ascii=False)
+
+
+# 示例输出中使用的邮箱格式正则，模块加载时编译一次
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+
+def _trunc(text: str, n: int) -> str:
+    """超过n个字符时截断并添加省略号"""
+    return text if len(text) <= n else text[:n] + "..."
+
+
+# 限制同时进行的优化请求数，避免并发演示触发模型服务的速率限制
+_SEM = asyncio.Semaphore(Config.get_int("PROMPT_MAX_CONCURRENCY", 5))
+
+# 精确缓存：完全相同的请求直接读取上次的优化结果
+_EXACT_CACHE = ExactCache(
+    Config.get_str("PROMPT_CACHE_DIR", "~/.cache/prompt_agent"),
+    ttl=Config.get_float("PROMPT_CACHE_TTL", 7 * 24 * 3600)
+)
+
+# 语义缓存：相近的请求直接复用已有的优化结果
+_CACHE = SemanticCache(
+    threshold=Config.get_float("SEMANTIC_CACHE_THRESHOLD", 0.95),
+    path=Config.get_str("SEMANTIC_CACHE_PATH", "") or None
+)
+
+_SWDEV_EXAMPLE_1_INPUT = _dumps({
+    "function_name": "validate_email",
+    "input_type": "str",
+    "output_type": "bool",
+    "description": "验证邮箱地址格式"
+})
+
+_SWDEV_EXAMPLE_2_INPUT = _dumps({
+    "class_name": "DatabaseConnection",
+    "host": "localhost",
+    "database": "mydb",
+    "username": "admin"
+})
+
+_CONTENT_EXAMPLE_1_INPUT = _dumps({
+    "topic": "AI trends",
+    "target_audience": "tech professionals",
+    "tone": "professional",
+    "word_count": "1000"
+})
+
+_CONTENT_EXAMPLE_2_INPUT = _dumps({
+    "topic": "sustainability",
+    "target_audience": "general public",
+    "tone": "casual",
+    "word_count": "200"
+})
+
+# 演示请求在模块加载时构建一次，多次运行直接复用
+_SWDEV_GEMINI_REQUEST = PromptRequest(
+    role="software developers",
+    basic_requirements="编写高质量、可维护的Python代码，包括函数、类和API设计",
+    examples=[  # 可选的示例
+        {
+            "input": "Write a function to calculate fibonacci numbers",
+            "output": "def fibonacci(n):\n    if n <= 1:\n        return n\n    return fibonacci(n-1) + fibonacci(n-2)"
+        },
+        {
+            "input": "Create a REST API endpoint",
+            "output": "@app.route('/api/users', methods=['GET'])\ndef get_users():\n    return jsonify(users)"
+        }
+    ],
+    additional_requirements="代码需要包含详细的注释和错误处理",
+    model_type="gemini"
+)
+
+
+_SWDEV_OPENAI_REQUEST = PromptRequest(
+    role="software developers",
+    basic_requirements="编写健壮、可扩展的Python代码，重点关注错误处理和文档",
+    examples=[  # 可选的示例
+        {
+            "input": _SWDEV_EXAMPLE_1_INPUT,
+            "output": "def validate_email(email: str) -> bool:\n    \"\"\"验证邮箱地址格式的有效性\n    Args:\n        email: 要验证的邮箱地址\n    Returns:\n        bool: 邮箱格式是否有效\n    \"\"\"\n    pattern = r'" + _EMAIL_RE.pattern + "'\n    return re.match(pattern, email) is not None"
+        },
+        {
+            "input": _SWDEV_EXAMPLE_2_INPUT,
+            "output": "class DatabaseConnection:\n    def __init__(self, host: str = 'localhost', database: str = 'mydb', username: str = 'admin'):\n        self.host = host\n        self.database = database\n        self.username = username\n        self.connection = None"
+        }
+    ],
+    additional_requirements="代码需要包含完整的类型提示和异常处理",
+    model_type="openai"
+)
+
+
+_SUPPORT_REQUEST = PromptRequest(
+    role="customer support representatives",
+    basic_requirements="提供专业、有同理心的客户服务，快速解决客户问题",
+    examples=[  # 可选的示例
+        {
+            "input": "Customer complains about delayed delivery",
+            "output": "I sincerely apologize for the delay. Let me check your order status and provide an update."
+        },
+        {
+            "input": "Customer asks for refund",
+            "output": "I understand your concern. I'd be happy to help with the refund process."
+        }
+    ],
+    additional_requirements="保持积极友好的语气，提供明确的解决方案",
+    model_type="openai"
+)
+
+
+_CONTENT_REQUEST = PromptRequest(
+    role="content creators",
+    basic_requirements="创作引人入胜、结构清晰的内容，包括博客文章和社交媒体帖子",
+    examples=[  # 可选的示例
+        {
+            "input": _CONTENT_EXAMPLE_1_INPUT,
+            "output": "# The Future of AI: 5 Trends That Will Shape 2024\n\nArtificial Intelligence continues to evolve rapidly, transforming industries and reshaping how we work..."
+        },
+        {
+            "input": _CONTENT_EXAMPLE_2_INPUT,
+            "output": "🌱 Small changes, BIG impact! Here are 3 easy sustainability tips that anyone can follow to help protect our planet..."
+        }
+    ],
+    additional_requirements="内容需要包含吸引人的标题和清晰的行动号召",
+    model_type="openai"
+)
+
+
+_NO_EXAMPLES_REQUEST = PromptRequest(
+    role="data scientists",
+    basic_requirements="进行数据分析和可视化，生成清晰的见解报告",
+    examples=[],  # 不提供示例
+    additional_requirements="报告需要包含数据来源、方法论和关键发现",
+    model_type="openai"
+)
+
+
+class DemoLogger:
+    """缓存单个演示的输出，结束时一次性写出，避免并发演示的输出交错"""
     
-    # 创建工作流
-    workflow = PromptOptimizerWorkflow()
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.buf = []
     
-    # 创建请求
-    request = PromptRequest(
-        role="software developers",
-        basic_requirements="编写高质量、可维护的Python代码，包括函数、类和API设计",
-        examples=[  # 可选的示例
-            {
-                "input": "Write a function to calculate fibonacci numbers",
-                "output": "def fibonacci(n):\n    if n <= 1:\n        return n\n    return fibonacci(n-1) + fibonacci(n-2)"
-            },
-            {
-                "input": "Create a REST API endpoint",
-                "output": "@app.route('/api/users', methods=['GET'])\ndef get_users():\n    return jsonify(users)"
-            }
-        ],
-        additional_requirements="代码需要包含详细的注释和错误处理",
-        model_type="gemini"
-    )
+    def p(self, *args):
+        self.buf.append(" ".join(map(str, args)))
     
-    print(f"目标角色: {request.role}")
-    print(f"基本要求: {request.basic_requirements}")
-    print(f"模型类型: {request.model_type.upper()}")
-    print(f"示例数量: {len(request.examples or [])}")
-    print("开始优化...")
+    def progress(self, *args):
+        """进度信息立即输出，不等待演示结束"""
+        sys.stdout.write(f"[{self.name}] " + " ".join(map(str, args)) + "\n")
+        sys.stdout.flush()
+    
+    def flush(self):
+        sys.stdout.write("\n".join(self.buf) + "\n")
+        sys.stdout.flush()
+        self.buf.clear()
+
+
+async def _run_demo(demo, workflow):
+    """运行单个演示，结束后输出其缓存的日志"""
+    log = DemoLogger(demo.__name__)
+    try:
+        await demo(workflow, log)
+    finally:
+        log.flush()
+
+
+async def _stream_optimize(workflow, request, log):
+    """流式执行优化，每个节点完成时立即输出进度，返回最终结果"""
+    result = {}
+    async for event in workflow.astream(request):
+        node = event["node"]
+        if node == "result":
+            result = event["result"]
+        elif node == "generate_prompt":
+            prompt = event["update"].get("current_prompt", "")
+            log.progress(f"✏️ 已生成初始prompt（{len(prompt)} 字符）")
+        elif node == "alternative":
+            update = event["update"]
+            log.progress(f"💡 改进方案 {update['index']} 已生成（自评 {update['self_score']}/10）")
+        else:
+            log.progress(f"✔️ {node} 完成")
+    return result
+
+
+async def _run_optimize(workflow, request, log):
+    """依次查询精确缓存和语义缓存，均未命中时在并发限制内流式执行一次prompt优化"""
+    async def compute(req):
+        async with _SEM:
+            return await _stream_optimize(workflow, req, log)
+
+    async def semantic_lookup(req):
+        return await _CACHE.get_or_compute(req, compute)
+
+    return await _EXACT_CACHE.get_or_compute(request, semantic_lookup)
+
+
+async def demo_software_development_gemini(workflow, log):
+    """演示为软件开发优化prompt - 使用Gemini模型"""
+    log.p("🔧 演示：软件开发prompt优化 - Gemini模型")
+    log.p("=" * 60)
+    
+    request = _SWDEV_GEMINI_REQUEST
+    
+    log.p(f"目标角色: {request.role}")
+    log.p(f"基本要求: {request.basic_requirements}")
+    log.p(f"模型类型: {request.model_type.upper()}")
+    log.p(f"示例数量: {len(request.examples or [])}")
+    log.p("开始优化...")
     
     try:
         # 执行优化
-        result = await workflow.optimize_prompt(request)
+        result = OptimizeResult.from_dict(await _run_optimize(workflow, request, log))
         
         # 显示结果
-        print("\n✅ 优化完成！")
-        print(f"\n📝 生成的Prompt:")
-        print("-" * 30)
-        print(result.get('generated_prompt', 'N/A'))
+        log.p("\n✅ 优化完成！")
+        log.p(f"\n📝 生成的Prompt:")
+        log.p("-" * 30)
+        log.p(result.generated_prompt or 'N/A')
         
-        print(f"\n🔍 评估结果:")
-        print("-" * 30)
-        for i, evaluation in enumerate(result.get('evaluations', []), 1):
-            print(f"评估 {i}: {evaluation[:200]}...")
+        log.p(f"\n🔍 评估结果:")
+        log.p("-" * 30)
+        log.p("\n".join(f"评估 {i}: {_trunc(evaluation, 200)}" for i, evaluation in enumerate(result.evaluations, 1)))
         
-        print(f"\n🚀 改进方案 ({len(result.get('alternative_prompts', []))}):")
-        print("-" * 30)
-        for i, alt in enumerate(result.get('alternative_prompts', []), 1):
-            print(f"方案 {i}: {alt[:100]}...")
+        log.p(f"\n🚀 改进方案 ({len(result.alternative_prompts)}):")
+        log.p("-" * 30)
+        log.p("\n".join(f"方案 {i}: {_trunc(alt, 100)}" for i, alt in enumerate(result.alternative_prompts, 1)))
         
-        print(f"\n💡 最终推荐:")
-        print("-" * 30)
-        print(result.get('final_recommendation', 'N/A')[:200] + "...")
+        log.p(f"\n💡 最终推荐:")
+        log.p("-" * 30)
+        log.p(_trunc(result.final_recommendation or 'N/A', 200))
         
     except Exception as e:
-        print(f"❌ 演示失败: {e}")
+        log.p(f"❌ 演示失败: {e}")
 
 
-async def demo_software_development_openai():
+async def demo_software_development_openai(workflow, log):
     """演示为软件开发优化prompt - 使用OpenAI模型"""
-    print("\n\n🔧 演示：软件开发prompt优化 - OpenAI模型")
-    print("=" * 60)
+    log.p("\n\n🔧 演示：软件开发prompt优化 - OpenAI模型")
+    log.p("=" * 60)
     
     # 检查OpenAI API密钥
     if not os.getenv('OPENAI_API_KEY') or os.getenv('OPENAI_API_KEY') == 'your_openai_api_key_here':
-        print("⚠️ 跳过OpenAI演示：未配置OPENAI_API_KEY")
+        log.p("⚠️ 跳过OpenAI演示：未配置OPENAI_API_KEY")
         return
     
-    # 创建工作流
-    workflow = PromptOptimizerWorkflow()
-    
-    # 创建请求
-    request = PromptRequest(
-        role="software developers",
-        basic_requirements="编写健壮、可扩展的Python代码，重点关注错误处理和文档",
-        examples=[  # 可选的示例
-            {
-                "input": json.dumps({
-                    "function_name": "validate_email",
-                    "input_type": "str",
-                    "output_type": "bool",
-                    "description": "验证邮箱地址格式"
-                }),
-                "output": "def validate_email(email: str) -> bool:\n    \"\"\"验证邮箱地址格式的有效性\n    Args:\n        email: 要验证的邮箱地址\n    Returns:\n        bool: 邮箱格式是否有效\n    \"\"\"\n    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}$'\n    return re.match(pattern, email) is not None"
-            },
-            {
-                "input": json.dumps({
-                    "class_name": "DatabaseConnection",
-                    "host": "localhost",
-                    "database": "mydb",
-                    "username": "admin"
-                }),
-                "output": "class DatabaseConnection:\n    def __init__(self, host: str = 'localhost', database: str = 'mydb', username: str = 'admin'):\n        self.host = host\n        self.database = database\n        self.username = username\n        self.connection = None"
-            }
-        ],
-        additional_requirements="代码需要包含完整的类型提示和异常处理",
-        model_type="openai"
-    )
+    request = _SWDEV_OPENAI_REQUEST
     
-    print(f"目标角色: {request.role}")
-    print(f"基本要求: {request.basic_requirements}")
-    print(f"模型类型: {request.model_type.upper()}")
-    print(f"示例数量: {len(request.examples or [])}")
-    print("开始优化...")
+    log.p(f"目标角色: {request.role}")
+    log.p(f"基本要求: {request.basic_requirements}")
+    log.p(f"模型类型: {request.model_type.upper()}")
+    log.p(f"示例数量: {len(request.examples or [])}")
+    log.p("开始优化...")
     
     try:
         # 执行优化
-        result = await workflow.optimize_prompt(request)
+        result = OptimizeResult.from_dict(await _run_optimize(workflow, request, log))
         
         # 显示结果
-        print("\n✅ 优化完成！")
-        print(f"生成的prompt长度: {len(result.get('generated_prompt', ''))} 字符")
-        print(f"生成的prompt: {result.get('generated_prompt', '')}")
-        print(f"评估数量: {len(result.get('evaluations', []))}")
-        print(f"改进方案数量: {len(result.get('alternative_prompts', []))}")
+        log.p("\n✅ 优化完成！")
+        log.p(f"生成的prompt长度: {len(result.generated_prompt)} 字符")
+        log.p(f"生成的prompt: {result.generated_prompt}")
+        log.p(f"评估数量: {len(result.evaluations)}")
+        log.p(f"改进方案数量: {len(result.alternative_prompts)}")
         
     except Exception as e:
-        print(f"❌ 演示失败: {e}")
+        log.p(f"❌ 演示失败: {e}")
 
 
-async def demo_customer_support():
+async def demo_customer_support(workflow, log):
     """演示为客服优化prompt"""
-    print("\n\n📞 演示：客服对话prompt优化 - Gemini模型")
-    print("=" * 60)
-    
-    workflow = PromptOptimizerWorkflow()
+    log.p("\n\n📞 演示：客服对话prompt优化 - Gemini模型")
+    log.p("=" * 60)
     
-    request = PromptRequest(
-        role="customer support representatives",
-        basic_requirements="提供专业、有同理心的客户服务，快速解决客户问题",
-        examples=[  # 可选的示例
-            {
-                "input": "Customer complains about delayed delivery",
-                "output": "I sincerely apologize for the delay. Let me check your order status and provide an update."
-            },
-            {
-                "input": "Customer asks for refund",
-                "output": "I understand your concern. I'd be happy to help with the refund process."
-            }
-        ],
-        additional_requirements="保持积极友好的语气，提供明确的解决方案",
-        model_type="openai"
-    )
+    request = _SUPPORT_REQUEST
     
-    print(f"目标角色: {request.role}")
-    print(f"基本要求: {request.basic_requirements}")
-    print(f"模型类型: {request.model_type.upper()}")
-    print("开始优化...")
+    log.p(f"目标角色: {request.role}")
+    log.p(f"基本要求: {request.basic_requirements}")
+    log.p(f"模型类型: {request.model_type.upper()}")
+    log.p("开始优化...")
     
     try:
-        result = await workflow.optimize_prompt(request)
-        print("✅ 客服prompt优化完成！")
-        print(f"生成的prompt长度: {len(result.get('generated_prompt', ''))} 字符")
-        print(f"评估数量: {len(result.get('evaluations', []))}")
-        print(f"改进方案数量: {len(result.get('alternative_prompts', []))}")
+        result = OptimizeResult.from_dict(await _run_optimize(workflow, request, log))
+        log.p("✅ 客服prompt优化完成！")
+        log.p(f"生成的prompt长度: {len(result.generated_prompt)} 字符")
+        log.p(f"评估数量: {len(result.evaluations)}")
+        log.p(f"改进方案数量: {len(result.alternative_prompts)}")
         
     except Exception as e:
-        print(f"❌ 演示失败: {e}")
+        log.p(f"❌ 演示失败: {e}")
 
 
-async def demo_content_creation():
+async def demo_content_creation(workflow, log):
     """演示为内容创作优化prompt"""
-    print("\n\n✍️ 演示：内容创作prompt优化 - OpenAI模型")
-    print("=" * 60)
+    log.p("\n\n✍️ 演示：内容创作prompt优化 - OpenAI模型")
+    log.p("=" * 60)
     
-    workflow = PromptOptimizerWorkflow()
-    
-    request = PromptRequest(
-        role="content creators",
-        basic_requirements="创作引人入胜、结构清晰的内容，包括博客文章和社交媒体帖子",
-        examples=[  # 可选的示例
-            {
-                "input": json.dumps({
-                    "topic": "AI trends",
-                    "target_audience": "tech professionals",
-                    "tone": "professional",
-                    "word_count": "1000"
-                }),
-                "output": "# The Future of AI: 5 Trends That Will Shape 2024\n\nArtificial Intelligence continues to evolve rapidly, transforming industries and reshaping how we work..."
-            },
-            {
-                "input": json.dumps({
-                    "topic": "sustainability",
-                    "target_audience": "general public",
-                    "tone": "casual",
-                    "word_count": "200"
-                }),
-                "output": "🌱 Small changes, BIG impact! Here are 3 easy sustainability tips that anyone can follow to help protect our planet..."
-            }
-        ],
-        additional_requirements="内容需要包含吸引人的标题和清晰的行动号召",
-        model_type="openai"
-    )
+    request = _CONTENT_REQUEST
     
-    print(f"目标角色: {request.role}")
-    print(f"基本要求: {request.basic_requirements}")
-    print(f"模型类型: {request.model_type.upper()}")
-    print("开始优化...")
+    log.p(f"目标角色: {request.role}")
+    log.p(f"基本要求: {request.basic_requirements}")
+    log.p(f"模型类型: {request.model_type.upper()}")
+    log.p("开始优化...")
     
     try:
-        result = await workflow.optimize_prompt(request)
-        print("✅ 内容创作prompt优化完成！")
+        result = OptimizeResult.from_dict(await _run_optimize(workflow, request, log))
+        log.p("✅ 内容创作prompt优化完成！")
         
         # 显示简化的结果
-        print(f"\n📊 优化结果摘要:")
-        print(f"- 模型类型: {result.get('model_type', 'unknown').upper()}")
-        print(f"- 原始示例: {len(result.get('original_examples', []))}")
-        print(f"- 生成prompt长度: {len(result.get('generated_prompt', ''))} 字符")
-        print(f"- 评估报告: {len(result.get('evaluations', []))} 份")
-        print(f"- 改进方案: {len(result.get('alternative_prompts', []))} 个")
+        log.p(f"\n📊 优化结果摘要:")
+        log.p(f"- 模型类型: {(result.model_type or 'unknown').upper()}")
+        log.p(f"- 原始示例: {len(result.original_examples)}")
+        log.p(f"- 生成prompt长度: {len(result.generated_prompt)} 字符")
+        log.p(f"- 评估报告: {len(result.evaluations)} 份")
+        log.p(f"- 改进方案: {len(result.alternative_prompts)} 个")
         
     except Exception as e:
-        print(f"❌ 演示失败: {e}")
+        log.p(f"❌ 演示失败: {e}")
 
 
-async def demo_no_examples():
+async def demo_no_examples(workflow, log):
     """演示无示例的prompt优化"""
-    print("\n\n🎯 演示：无示例的prompt优化 - OpenAI模型")
-    print("=" * 60)
+    log.p("\n\n🎯 演示：无示例的prompt优化 - OpenAI模型")
+    log.p("=" * 60)
     
     # 检查OpenAI API密钥
     if not os.getenv('OPENAI_API_KEY') or os.getenv('OPENAI_API_KEY') == 'your_openai_api_key_here':
-        print("⚠️ 跳过OpenAI演示：未配置OPENAI_API_KEY")
+        log.p("⚠️ 跳过OpenAI演示：未配置OPENAI_API_KEY")
         return
     
-    workflow = PromptOptimizerWorkflow()
-    
-    request = PromptRequest(
-        role="data scientists",
-        basic_requirements="进行数据分析和可视化，生成清晰的见解报告",
-        examples=[],  # 不提供示例
-        additional_requirements="报告需要包含数据来源、方法论和关键发现",
-        model_type="openai"
-    )
+    request = _NO_EXAMPLES_REQUEST
     
-    print(f"目标角色: {request.role}")
-    print(f"基本要求: {request.basic_requirements}")
-    print(f"模型类型: {request.model_type.upper()}")
-    print("开始优化...")
+    log.p(f"目标角色: {request.role}")
+    log.p(f"基本要求: {request.basic_requirements}")
+    log.p(f"模型类型: {request.model_type.upper()}")
+    log.p("开始优化...")
     
     try:
-        result = await workflow.optimize_prompt(request)
-        print("✅ 无示例prompt优化完成！")
+        result = OptimizeResult.from_dict(await _run_optimize(workflow, request, log))
+        log.p("✅ 无示例prompt优化完成！")
         
         # 显示简化的结果
-        print(f"\n📊 优化结果摘要:")
-        print(f"- 生成prompt长度: {len(result.get('generated_prompt', ''))} 字符")
-        print(f"- 评估报告: {len(result.get('evaluations', []))} 份")
-        print(f"- 改进方案: {len(result.get('alternative_prompts', []))} 个")
+        log.p(f"\n📊 优化结果摘要:")
+        log.p(f"- 生成prompt长度: {len(result.generated_prompt)} 字符")
+        log.p(f"- 评估报告: {len(result.evaluations)} 份")
+        log.p(f"- 改进方案: {len(result.alternative_prompts)} 个")
         
     except Exception as e:
-        print(f"❌ 演示失败: {e}")
+        log.p(f"❌ 演示失败: {e}")
 
 
 async def main():
@@ -273,12 +378,28 @@ async def main():
     print("包括软件开发、客服对话、内容创作等场景")
     print("同时演示不同模型（Gemini/OpenAI）的效果")
     
-    # 运行所有演示
-    #await demo_software_development_gemini()
-    await demo_software_development_openai()
-    await demo_customer_support()
-    await demo_content_creation()
-    await demo_no_examples()  # 新增：演示无示例的情况
+    # 并发运行所有演示，每个演示的输出先缓存，结束后整体输出
+    demos = [
+        #demo_software_development_gemini,
+        demo_software_development_openai,
+        demo_customer_support,
+        demo_content_creation,
+        demo_no_examples,  # 新增：演示无示例的情况
+    ]
+    # 所有演示共用同一个工作流实例，模型类型由各自的请求决定
+    workflow = PromptOptimizerWorkflow()
+    # 预热模型实例，避免首个演示承担初始化开销
+    await asyncio.to_thread(workflow.prewarm, ["openai"])
+    results = await asyncio.gather(
+        *(_run_demo(demo, workflow) for demo in demos),
+        return_exceptions=True
+    )
+    
+    for demo, result in zip(demos, results):
+        if isinstance(result, BaseException):
+            print(f"❌ 演示 {demo.__name__} 异常: {result}")
+    
+    await ModelFactory.aclose()
     
     print("\n🎉 演示完成！")
     print("\n📝 总结：")
@@ -289,4 +410,5 @@ async def main():
     print("5. 支持流式输出和格式化展示")
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    install_uvloop()
+    asyncio.run(main())
@@ -1,43 +1,67 @@
-import uvicorn
+from __future__ import annotations
+
 import os
+import asyncio
+import atexit
 import logging
-from typing import Optional
-
-from a2a.server.apps import A2AStarletteApplication
-from a2a.server.request_handlers import DefaultRequestHandler
-from a2a.server.tasks import InMemoryTaskStore
-from a2a.types import (
-    AgentCapabilities,
-    AgentCard,
-    AgentSkill,
-)
-from prompt_optimizer_executor import (
-    PromptOptimizerAgentExecutor,  # type: ignore[import-untyped]
+import logging.handlers
+import queue
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+
+# uvicorn、a2a和工作流等重量级依赖延迟到真正启动服务时再导入
+if TYPE_CHECKING:
+    from a2a.server.apps import A2AStarletteApplication
+    from a2a.server.tasks import TaskStore
+    from a2a.types import AgentCard
+
+# 仅在存在.env文件时加载环境变量
+if os.path.exists('.env'):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# 配置日志：文件写入交给后台线程，避免在事件循环线程上阻塞磁盘IO
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue,
+    logging.FileHandler('prompt_optimizer.log', mode='a', encoding='utf-8', delay=True)
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
-# 配置日志
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler('prompt_optimizer.log', mode='a', encoding='utf-8')
+        logging.handlers.QueueHandler(_log_queue)
     ]
 )
 logger = logging.getLogger(__name__)
 
-def check_environment() -> bool:
+@lru_cache(maxsize=1)
+def _google_key() -> Optional[str]:
+    """读取并缓存Google API密钥"""
+    return os.getenv('GOOGLE_API_KEY')
+
+@lru_cache(maxsize=1)
+def _openai_key() -> Optional[str]:
+    """读取并缓存OpenAI API密钥"""
+    return os.getenv('OPENAI_API_KEY')
+
+def _check_environment() -> bool:
     """检查环境配置是否正确"""
     try:
-        google_api_key = os.getenv('GOOGLE_API_KEY')
-        openai_api_key = os.getenv('OPENAI_API_KEY')
+        google_api_key = _google_key()
+        openai_api_key = _openai_key()
         
         # 至少需要一个API密钥
         has_google = google_api_key and google_api_key != 'your_google_api_key_here'
         has_openai = openai_api_key and openai_api_key != 'your_openai_api_key_here'
         
-        logger.info(f"Google API Key: {'✅ 已配置' if has_google else '❌ 未配置'}")
-        logger.info(f"OpenAI API Key: {'✅ 已配置' if has_openai else '❌ 未配置'}")
+        logger.info("Google API Key: %s", '✅ 已配置' if has_google else '❌ 未配置')
+        logger.info("OpenAI API Key: %s", '✅ 已配置' if has_openai else '❌ 未配置')
         
         if not (has_google or has_openai):
             logger.error("❌ 至少需要配置一个API密钥(GOOGLE_API_KEY 或 OPENAI_API_KEY)")
@@ -48,93 +72,63 @@ def check_environment() -> bool:
         http_proxy = os.getenv('HTTP_PROXY')
         
         if https_proxy or http_proxy:
-            logger.info(f"代理配置: HTTPS={https_proxy}, HTTP={http_proxy}")
+            logger.info("代理配置: HTTPS=%s, HTTP=%s", https_proxy, http_proxy)
         else:
             logger.info("未配置代理，将使用默认代理设置")
         
         return True
         
     except Exception as e:
-        logger.error(f"环境检查失败: {str(e)}")
+        logger.error("环境检查失败: %s", e)
         return False
 
-def create_agent_skills() -> tuple[AgentSkill, AgentSkill]:
-    """创建Agent技能定义"""
-    try:
-        basic_skill = AgentSkill(
-            id='prompt_optimization',
-            name='Prompt优化服务',
-            description='通过多Agent协作优化prompt，支持角色定义、基本要求和可选示例',
-            tags=['prompt engineering', 'optimization', 'multi-agent'],
-            examples=[
-                '为软件开发者优化代码生成prompt，包含基本编码规范和最佳实践',
-                '为内容创作者优化写作prompt，定义创作风格和结构要求',
-                '为数据分析师优化数据处理prompt，设定分析标准和输出格式'
-            ],
-        )
+async def check_environment() -> bool:
+    """在线程中执行环境检查，避免日志等IO阻塞事件循环"""
+    return await asyncio.to_thread(_check_environment)
 
-        advanced_skill = AgentSkill(
-            id='advanced_prompt_optimization',
-            name='高级Prompt优化服务',
-            description='提供深度定制的prompt优化服务，包含详细的角色分析、任务分解和性能评估',
-            tags=['prompt engineering', 'optimization', 'multi-agent', 'advanced', 'deep-analysis'],
-            examples=[
-                '基于详细的角色分析和任务要求进行多轮迭代优化',
-                '针对特定业务场景的深度定制，包含完整的任务分解和评估标准',
-                '结合性能指标和用户反馈的综合优化方案'
-            ],
-        )
-        
-        logger.info("Agent技能定义创建成功")
-        return basic_skill, advanced_skill
-        
-    except Exception as e:
-        logger.error(f"创建Agent技能失败: {str(e)}")
-        raise
+def _select_loop() -> str:
+    """优先使用uvloop事件循环，不可用时（如Windows）退回asyncio"""
+    try:
+        import uvloop  # noqa: F401
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
 
-def create_agent_cards(basic_skill: AgentSkill, advanced_skill: AgentSkill) -> tuple[AgentCard, AgentCard]:
-    """创建Agent卡片"""
+def _select_http() -> str:
+    """优先使用httptools解析HTTP，不可用时退回h11"""
     try:
-        # 获取服务器配置
-        host = os.getenv('SERVER_HOST', 'localhost')
-        port = int(os.getenv('SERVER_PORT', '9999'))
-        
-        public_agent_card = AgentCard(
-            name='Prompt优化器 Agent',
-            description='智能Prompt优化系统，支持角色定义、基本要求和示例，帮助用户生成高质量的prompt',
-            url=f'http://{host}:{port}/',
-            version='1.0.0',
-            defaultInputModes=['text'],
-            defaultOutputModes=['text'],
-            capabilities=AgentCapabilities(streaming=True),
-            skills=[basic_skill],
-            supportsAuthenticatedExtendedCard=True,
-        )
+        import httptools  # noqa: F401
+        return "httptools"
+    except ImportError:
+        return "h11"
 
-        # 认证扩展agent卡片 - 包含高级功能
-        extended_agent_card = public_agent_card.model_copy(
-            update={
-                'name': 'Prompt优化器 Agent - 专业版',
-                'description': '专业级Prompt优化系统，提供深度角色分析、任务分解和定制化优化服务',
-                'version': '1.1.0',
-                'skills': [basic_skill, advanced_skill],  # 包含基础和高级技能
-            }
-        )
-        
-        logger.info(f"Agent卡片创建成功: {public_agent_card.url}")
-        return public_agent_card, extended_agent_card
-        
-    except Exception as e:
-        logger.error(f"创建Agent卡片失败: {str(e)}")
-        raise
+def create_task_store() -> TaskStore:
+    """创建任务存储，配置TASK_STORE_URL时使用可在多个工作进程间共享的数据库存储"""
+    task_store_url = os.getenv('TASK_STORE_URL')
+    if not task_store_url:
+        from a2a.server.tasks import InMemoryTaskStore
+        return InMemoryTaskStore()
+    
+    # 数据库存储依赖SQLAlchemy，需要安装 a2a-sdk[sql]
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from a2a.server.tasks import DatabaseTaskStore
+    
+    logger.info("使用数据库任务存储")
+    return DatabaseTaskStore(create_async_engine(task_store_url))
 
 def create_server(public_card: AgentCard, extended_card: AgentCard) -> A2AStarletteApplication:
     """创建服务器应用"""
+    from a2a.server.apps import A2AStarletteApplication
+    from a2a.server.request_handlers import DefaultRequestHandler
+    from prompt_optimizer_executor import (
+        PromptOptimizerAgentExecutor,  # type: ignore[import-untyped]
+    )
+    
     try:
         # 创建请求处理器
         request_handler = DefaultRequestHandler(
             agent_executor=PromptOptimizerAgentExecutor(),
-            task_store=InMemoryTaskStore(),
+            task_store=create_task_store(),
         )
         
         # 创建服务器应用
@@ -148,48 +142,101 @@ def create_server(public_card: AgentCard, extended_card: AgentCard) -> A2AStarle
         return server
         
     except Exception as e:
-        logger.error(f"创建服务器失败: {str(e)}")
+        logger.error("创建服务器失败: %s", e)
         raise
 
+@asynccontextmanager
+async def lifespan(app):
+    """应用生命周期：关闭时释放模型共享的HTTP连接池"""
+    yield
+    from prompt_optimizer import ModelFactory
+    await ModelFactory.aclose()
+
+def create_app():
+    """创建ASGI应用，供uvicorn在每个工作进程中调用"""
+    from agent_cards import PUBLIC_CARD, EXTENDED_CARD
+    
+    logger.info("Agent卡片: %s", PUBLIC_CARD.url)
+    return create_server(PUBLIC_CARD, EXTENDED_CARD).build(lifespan=lifespan)
+
+async def serve(host: str, port: int, log_level: str, http: str) -> None:
+    """在同一个事件循环中并行完成环境检查和组件构建，然后启动服务"""
+    import uvicorn
+    
+    env_ok, app = await asyncio.gather(check_environment(), asyncio.to_thread(create_app))
+    if not env_ok:
+        logger.error("❌ 环境配置检查失败，服务无法启动")
+        return
+    
+    config = uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        http=http,
+        log_level=log_level,
+        timeout_keep_alive=30,
+        access_log=True
+    )
+    await uvicorn.Server(config).serve()
+
 def main():
     """主函数"""
     try:
         logger.info("🚀 启动Prompt优化器服务...")
         
-        # 检查环境配置
-        if not check_environment():
-            logger.error("❌ 环境配置检查失败，服务无法启动")
-            return
-        
-        # 创建Agent组件
-        basic_skill, advanced_skill = create_agent_skills()
-        public_card, extended_card = create_agent_cards(basic_skill, advanced_skill)
-        server = create_server(public_card, extended_card)
-        
         # 获取服务器配置
         host = os.getenv('SERVER_HOST', '0.0.0.0')
         port = int(os.getenv('SERVER_PORT', '9999'))
         log_level = os.getenv('LOG_LEVEL', 'info').lower()
-        workers = int(os.getenv('WORKERS', '1'))
+        # 内存任务存储无法在进程间共享：配置了TASK_STORE_URL时默认每个CPU一个工作进程，否则默认单进程
+        shared_store = bool(os.getenv('TASK_STORE_URL'))
+        workers = int(os.getenv('WORKERS', str((os.cpu_count() or 1) if shared_store else 1)))
+        reload = os.getenv('RELOAD', 'false').lower() == 'true'
+        
+        # 显式要求多进程但没有共享任务存储时退回单进程
+        if workers > 1 and not shared_store:
+            logger.warning("未配置TASK_STORE_URL，内存任务存储不支持多进程，工作进程数调整为1")
+            workers = 1
+        
+        loop = _select_loop()
+        http = _select_http()
+        
+        logger.info("服务器配置: host=%s, port=%s, log_level=%s, workers=%s, loop=%s, http=%s", host, port, log_level, workers, loop, http)
+        
+        # 单进程模式：在一个事件循环里完成启动
+        if workers == 1 and not reload:
+            if loop == "uvloop":
+                import uvloop
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            asyncio.run(serve(host, port, log_level, http))
+            return
+        
+        # 检查环境配置
+        if not asyncio.run(check_environment()):
+            logger.error("❌ 环境配置检查失败，服务无法启动")
+            return
         
-        logger.info(f"服务器配置: host={host}, port={port}, log_level={log_level}, workers={workers}")
+        import uvicorn
         
-        # 启动服务器
+        # 多进程或热重载模式：使用导入字符串，以便子进程中创建应用
         uvicorn.run(
-            server.build(),
+            'main:create_app',
+            factory=True,
             host=host,
             port=port,
+            loop=loop,
+            http=http,
             log_level=log_level,
             timeout_keep_alive=30,
             workers=workers,
             access_log=True,
-            reload=os.getenv('RELOAD', 'false').lower() == 'true'
+            reload=reload
         )
         
     except KeyboardInterrupt:
         logger.info("👋 服务器已手动停止")
     except Exception as e:
-        logger.error(f"❌ 服务器启动失败: {str(e)}", exc_info=True)
+        logger.error("❌ 服务器启动失败: %s", e, exc_info=True)
         raise
 
 if __name__ == '__main__':
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Prompt优化结果缓存
+对语义相近的优化请求直接复用已有结果，避免重复执行整轮多Agent调用
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 本地向量维度
+EMBEDDING_DIM = 512
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def hash_embed(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """本地轻量级文本向量：字符二元组哈希到固定维度并归一化"""
+    normalized = _WHITESPACE_RE.sub(" ", text.strip().lower())
+    vector = np.zeros(dim, dtype=np.float32)
+    if not normalized:
+        return vector
+
+    # 使用crc32而不是hash()，保证跨进程稳定，便于持久化
+    grams = [normalized[i:i + 2] for i in range(max(len(normalized) - 1, 1))]
+    for gram in grams:
+        vector[zlib.crc32(gram.encode("utf-8")) % dim] += 1.0
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def hash_embed_batch(texts: List[str]) -> np.ndarray:
+    """批量计算本地文本向量，返回(B, D)矩阵"""
+    return np.stack([hash_embed(text) for text in texts])
+
+
+def quantize(vector: np.ndarray) -> Tuple[np.ndarray, np.float32]:
+    """按向量最大绝对值缩放并量化为int8，返回(量化向量, 缩放系数)"""
+    scale = np.float32(np.max(np.abs(vector))) if vector.size else np.float32(0)
+    if not scale:
+        return np.zeros(vector.shape, dtype=np.int8), np.float32(0)
+    return np.round(vector / scale * 127).astype(np.int8), scale
+
+
+def examples_hash(examples: List[Dict[str, str]]) -> str:
+    """计算示例列表的稳定哈希"""
+    payload = json.dumps(examples or [], sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _atomic_write(path: str, mode: str, dump: Callable[[Any], None], **kwargs):
+    """写入同目录下的临时文件后原子替换目标文件，读取方不会看到写了一半的文件"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            dump(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class EmbedBatcher:
+    """将短时间窗口内到达的向量化请求合并为一次批量编码"""
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray], window: float = 0.01):
+        self._encode = encode_batch
+        self.window = window
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def embed(self, text: str) -> np.ndarray:
+        """提交单条文本，等待所在批次编码完成后返回其向量"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        return await future
+
+    async def _flush_later(self):
+        """等待窗口结束后一次性编码当前批次"""
+        await asyncio.sleep(self.window)
+        batch, self._pending = self._pending, []
+        self._flush_task = None
+
+        try:
+            vectors = self._encode([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+class SemanticCache:
+    """语义缓存：相似度超过阈值的请求直接返回已缓存的优化结果"""
+
+    def __init__(self, threshold: float = 0.95, path: Optional[str] = None,
+                 encode_batch: Callable[[List[str]], np.ndarray] = hash_embed_batch,
+                 batch_window: float = 0.01):
+        self.threshold = threshold
+        self.path = path
+        self._batcher = EmbedBatcher(encode_batch, window=batch_window)
+        # 分区键 -> (int8向量矩阵, 缩放系数, 结果列表)
+        self._entries: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]]]] = {}
+        self._save_lock = asyncio.Lock()  # 串行化写盘，后开始的保存总是写入更新的快照
+        self.load()
+
+    @staticmethod
+    def _partition_key(request) -> Tuple[str, str]:
+        """模型类型和示例必须完全一致，只对文本描述做语义匹配"""
+        return request.model_type.lower(), examples_hash(request.examples)
+
+    @staticmethod
+    def _request_text(request) -> str:
+        """拼接参与语义匹配的请求文本"""
+        return "\n".join((request.role, request.basic_requirements, request.additional_requirements))
+
+    def lookup(self, partition: Tuple[str, str], vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        """查找相似度最高且超过阈值的缓存结果"""
+        entry = self._entries.get(partition)
+        if entry is None:
+            return None
+
+        matrix, scales, results = entry
+        query, query_scale = quantize(vector)
+        # 整数点积（int32累加避免溢出）后乘回缩放系数，得到近似余弦相似度
+        dots = matrix.astype(np.int32) @ query.astype(np.int32)
+        scores = dots * (scales * (query_scale / (127 * 127)))
+        best = int(np.argmax(scores))
+        if scores[best] >= self.threshold:
+            logger.info("Semantic cache hit (similarity=%.3f)", scores[best])
+            return results[best]
+        return None
+
+    def add(self, partition: Tuple[str, str], vector: np.ndarray, result: Dict[str, Any]):
+        """添加缓存条目"""
+        quantized, scale = quantize(vector)
+        entry = self._entries.get(partition)
+        if entry is None:
+            self._entries[partition] = (quantized[np.newaxis, :], np.array([scale], dtype=np.float32), [result])
+        else:
+            matrix, scales, results = entry
+            self._entries[partition] = (
+                np.vstack((matrix, quantized)),
+                np.append(scales, np.float32(scale)),
+                results + [result]
+            )
+
+    async def get_or_compute(self, request, compute: Callable[[Any], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """命中缓存时直接返回结果，否则执行compute并缓存结果"""
+        partition = self._partition_key(request)
+        vector = await self._batcher.embed(self._request_text(request))
+
+        cached = self.lookup(partition, vector)
+        if cached is not None:
+            return cached
+
+        result = await compute(request)
+        # 有步骤因调用失败使用了占位结果时不缓存，相近的请求会重新调用模型
+        if result.get("used_fallback"):
+            logger.info("Result used fallback content, not adding to semantic cache")
+            return result
+        self.add(partition, vector, result)
+        await self.asave()
+        return result
+
+    def load(self):
+        """从磁盘加载缓存：npz中保存量化向量和缩放系数，结果及其分区以JSON保存（不使用pickle）"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                vectors = data["vectors"]
+                scales = data["scales"]
+                rows = json.loads(str(data["meta"]))
+            if len(rows) != len(vectors) or len(scales) != len(vectors):
+                raise ValueError("vector and metadata counts differ")
+
+            # 按分区收集行号，保持写入顺序
+            grouped: Dict[Tuple[str, str], List[int]] = {}
+            for i, row in enumerate(rows):
+                grouped.setdefault(tuple(row["partition"]), []).append(i)
+            self._entries = {
+                partition: (vectors[indices], scales[indices], [rows[i]["result"] for i in indices])
+                for partition, indices in grouped.items()
+            }
+            logger.info("Loaded semantic cache from %s", self.path)
+        except Exception as e:
+            logger.warning("Failed to load semantic cache: %s", e)
+            self._entries = {}
+
+    def _write(self, entries: List[Tuple[Tuple[str, str], Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]]]]]):
+        """把各分区合并为向量矩阵、缩放系数和逐行的分区及结果JSON，写入磁盘（临时文件原子替换）"""
+        try:
+            if entries:
+                vectors = np.concatenate([matrix for _, (matrix, _, _) in entries])
+                scales = np.concatenate([entry_scales for _, (_, entry_scales, _) in entries])
+            else:
+                vectors = np.zeros((0, EMBEDDING_DIM), dtype=np.int8)
+                scales = np.zeros(0, dtype=np.float32)
+            meta = json.dumps([
+                {"partition": list(partition), "result": result}
+                for partition, (_, _, results) in entries
+                for result in results
+            ], ensure_ascii=False)
+            _atomic_write(self.path, "wb", lambda f: np.savez(f, vectors=vectors, scales=scales, meta=np.array(meta)))
+        except Exception as e:
+            logger.warning("Failed to save semantic cache: %s", e)
+
+    def save(self):
+        """将缓存持久化到磁盘"""
+        if self.path:
+            self._write(list(self._entries.items()))
+
+    async def asave(self):
+        """在线程中持久化缓存，不阻塞事件循环"""
+        if not self.path:
+            return
+        async with self._save_lock:
+            # 在事件循环中取条目快照（各分区元组不会原地修改），写盘期间新增的条目留给下一次保存
+            await asyncio.to_thread(self._write, list(self._entries.items()))
+
+
+def request_key(request) -> str:
+    """计算请求规范化JSON的BLAKE2b摘要"""
+    payload = json.dumps(request.model_dump(), sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ExactCache:
+    """精确缓存：请求内容完全相同时直接读取磁盘上的优化结果，超过有效期的结果视为未命中"""
+
+    def __init__(self, directory: str = os.path.join("~", ".cache", "prompt_agent"),
+                 ttl: Optional[float] = 7 * 24 * 3600):
+        self.directory = os.path.expanduser(directory)
+        self.ttl = ttl  # 有效期（秒），None或不大于0时永不过期
+
+    def _path(self, key: str) -> str:
+        """缓存文件路径"""
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _expired(self, path: str) -> bool:
+        """缓存文件是否已超过有效期"""
+        return bool(self.ttl and self.ttl > 0 and time.time() - os.path.getmtime(path) > self.ttl)
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        """读取缓存文件，过期的文件直接删除"""
+        try:
+            if self._expired(path):
+                os.remove(path)
+                logger.info("Exact cache entry expired: %s", path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Failed to read cache file %s: %s", path, e)
+            return None
+
+    def _write(self, path: str, result: Dict[str, Any]):
+        """写入缓存文件（临时文件原子替换）"""
+        try:
+            _atomic_write(path, "w", lambda f: json.dump(result, f, ensure_ascii=False), encoding="utf-8")
+        except Exception as e:
+            logger.warning("Failed to write cache file %s: %s", path, e)
+
+    def clear(self) -> int:
+        """删除所有缓存文件，返回删除的数量"""
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        for name in os.listdir(self.directory):
+            if name.endswith((".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    removed += 1
+                except OSError as e:
+                    logger.warning("Failed to remove cache file %s: %s", name, e)
+        return removed
+
+    async def get_or_compute(self, request, compute: Callable[[Any], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """命中缓存时直接返回结果，否则执行compute并写入缓存"""
+        path = self._path(request_key(request))
+
+        # 文件读写放到线程中，避免阻塞事件循环
+        cached = await asyncio.to_thread(self._read, path)
+        if cached is not None:
+            logger.info("Exact cache hit: %s", path)
+            return cached
+
+        result = await compute(request)
+        # 有步骤因调用失败使用了占位结果时不写入，下次运行重新调用模型
+        if result.get("used_fallback"):
+            logger.info("Result used fallback content, not caching: %s", path)
+            return result
+        await asyncio.to_thread(self._write, path, result)
+        return result
@@ -1,15 +1,43 @@
+import asyncio
+import atexit
+import hashlib
 import json
+import operator
 import os
 import logging
-from typing import Dict, List, TypedDict, Annotated, Optional
-from dataclasses import dataclass, field
+import logging.handlers
+import queue
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from contextvars import ContextVar
+from functools import lru_cache, partial
+import importlib.util
+import httpx
+from typing import AsyncIterator, Callable, Dict, List, Tuple, TypedDict, Annotated, Optional
+from dataclasses import dataclass, field, fields
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END, add_messages
 from dotenv import load_dotenv
 
+# 优先使用orjson解析JSON，未安装时退回标准库json
+# （orjson.JSONDecodeError继承自json.JSONDecodeError，现有异常处理不受影响）
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 # 加载环境变量
 load_dotenv()
 
+# 布尔配置中表示"真"的取值
+_TRUTHY = frozenset(('true', '1', 'yes', 'on'))
+
 # 配置管理类
 class Config:
     """配置管理类，用于集中管理所有配置参数"""
@@ -17,8 +45,7 @@ class Config:
     @staticmethod
     def get_bool(key: str, default: bool = False) -> bool:
         """获取布尔类型配置"""
-        value = os.getenv(key, str(default)).lower()
-        return value in ('true', '1', 'yes', 'on')
+        return os.getenv(key, str(default)).lower() in _TRUTHY
     
     @staticmethod
     def get_int(key: str, default: int) -> int:
@@ -50,6 +77,8 @@ class Config:
     # Web界面配置
     WEB_HOST = get_str("WEB_HOST", "0.0.0.0")
     WEB_PORT = get_int("WEB_PORT", 7860)
+    WEB_CONCURRENCY_LIMIT = get_int("WEB_CONCURRENCY_LIMIT", 16)  # 每个事件同时处理的请求数，模型调用均为异步IO
+    WEB_QUEUE_MAX_SIZE = get_int("WEB_QUEUE_MAX_SIZE", 64)  # 排队等待的请求上限，超出时直接提示繁忙
     
     # 日志配置
     LOG_LEVEL = get_str("LOG_LEVEL", "info").upper()
@@ -59,6 +88,8 @@ class Config:
     # 代理配置
     ENABLE_DEFAULT_PROXY = get_bool("ENABLE_DEFAULT_PROXY", True)
     DEFAULT_PROXY = "http://127.0.0.1:7890"
+    HTTPS_PROXY = get_str("HTTPS_PROXY", "").strip()
+    HTTP_PROXY = get_str("HTTP_PROXY", "").strip()
     
     # 模型配置
     DEFAULT_MODEL_TYPE = get_str("DEFAULT_MODEL_TYPE", "openai")
@@ -66,25 +97,103 @@ class Config:
     REQUEST_TIMEOUT = get_int("REQUEST_TIMEOUT", 60)
     MAX_RETRIES = get_int("MAX_RETRIES", 3)
     
+    # 输出token上限：模型默认值，以及各类调用的单独预算（解码时间与输出长度成正比）
+    MAX_OUTPUT_TOKENS = get_int("MAX_OUTPUT_TOKENS", 1024)
+    GUIDE_MAX_TOKENS = get_int("GUIDE_MAX_TOKENS", 512)
+    EVALUATION_MAX_TOKENS = get_int("EVALUATION_MAX_TOKENS", 800)
+    IMPROVEMENT_MAX_TOKENS = get_int("IMPROVEMENT_MAX_TOKENS", 1200)
+    BATCHED_MAX_TOKENS = get_int("BATCHED_MAX_TOKENS", 2048)
+    
+    # 评估得分达到该值时跳过改进步骤（满分10分）
+    SKIP_IMPROVEMENT_SCORE = get_float("SKIP_IMPROVEMENT_SCORE", 9.0)
+    
+    # 是否把生成、评估、改进合并为一次JSON输出请求（失败时退回多次调用）
+    ENABLE_BATCHED_JSON = get_bool("ENABLE_BATCHED_JSON", False)
+    # 是否在评估的同时按通用评分标准生成改进方案（节省一轮往返，但高分时改进请求会被浪费）
+    ENABLE_SPECULATIVE_IMPROVEMENT = get_bool("ENABLE_SPECULATIVE_IMPROVEMENT", False)
+    
+    # LLM响应缓存配置
+    ENABLE_LLM_CACHE = get_bool("ENABLE_LLM_CACHE", True)
+    LLM_CACHE_SIZE = get_int("LLM_CACHE_SIZE", 256)
+    
+    # HTTP连接池配置
+    HTTP_MAX_CONNECTIONS = get_int("HTTP_MAX_CONNECTIONS", 100)
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = get_int("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+    HTTP_KEEPALIVE_EXPIRY = get_float("HTTP_KEEPALIVE_EXPIRY", 30.0)
+    
     # API配置
     GOOGLE_API_KEY = get_str("GOOGLE_API_KEY", "")
     OPENAI_API_KEY = get_str("OPENAI_API_KEY", "")
 
-# 配置日志
+# 配置日志：请求路径上只把记录放入队列，由后台线程写控制台和文件
 logger = logging.getLogger(__name__)
-if not logger.handlers:  # 避免重复添加处理器
+if not logger.handlers:  # 避免重复添加处理器（热重载时logger对象会保留）
     logger.setLevel(getattr(logging, Config.LOG_LEVEL))
     handlers = [logging.StreamHandler()]
     if Config.LOG_FILE_PATH:
-        handlers.append(logging.FileHandler(Config.LOG_FILE_PATH, encoding='utf-8'))
+        handlers.append(logging.FileHandler(Config.LOG_FILE_PATH, encoding='utf-8', delay=True))
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     for handler in handlers:
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         handler.setFormatter(formatter)
-        logger.addHandler(handler)
+    
+    _log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(_log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(_log_queue))
     
     if Config.VERBOSE_LOGGING:
         logger.setLevel(logging.DEBUG)
 
+# 响应解析用的正则，模块加载时编译一次
+# 评估结果中的得分，如 "Overall Score: 8/10"
+_SCORE_RE = re.compile(r'[Ss]core[^\n]*?(\d+(?:\.\d+)?)\s*/\s*10')
+# 改进方案标题行（如 "ALTERNATIVE 1: ..."），以及需要跳过的Focus说明行和空行
+_ALT_RE = re.compile(r'^[^\n]*ALTERNATIVE[^\n]*:[^\n]*$', re.M)
+_ALT_SKIP_LINE_RE = re.compile(r'^[ \t]*(?:\[Focus:[^\n]*\])?[ \t]*(?:\n|$)', re.M)
+# 自评得分中的数字
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
+@lru_cache(maxsize=128)
+def _split_alternatives(response: str) -> Tuple[str, ...]:
+    """以ALTERNATIVE标题行切分，再去掉Focus说明行和空行；重试时相同响应直接命中缓存"""
+    alternatives = []
+    for chunk in _ALT_RE.split(response)[1:]:
+        alt_text = _ALT_SKIP_LINE_RE.sub('', chunk).strip()
+        if alt_text:  # 确保内容不为空
+            alternatives.append(alt_text)
+    return tuple(alternatives)
+
+def _content(message) -> str:
+    """取出模型响应的文本内容，兼容返回内容块列表的模型"""
+    content = getattr(message, "content", None)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part if isinstance(part, str) else part.get("text", "")
+            for part in content if isinstance(part, (str, dict))
+        )
+    return str(message)
+
+
+def _stream_writer():
+    """获取LangGraph自定义流写入器，不在图运行中（如直接调用节点方法）时返回空操作"""
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda chunk: None
+
+
+# 生成prompt时逐块接收模型输出的回调，供直接调用节点的调用方（如Web界面）实时展示；未设置时不推送
+prompt_delta_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar("prompt_delta_sink", default=None)
+
+
+def _last_value(current: str, new: str) -> str:
+    """并行节点同时写入同一字段时保留最后写入的值"""
+    return new
+
+
 # 状态管理
 class PromptOptimizerState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
@@ -95,23 +204,210 @@ class PromptOptimizerState(TypedDict):
     evaluations: List[str]
     alternative_prompts: List[str]
     final_prompt: str
-    step: str  # 当前处理步骤
+    step: Annotated[str, _last_value]  # 当前处理步骤（并行节点会同时写入）
     model_type: str  # 模型类型
+    examples_inputs: Tuple[str, ...]  # 校验后的示例输入，与examples_outputs按下标对应
+    examples_outputs: Tuple[str, ...]  # 校验后的示例输出
+    examples_text: str  # 格式化后的示例文本，评估和改进共用
+    example_variables: Tuple[str, ...]  # 示例input中的变量名（已排序），验证时解析一次
+    score: float  # 评估得分（1-10），未解析到时为0
+    alt_scores: List[float]  # 与alternative_prompts一一对应的自评得分
+    used_fallback: Annotated[bool, operator.or_]  # 是否有步骤因调用失败使用了占位结果（此类结果不应缓存）
 
 
-@dataclass
-class PromptRequest:
+class PromptRequest(BaseModel):
+    model_config = ConfigDict(frozen=True)  # 创建后不可修改
+    
     role: str
     basic_requirements: str  # 新增基本要求字段
-    examples: List[Dict[str, str]] = field(default_factory=list)  # 默认为空列表
+    examples: List[Dict[str, str]] = Field(default_factory=list)  # 默认为空列表
     additional_requirements: str = ""  # 保持可选
     model_type: str = "openai"  # 默认使用openai
+    
+    @field_validator("role", "basic_requirements")
+    @classmethod
+    def _not_blank(cls, value: str, info) -> str:
+        """角色和基本要求不能为空"""
+        if not value.strip():
+            raise ValueError(f"{info.field_name} cannot be empty")
+        return value
+    
+    @field_validator("examples")
+    @classmethod
+    def _examples_complete(cls, examples: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """每个示例都必须包含input和output"""
+        for i, example in enumerate(examples):
+            if 'input' not in example or 'output' not in example:
+                raise ValueError(f"Example {i+1} must have 'input' and 'output' keys")
+        return examples
+
+
+@dataclass(slots=True)
+class OptimizeResult:
+    """优化结果，提供类型化的字段访问"""
+    role: str = ""
+    model_type: str = ""
+    original_examples: List[Dict[str, str]] = field(default_factory=list)
+    generated_prompt: str = ""
+    evaluations: List[str] = field(default_factory=list)
+    alternative_prompts: List[str] = field(default_factory=list)
+    final_recommendation: str = ""
+    step: str = ""
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "OptimizeResult":
+        """由optimize_prompt返回的字典构建"""
+        return cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+
+
+class CachedModel:
+    """模型调用缓存包装器，相同的prompt直接返回缓存的响应（LRU淘汰），并合并并发的相同请求"""
+    
+    def __init__(self, model, maxsize: int = 256):
+        self._model = model
+        self._maxsize = maxsize
+        self._cache: "OrderedDict[bytes, BaseMessage]" = OrderedDict()
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+    
+    @staticmethod
+    def _cache_key(messages: List[BaseMessage], kwargs: Dict) -> bytes:
+        """对消息内容和调用参数计算SHA-256作为缓存键"""
+        digest = hashlib.sha256()
+        for message in messages:
+            digest.update(str(message.content).encode("utf-8"))
+            digest.update(b"\x00")
+        if kwargs:
+            digest.update(repr(sorted(kwargs.items())).encode("utf-8"))
+        return digest.digest()
+    
+    def _lookup(self, key: bytes) -> Optional[BaseMessage]:
+        """查找缓存，命中时更新LRU顺序"""
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            logger.debug("LLM cache hit")
+        return cached
+    
+    def _store(self, key: bytes, response: BaseMessage):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        self._cache[key] = response
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+    
+    def _on_inflight_done(self, key: bytes, task: asyncio.Future):
+        """进行中的请求完成：移出等待表，成功时写入缓存"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
+    
+    async def ainvoke(self, messages: List[BaseMessage], **kwargs) -> BaseMessage:
+        """命中缓存时直接返回；相同请求正在进行时等待同一结果；否则调用模型并缓存响应"""
+        key = self._cache_key(messages, kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._model.ainvoke(messages, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(partial(self._on_inflight_done, key))
+        else:
+            logger.debug("LLM request joined an in-flight call")
+        # shield：某个调用方被取消时不影响其他等待同一请求的调用方
+        return await asyncio.shield(task)
+    
+    async def astream(self, messages: List[BaseMessage], **kwargs) -> AsyncIterator[BaseMessage]:
+        """流式调用：命中缓存时一次性返回，否则边转发边累积，正常结束或调用方提前停止时写入缓存"""
+        key = self._cache_key(messages, kwargs)
+        cached = self._lookup(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        text = ""
+        try:
+            async for chunk in self._model.astream(messages, **kwargs):
+                text += _content(chunk)
+                yield chunk
+        except GeneratorExit:
+            # 调用方主动关闭（aclose）时已拿到所需内容，截断后的响应同样可直接复用；
+            # 上游抛出的异常直接传出，不缓存不完整的响应，重试时重新调用模型
+            if text:
+                self._store(key, AIMessage(content=text))
+            raise
+        self._store(key, AIMessage(content=text))
+    
+    def clear(self):
+        """清空缓存"""
+        self._cache.clear()
+    
+    def __getattr__(self, name):
+        # 其余属性和方法直接转发给被包装的模型
+        return getattr(self._model, name)
+
+
+def install_uvloop() -> bool:
+    """使用uvloop（Windows上为winloop）作为事件循环，需在asyncio.run之前调用；未安装时保持默认并返回False"""
+    try:
+        import uvloop as loop_impl
+    except ImportError:
+        try:
+            import winloop as loop_impl
+        except ImportError:
+            return False
+    asyncio.set_event_loop_policy(loop_impl.EventLoopPolicy())
+    return True
+
+
+# 各模型单次调用时设置输出上限的参数名
+_MAX_TOKENS_PARAM = {"openai": "max_tokens", "gemini": "max_output_tokens"}
+
+
+# 上次设置代理环境变量时使用的配置，配置不变时不再重复设置
+_proxy_fingerprint: Optional[Tuple[str, str, bool]] = None
 
 
 class ModelFactory:
     """模型工厂类，用于创建不同类型的模型，支持代理配置"""
     
-    _model_instances = {}  # 缓存模型实例以提高性能
+    # 缓存模型实例以提高性能；弱引用缓存，不再被任何Agent使用的模型会被自动回收
+    _model_instances: "weakref.WeakValueDictionary[str, object]" = weakref.WeakValueDictionary()
+    _lock = threading.Lock()  # 保护模型实例的创建，避免并发时重复构建
+    _http_async_client: Optional[httpx.AsyncClient] = None  # 进程级共享的HTTP连接池
+    
+    @classmethod
+    def get_http_async_client(cls) -> httpx.AsyncClient:
+        """获取共享的httpx异步客户端，所有模型请求复用同一连接池（安装h2时启用HTTP/2）"""
+        if cls._http_async_client is None:
+            cls._http_async_client = httpx.AsyncClient(
+                **cls._http_pool_args(),
+                timeout=httpx.Timeout(Config.REQUEST_TIMEOUT, connect=5.0),
+                follow_redirects=True
+            )
+        return cls._http_async_client
+    
+    @staticmethod
+    def _http_pool_args() -> Dict:
+        """连接池参数：长连接上限，安装h2时启用HTTP/2多路复用"""
+        return {
+            "http2": importlib.util.find_spec("h2") is not None,
+            "limits": httpx.Limits(
+                max_connections=Config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+            )
+        }
+    
+    @classmethod
+    async def aclose(cls):
+        """关闭共享的HTTP连接池，并清除持有该连接池的模型实例，之后创建的模型使用新的连接池"""
+        with cls._lock:
+            cls._model_instances.clear()
+        if cls._http_async_client is not None:
+            await cls._http_async_client.aclose()
+            cls._http_async_client = None
     
     @staticmethod
     def create_model(model_type: str = None):
@@ -119,42 +415,68 @@ class ModelFactory:
         # 如果未指定模型类型，使用默认配置
         model_type = model_type or Config.DEFAULT_MODEL_TYPE
         
-        # 使用缓存避免重复创建模型实例
-        cache_key = f"{model_type.lower()}"
-        if cache_key in ModelFactory._model_instances:
-            return ModelFactory._model_instances[cache_key]
-        
-        # 设置代理环境变量
-        ModelFactory._setup_proxy()
+        # 使用缓存避免重复创建模型实例（命中时不加锁）
+        cache_key = ModelFactory._cache_key(model_type)
+        model = ModelFactory._model_instances.get(cache_key)
+        if model is not None:
+            return model
         
-        try:
-            if model_type.lower() == "openai":
-                model = ModelFactory._create_openai_model()
-            elif model_type.lower() == "gemini":
-                model = ModelFactory._create_gemini_model()
-            else:
-                raise ValueError(f"Unsupported model type: {model_type}. Supported types: openai, gemini")
+        with ModelFactory._lock:
+            # 双重检查：等待锁期间其他调用方可能已经创建完成
+            model = ModelFactory._model_instances.get(cache_key)
+            if model is not None:
+                return model
             
-            # 缓存模型实例
-            ModelFactory._model_instances[cache_key] = model
-            return model
+            # 设置代理环境变量
+            ModelFactory._setup_proxy()
             
-        except Exception as e:
-            raise RuntimeError(f"Failed to create {model_type} model: {str(e)}")
+            try:
+                if model_type.lower() == "openai":
+                    model = ModelFactory._create_openai_model()
+                elif model_type.lower() == "gemini":
+                    model = ModelFactory._create_gemini_model()
+                else:
+                    raise ValueError(f"Unsupported model type: {model_type}. Supported types: openai, gemini")
+                
+                # 包装响应缓存，所有Agent共享
+                if Config.ENABLE_LLM_CACHE:
+                    model = CachedModel(model, maxsize=Config.LLM_CACHE_SIZE)
+                
+                # 缓存模型实例
+                ModelFactory._model_instances[cache_key] = model
+                return model
+                
+            except Exception as e:
+                raise RuntimeError(f"Failed to create {model_type} model: {str(e)}")
+    
+    @staticmethod
+    def _cache_key(model_type: str) -> str:
+        """模型实例缓存键：包含构建模型时使用的配置，配置变化后不会拿到旧实例"""
+        model_type = model_type.lower()
+        api_key = Config.OPENAI_API_KEY if model_type == "openai" else Config.GOOGLE_API_KEY
+        fingerprint = (f"{model_type}|{Config.MODEL_TEMPERATURE}|{Config.REQUEST_TIMEOUT}|"
+                       f"{Config.MAX_RETRIES}|{Config.MAX_OUTPUT_TOKENS}|{api_key}")
+        return hashlib.blake2b(fingerprint.encode("utf-8"), digest_size=8).hexdigest()
     
     @staticmethod
     def _setup_proxy():
-        """设置代理配置"""
+        """设置代理配置（代理配置不变时直接返回）"""
+        global _proxy_fingerprint
+        fingerprint = (Config.HTTPS_PROXY, Config.HTTP_PROXY, Config.ENABLE_DEFAULT_PROXY)
+        if fingerprint == _proxy_fingerprint:
+            return
+        _proxy_fingerprint = fingerprint
+        
         try:
-            # 从环境变量获取代理设置
-            https_proxy = os.getenv("HTTPS_PROXY", "").strip()
-            http_proxy = os.getenv("HTTP_PROXY", "").strip()
+            # 使用启动时读取的代理设置
+            https_proxy = Config.HTTPS_PROXY
+            http_proxy = Config.HTTP_PROXY
             
             # 检查是否需要设置默认代理
             if not https_proxy and not http_proxy:
                 if Config.ENABLE_DEFAULT_PROXY:
                     https_proxy = http_proxy = Config.DEFAULT_PROXY
-                    logger.info(f"使用默认代理配置: {Config.DEFAULT_PROXY}")
+                    logger.info("使用默认代理配置: %s", Config.DEFAULT_PROXY)
                 else:
                     logger.info("未启用代理")
                     return
@@ -162,14 +484,16 @@ class ModelFactory:
             # 设置代理环境变量
             if https_proxy:
                 os.environ["HTTPS_PROXY"] = os.environ["https_proxy"] = https_proxy
-                logger.debug(f"设置HTTPS代理: {https_proxy}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("设置HTTPS代理: %s", https_proxy)
             
             if http_proxy:
                 os.environ["HTTP_PROXY"] = os.environ["http_proxy"] = http_proxy
-                logger.debug(f"设置HTTP代理: {http_proxy}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("设置HTTP代理: %s", http_proxy)
                 
         except Exception as e:
-            logger.warning(f"设置代理时出错: {str(e)}")
+            logger.warning("设置代理时出错: %s", e)
             # 出错时清除所有代理设置
             for key in ["HTTPS_PROXY", "HTTP_PROXY", "https_proxy", "http_proxy"]:
                 os.environ.pop(key, None)
@@ -189,7 +513,9 @@ class ModelFactory:
                 api_key=api_key,
                 temperature=Config.MODEL_TEMPERATURE,
                 timeout=Config.REQUEST_TIMEOUT,
-                max_retries=Config.MAX_RETRIES
+                max_retries=Config.MAX_RETRIES,
+                max_tokens=Config.MAX_OUTPUT_TOKENS,
+                http_async_client=ModelFactory.get_http_async_client()
             )
         except ImportError:
             raise ImportError("Please install langchain-openai: pip install langchain-openai")
@@ -206,12 +532,20 @@ class ModelFactory:
             if not api_key:
                 raise ValueError("GOOGLE_API_KEY environment variable is required")
                 
+            kwargs = {}
+            # google-genai在模型实例内部持有httpx客户端，通过client_args配置连接池；
+            # 安装aiohttp时它会改用aiohttp，这些httpx参数不适用
+            if "client_args" in ChatGoogleGenerativeAI.model_fields and importlib.util.find_spec("aiohttp") is None:
+                kwargs["client_args"] = ModelFactory._http_pool_args()
+                
             return ChatGoogleGenerativeAI(
                 model="gemini-2.0-flash-exp",
                 google_api_key=api_key,
                 temperature=Config.MODEL_TEMPERATURE,
                 timeout=Config.REQUEST_TIMEOUT,
-                max_retries=Config.MAX_RETRIES
+                max_retries=Config.MAX_RETRIES,
+                max_output_tokens=Config.MAX_OUTPUT_TOKENS,
+                **kwargs
             )
         except ImportError:
             raise ImportError("Please install langchain-google-genai: pip install langchain-google-genai")
@@ -221,40 +555,251 @@ class ModelFactory:
     @classmethod
     def clear_cache(cls):
         """清除模型实例缓存"""
-        cls._model_instances.clear()
+        with cls._lock:
+            cls._model_instances.clear()
 
 
-class PromptGeneratorAgent:
-    """Prompt生成器Agent - 负责生成初始prompt工程指导和prompt"""
+# PROMPT:段落之后的段落标记，prompt内容截止到其中最先出现的一个
+_PROMPT_SECTION_END_MARKERS = ('ADDITIONAL_EXAMPLES:', 'DESIGN_PRINCIPLES:')
+
+
+async def _stream_prompt_section(model, messages: List[BaseMessage], end_markers: tuple) -> AIMessage:
+    """流式读取响应，PROMPT:段落之后一出现结束标记就停止读取，后续段落不再等待"""
+    # 设置了prompt_delta_sink时只推送PROMPT:段落本身，与_extract_prompt_from_response提取的内容一致
+    marker_len = max(len(marker) for marker in end_markers + _PROMPT_SECTION_END_MARKERS)
+    sink = prompt_delta_sink.get()
+    text = ""
+    section_start = -1  # PROMPT:之后内容的起始位置
+    section_end = -1  # PROMPT段落之后第一个段落标记的位置
+    sent = 0  # 已推送给sink的位置
+    stream = model.astream(messages)
+    try:
+        async for chunk in stream:
+            # 只在新到达的内容附近查找标记，避免每个chunk都重新扫描整个缓冲区
+            scan_from = max(len(text) - marker_len, 0)
+            text += _content(chunk)
+            if section_start < 0:
+                prompt_start = text.find('PROMPT:')
+                if prompt_start < 0:
+                    continue
+                section_start = sent = prompt_start + len('PROMPT:')
+            scan_from = max(scan_from, section_start)
+            if section_end < 0:
+                found = [index for index in (text.find(marker, scan_from) for marker in _PROMPT_SECTION_END_MARKERS)
+                         if index >= 0]
+                if found:
+                    section_end = min(found)
+            if sink is not None:
+                # 末尾可能是段落标记的前半部分，段落未结束时暂不推送
+                limit = section_end if section_end >= 0 else len(text) - marker_len + 1
+                if limit > sent:
+                    sink(text[sent:limit])
+                    sent = limit
+            if any(text.find(marker, scan_from) >= 0 for marker in end_markers):
+                break
+    finally:
+        # 主动关闭流，不再接收（和计费）后续不需要的token
+        await stream.aclose()
+    # 响应正常结束时推送暂缓的结尾
+    if sink is not None and section_start >= 0:
+        limit = section_end if section_end >= 0 else len(text)
+        if limit > sent:
+            sink(text[sent:limit])
+    return AIMessage(content=text)
+
+
+# Prompt模板：模块加载时创建一次，调用时只做str.format填充
+# prompt工程指导
+_GUIDE_TPL = """
+Generate a detailed prompt engineering guide. The audience is {role}.
+
+Include best practices, common patterns, and specific techniques that work well for {role}.
+Focus on clarity, specificity, and effectiveness for this particular audience.
+
+Provide the guide in a structured format with examples.
+"""
+
+# 无示例时的基础prompt生成
+_BASIC_PROMPT_TPL = """
+Generate a prompt for {role}.
+
+Basic requirements: {basic_requirements}
+
+The prompt should be:
+1. Clear and specific for {role}
+2. Follow the basic requirements
+3. Easy to understand and use
+
+Format your response as:
+
+PROMPT:
+[Your generated prompt here]
+
+DESIGN_PRINCIPLES:
+[Brief explanation of the prompt design]
+"""
+
+# 根据示例生成prompt
+_EXAMPLES_PROMPT_TPL = """
+Based on these {example_count} examples, generate a prompt that uses the following variables: {variables}.
+The prompt should be designed to generate outputs similar to the examples when the variables are provided.
+
+Examples:
+{examples_text}
+
+The target audience is {role}.
+Basic requirements: {basic_requirements}
+
+Generate a prompt that:
+1. Uses ALL the identified variables in curly braces (e.g. {{variable_name}})
+2. Produces outputs similar to the examples when variables are provided
+3. Is clear and specific for {role}
+4. Follows the basic requirements
+
+Format your response as:
+
+PROMPT:
+[Your generated prompt here, using variables in curly braces]
+
+ADDITIONAL_EXAMPLES:
+[New examples with variable values and expected outputs]
+
+DESIGN_PRINCIPLES:
+[Brief explanation of how the variables are used]
+"""
+
+# prompt评估指导
+_EVAL_GUIDE_TPL = """
+Generate a detailed prompt evaluation guide. The audience is {role}.
+
+Include criteria for evaluating prompts specifically for {role}, such as:
+- Clarity and specificity
+- Effectiveness for the target use case
+- Potential edge cases
+- Performance considerations
+- Maintainability and scalability
+
+Provide a structured evaluation framework.
+"""
+
+# prompt评估
+_EVALUATION_TPL = """
+Evaluate this prompt for {role}:
+
+PROMPT TO EVALUATE:
+{current_prompt}
+
+ORIGINAL EXAMPLES IT SHOULD HANDLE:
+{examples_text}
+
+Provide a detailed evaluation including:
+1. Strengths of the current prompt
+2. Potential weaknesses or limitations
+3. How well it addresses the target audience ({role})
+4. Specific areas for improvement
+5. Overall score (1-10) with justification
+
+Be thorough and constructive in your evaluation.
+"""
+
+# 单个方向的改进方案
+_IMPROVEMENT_TPL = """
+Based on the evaluation, generate an improved alternative prompt for {role}, focusing on {focus}.
+
+CURRENT PROMPT:
+{current_prompt}
+
+EVALUATION FEEDBACK:
+{evaluation}
+
+ORIGINAL EXAMPLES TO HANDLE:
+{examples_text}
+
+Generate an improved version that addresses the identified weaknesses while maintaining the strengths. It should:
+1. Be specifically tailored for {role}
+2. Address the feedback from the evaluation
+3. Maintain or improve upon the original prompt's capabilities
+4. Have {focus} as its clear improvement focus
+
+Format as:
+
+ALTERNATIVE {index}: [Focus: {focus}]
+[Improved prompt]
+
+SELF_SCORE: [Your score for the improved prompt, as N/10]
+"""
+
+# 推测执行时评估尚未完成，改进请求改用通用评分标准代替评估反馈
+_IMPROVEMENT_RUBRIC = (
+    "No evaluation is available yet. Assess the prompt yourself against these criteria: "
+    "clarity, specificity, completeness, structure, and effectiveness for the role."
+)
+
+# 生成、评估、改进合并为一次请求，要求输出JSON
+_BATCHED_TPL = """
+You are optimizing a prompt for {role}.
+
+Basic requirements: {basic_requirements}
+
+Examples (variables and expected outputs):
+{examples_text}
+
+Variables the prompt must use in curly braces (e.g. {{variable_name}}): {variables}
+
+Complete all three steps in one response:
+1. Write a clear, specific prompt for {role} that follows the basic requirements and would produce outputs similar to the examples.
+2. Evaluate that prompt: strengths, weaknesses, how well it fits {role}, and specific areas for improvement, with an overall score from 1 to 10.
+3. Write one improved alternative for each focus: {focuses}. Each alternative should address the evaluation. Score each alternative from 1 to 10.
+
+Respond with a single JSON object only, in this shape:
+{{"prompt": "...", "evaluation": "...", "score": 7, "alternatives": [{{"focus": "clarity", "prompt": "...", "score": 8}}]}}
+"""
+
+
+def _format_examples(inputs: Tuple[str, ...], outputs: Tuple[str, ...]) -> str:
+    """格式化示例（示例已在构建初始状态时校验，每个工作流只格式化一次）"""
+    if not inputs:
+        return "No examples provided"
+    return "\n\n".join(f"Input: {i}\nOutput: {o}" for i, o in zip(inputs, outputs))
+
+
+class BaseAgent:
+    """Agent基类，模型类型在构造时确定；未传入模型时在首次使用时创建，之后不再改变"""
+    
+    __slots__ = ("model", "model_type")
+    
+    def __init__(self, model=None, model_type: Optional[str] = None):
+        self.model = model
+        self.model_type = model_type or Config.DEFAULT_MODEL_TYPE
+    
+    def _ensure_model(self):
+        """确保model已经初始化"""
+        if self.model is None:
+            self.model = ModelFactory.create_model(self.model_type)
     
-    def __init__(self):
-        self.model = None
+    def _output_limit(self, max_tokens: int) -> Dict:
+        """单次调用的输出token上限参数"""
+        return {_MAX_TOKENS_PARAM.get(self.model_type.lower(), "max_tokens"): max_tokens}
+
+
+class PromptGeneratorAgent(BaseAgent):
+    """Prompt生成器Agent - 负责生成初始prompt工程指导和prompt"""
     
-    def _ensure_model(self, model_type: str):
-        """确保model已经初始化，并且类型正确"""
-        if not self.model or self.model_type != model_type:
-            self.model_type = model_type
-            self.model = ModelFactory.create_model(model_type)
+    __slots__ = ()
     
     async def generate_prompt_engineering_guide(self, state: PromptOptimizerState) -> Dict:
         """生成针对特定角色的prompt工程指导"""
         if not state.get('role'):
             raise ValueError("Role is required for generating prompt engineering guide")
             
-        # 确保使用正确的模型类型
-        self._ensure_model(state['model_type'])
+        self._ensure_model()
             
-        guide_prompt = f"""
-        Generate a detailed prompt engineering guide. The audience is {state['role']}.
-        
-        Include best practices, common patterns, and specific techniques that work well for {state['role']}.
-        Focus on clarity, specificity, and effectiveness for this particular audience.
-        
-        Provide the guide in a structured format with examples.
-        """
+        guide_prompt = _GUIDE_TPL.format(role=state['role'])
         
         try:
-            response = await self.model.ainvoke([HumanMessage(content=guide_prompt)])
+            response = await self.model.ainvoke(
+                [HumanMessage(content=guide_prompt)], **self._output_limit(Config.GUIDE_MAX_TOKENS)
+            )
             return {
                 "messages": [response],
                 "step": "guide_generated"
@@ -264,30 +809,25 @@ class PromptGeneratorAgent:
     
     async def generate_prompt_from_examples(self, state: PromptOptimizerState) -> Dict:
         """根据示例生成能产生这些输出的prompt"""
+        self._ensure_model()
+        
+        role = state['role']
+        basic_requirements = state.get('basic_requirements', '')
+        inputs = state.get('examples_inputs', ())
+        outputs = state.get('examples_outputs', ())
+        
         # 如果没有示例，生成基本的prompt
-        if not state.get('examples'):
-            basic_prompt = f"""
-            Generate a prompt for {state['role']}.
-            
-            Basic requirements: {state.get('basic_requirements', '')}
-            
-            The prompt should be:
-            1. Clear and specific for {state['role']}
-            2. Follow the basic requirements
-            3. Easy to understand and use
-            
-            Format your response as:
-            
-            PROMPT:
-            [Your generated prompt here]
-            
-            DESIGN_PRINCIPLES:
-            [Brief explanation of the prompt design]
-            """
+        if not inputs:
+            basic_prompt = _BASIC_PROMPT_TPL.format(
+                role=role,
+                basic_requirements=basic_requirements
+            )
             
             try:
-                response = await self.model.ainvoke([HumanMessage(content=basic_prompt)])
-                prompt_content = response.content if hasattr(response, 'content') else str(response)
+                response = await _stream_prompt_section(
+                    self.model, [HumanMessage(content=basic_prompt)], ('DESIGN_PRINCIPLES:',)
+                )
+                prompt_content = response.content
                 current_prompt = self._extract_prompt_from_response(prompt_content)
                 
                 return {
@@ -298,57 +838,31 @@ class PromptGeneratorAgent:
             except Exception as e:
                 raise RuntimeError(f"Failed to generate basic prompt: {str(e)}")
             
-        # 提取所有变量名
-        all_variables = set()
-        for example in state['examples']:
-            if isinstance(example, dict) and 'input' in example:
-                try:
-                    variables = json.loads(example['input'])
-                    all_variables.update(variables.keys())
-                except json.JSONDecodeError:
-                    raise ValueError(f"Example input must be a valid JSON object: {example['input']}")
+        # 变量名已在构建初始状态时解析
+        all_variables = state.get('example_variables', ())
         
         # 格式化示例文本
-        examples_text = "\n\n".join([
-            f"Example {i+1}:\nVariables: {ex.get('input', '')}\nOutput: {ex.get('output', '')}"
-            for i, ex in enumerate(state['examples']) if isinstance(ex, dict)
-        ])
-        
-        if not examples_text.strip():
-            raise ValueError("Valid examples with 'input' and 'output' keys are required")
+        examples_text = "\n\n".join(
+            f"Example {i}:\nVariables: {input_text}\nOutput: {output_text}"
+            for i, (input_text, output_text) in enumerate(zip(inputs, outputs), 1)
+        )
         
         # 构建生成提示
-        generation_prompt = f"""
-        Based on these {len(state['examples'])} examples, generate a prompt that uses the following variables: {', '.join(sorted(all_variables))}.
-        The prompt should be designed to generate outputs similar to the examples when the variables are provided.
-
-        Examples:
-        {examples_text}
-
-        The target audience is {state['role']}.
-        Basic requirements: {state.get('basic_requirements', '')}
-
-        Generate a prompt that:
-        1. Uses ALL the identified variables in curly braces (e.g. {{variable_name}})
-        2. Produces outputs similar to the examples when variables are provided
-        3. Is clear and specific for {state['role']}
-        4. Follows the basic requirements
-
-        Format your response as:
-        
-        PROMPT:
-        [Your generated prompt here, using variables in curly braces]
-        
-        ADDITIONAL_EXAMPLES:
-        [New examples with variable values and expected outputs]
-        
-        DESIGN_PRINCIPLES:
-        [Brief explanation of how the variables are used]
-        """
+        generation_prompt = _EXAMPLES_PROMPT_TPL.format(
+            example_count=len(inputs),
+            variables=', '.join(all_variables),
+            examples_text=examples_text,
+            role=role,
+            basic_requirements=basic_requirements
+        )
         
         try:
-            response = await self.model.ainvoke([HumanMessage(content=generation_prompt)])
-            prompt_content = response.content if hasattr(response, 'content') else str(response)
+            # PROMPT段落在ADDITIONAL_EXAMPLES之前，读到该标记即可停止
+            response = await _stream_prompt_section(
+                self.model, [HumanMessage(content=generation_prompt)],
+                ('ADDITIONAL_EXAMPLES:', 'DESIGN_PRINCIPLES:')
+            )
+            prompt_content = response.content
             
             # 解析生成的prompt
             current_prompt = self._extract_prompt_from_response(prompt_content)
@@ -357,7 +871,7 @@ class PromptGeneratorAgent:
             missing_vars = [var for var in all_variables if f"{{{var}}}" not in current_prompt]
             if missing_vars:
                 # 如果有缺失的变量，添加到prompt末尾
-                current_prompt += f"\n\nAvailable variables: {', '.join(f'{{{var}}}' for var in sorted(all_variables))}"
+                current_prompt += f"\n\nAvailable variables: {', '.join(f'{{{var}}}' for var in all_variables)}"
             
             return {
                 "messages": [response],
@@ -372,57 +886,43 @@ class PromptGeneratorAgent:
         if not response:
             return ""
             
-        lines = response.split('\n')
-        prompt_lines = []
-        in_prompt_section = False
-        
-        for line in lines:
-            if 'PROMPT:' in line:
-                in_prompt_section = True
-                continue
-            elif 'ADDITIONAL_EXAMPLES:' in line or 'DESIGN_PRINCIPLES:' in line:
-                in_prompt_section = False
-            elif in_prompt_section:
-                prompt_lines.append(line)
-        
-        return '\n'.join(prompt_lines).strip()
+        # 只用下标定位PROMPT:之后、下一个段落标记之前的范围，最后切片一次，不复制中间字符串
+        start = response.find('PROMPT:')
+        if start < 0:
+            return ""
+        start += len('PROMPT:')
+        end = len(response)
+        for marker in _PROMPT_SECTION_END_MARKERS:
+            index = response.find(marker, start, end)
+            if index >= 0:
+                end = index
+        return response[start:end].strip()
+
+
+def _extract_score(evaluation: str) -> float:
+    """从评估文本中提取得分，取最后一个（通常是总分），未找到时返回0"""
+    matches = _SCORE_RE.findall(evaluation or "")
+    return float(matches[-1]) if matches else 0.0
 
 
-class PromptEvaluatorAgent:
+class PromptEvaluatorAgent(BaseAgent):
     """Prompt评估器Agent - 负责评估prompt质量"""
     
-    def __init__(self):
-        self.model = None
-    
-    def _ensure_model(self, model_type: str):
-        """确保model已经初始化，并且类型正确"""
-        if not self.model or self.model_type != model_type:
-            self.model_type = model_type
-            self.model = ModelFactory.create_model(model_type)
+    __slots__ = ()
     
     async def generate_evaluation_guide(self, state: PromptOptimizerState) -> Dict:
         """生成针对特定角色的prompt评估指导"""
         if not state.get('role'):
             raise ValueError("Role is required for generating evaluation guide")
             
-        # 确保使用正确的模型类型
-        self._ensure_model(state['model_type'])
+        self._ensure_model()
             
-        eval_guide_prompt = f"""
-        Generate a detailed prompt evaluation guide. The audience is {state['role']}.
-        
-        Include criteria for evaluating prompts specifically for {state['role']}, such as:
-        - Clarity and specificity
-        - Effectiveness for the target use case
-        - Potential edge cases
-        - Performance considerations
-        - Maintainability and scalability
-        
-        Provide a structured evaluation framework.
-        """
+        eval_guide_prompt = _EVAL_GUIDE_TPL.format(role=state['role'])
         
         try:
-            response = await self.model.ainvoke([HumanMessage(content=eval_guide_prompt)])
+            response = await self.model.ainvoke(
+                [HumanMessage(content=eval_guide_prompt)], **self._output_limit(Config.GUIDE_MAX_TOKENS)
+            )
             return {
                 "messages": [response],
                 "step": "evaluation_guide_generated"
@@ -435,268 +935,475 @@ class PromptEvaluatorAgent:
         if not state.get('current_prompt'):
             raise ValueError("Current prompt is required for evaluation")
             
-        # 确保使用正确的模型类型
-        self._ensure_model(state['model_type'])
+        self._ensure_model()
             
-        evaluation_prompt = f"""
-        Evaluate this prompt for {state['role']}:
-
-        PROMPT TO EVALUATE:
-        {state['current_prompt']}
-
-        ORIGINAL EXAMPLES IT SHOULD HANDLE:
-        {self._format_examples(state.get('examples', []))}
-
-        Provide a detailed evaluation including:
-        1. Strengths of the current prompt
-        2. Potential weaknesses or limitations
-        3. How well it addresses the target audience ({state['role']})
-        4. Specific areas for improvement
-        5. Overall score (1-10) with justification
-
-        Be thorough and constructive in your evaluation.
-        """
+        evaluation_prompt = _EVALUATION_TPL.format(
+            role=state['role'],
+            current_prompt=state['current_prompt'],
+            examples_text=state['examples_text']
+        )
         
         try:
-            response = await self.model.ainvoke([HumanMessage(content=evaluation_prompt)])
-            response_content = response.content if hasattr(response, 'content') else str(response)
+            response = await self.model.ainvoke(
+                [HumanMessage(content=evaluation_prompt)], **self._output_limit(Config.EVALUATION_MAX_TOKENS)
+            )
+            response_content = _content(response)
             
             return {
                 "messages": [response],
                 "evaluations": state.get("evaluations", []) + [response_content],
+                "score": _extract_score(response_content),
                 "step": "prompt_evaluated"
             }
         except Exception as e:
             raise RuntimeError(f"Failed to evaluate prompt: {str(e)}")
-    
-    def _format_examples(self, examples: List[Dict[str, str]]) -> str:
-        """格式化示例，增加错误处理"""
-        if not examples:
-            return "No examples provided"
-            
-        formatted_examples = []
-        for ex in examples:
-            if isinstance(ex, dict) and 'input' in ex and 'output' in ex:
-                formatted_examples.append(f"Input: {ex['input']}\nOutput: {ex['output']}")
-        
-        return "\n\n".join(formatted_examples) if formatted_examples else "No valid examples found"
 
 
-class PromptImproverAgent:
+# 改进方案的三个方向，每个方向单独生成一个方案
+IMPROVEMENT_FOCUSES = ("clarity", "specificity", "edge case handling")
+
+
+class PromptImproverAgent(BaseAgent):
     """Prompt改进器Agent - 负责生成改进的prompt版本"""
     
-    def __init__(self):
-        self.model = None
-    
-    def _ensure_model(self, model_type: str):
-        """确保model已经初始化，并且类型正确"""
-        if not self.model or self.model_type != model_type:
-            self.model_type = model_type
-            self.model = ModelFactory.create_model(model_type)
+    __slots__ = ()
     
-    async def generate_improved_prompts(self, state: PromptOptimizerState) -> Dict:
-        """生成3个改进的prompt变体"""
-        if not state.get('current_prompt'):
+    async def generate_improved_prompts(self, state: PromptOptimizerState, speculative: bool = False) -> Dict:
+        """生成3个改进的prompt变体，每个改进方向单独并行请求；speculative时不等待评估，按通用评分标准改进"""
+        # 状态字段只读取一次，下面的循环和回退逻辑复用局部变量
+        current_prompt = state.get('current_prompt')
+        evaluations = state.get('evaluations')
+        if not current_prompt:
             raise ValueError("Current prompt is required for generating improvements")
             
-        if not state.get('evaluations'):
+        if not evaluations and not speculative:
             raise ValueError("Evaluation feedback is required for generating improvements")
         
-        # 确保使用正确的模型类型
-        self._ensure_model(state['model_type'])
+        self._ensure_model()
         
-        improvement_prompt = f"""
-        Based on the evaluation, generate 3 improved alternative prompts for {state['role']}.
-
-        CURRENT PROMPT:
-        {state['current_prompt']}
+        role = state['role']
+        examples_text = state['examples_text']
+        evaluation = _IMPROVEMENT_RUBRIC if speculative else evaluations[-1]
+        improvement_prompts = [
+            _IMPROVEMENT_TPL.format(
+                role=role,
+                focus=focus,
+                index=i,
+                current_prompt=current_prompt,
+                evaluation=evaluation,
+                examples_text=examples_text
+            )
+            for i, focus in enumerate(IMPROVEMENT_FOCUSES, 1)
+        ]
+        
+        # 每个方案完成后立即解析并推送到自定义流，调用方无需等待最慢的一个
+        writer = _stream_writer()
+        
+        async def improve(index: int, prompt: str):
+            response = await self.model.ainvoke(
+                [HumanMessage(content=prompt)], **self._output_limit(Config.IMPROVEMENT_MAX_TOKENS)
+            )
+            alternative, score = self._parse_improvement(_content(response))
+            if alternative:
+                writer({"alternative": alternative, "index": index, "self_score": score})
+            return response, alternative, score
+        
+        # 三个改进方向互不依赖，并行请求，输出更短、整体延迟更低
+        results = await asyncio.gather(
+            *(improve(i, prompt) for i, prompt in enumerate(improvement_prompts, 1)),
+            return_exceptions=True
+        )
+        
+        messages = []
+        alternative_prompts = []
+        alt_scores = []
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.warning("Warning: Failed to generate an improved prompt: %s", result)
+                continue
+            response, alternative, score = result
+            messages.append(response)
+            if alternative:
+                alternative_prompts.append(alternative)
+                alt_scores.append(score)
+        
+        if not messages:
+            raise RuntimeError(f"Failed to generate improved prompts: {str(results[0])}")
+        
+        # 确保至少有一个改进方案
+        if not alternative_prompts:
+            alternative_prompts = [current_prompt]  # 如果解析失败，使用原prompt
+            alt_scores = [state.get('score', 0.0)]
+        
+        return {
+            "messages": messages,
+            "alternative_prompts": alternative_prompts,
+            "alt_scores": alt_scores,
+            "step": "alternatives_generated"
+        }
+    
+    def _parse_improvement(self, response_content: str) -> Tuple[str, float]:
+        """解析单个改进响应，返回(方案, 自评得分)"""
+        # 自评得分在方案之后，先切出来，未给出时记为0
+        body, _, score_text = response_content.partition('SELF_SCORE:')
+        score_match = _NUMBER_RE.search(score_text)
+        
+        # 每个响应只包含一个方案，解析失败时直接使用整个响应
+        parsed = self._extract_alternatives(body)
+        alternative = parsed[0] if parsed else body.strip()
+        return alternative, float(score_match.group()) if score_match else 0.0
+    
+    def _extract_alternatives(self, response: str) -> List[str]:
+        """从响应中提取alternative prompts，改进解析逻辑"""
+        if not response:
+            return []
+        return list(_split_alternatives(response))
 
-        EVALUATION FEEDBACK:
-        {state['evaluations'][-1] if state['evaluations'] else "No evaluation available"}
 
-        ORIGINAL EXAMPLES TO HANDLE:
-        {self._format_examples(state.get('examples', []))}
+# 各模型开启JSON输出的调用参数
+_JSON_MODE_KWARGS = {
+    "openai": {"response_format": {"type": "json_object"}},
+    "gemini": {"response_mime_type": "application/json"},
+}
 
-        Generate 3 distinct improved versions that address the identified weaknesses while maintaining the strengths. Each should:
-        1. Be specifically tailored for {state['role']}
-        2. Address the feedback from the evaluation
-        3. Maintain or improve upon the original prompt's capabilities
-        4. Have a clear improvement focus (e.g., clarity, specificity, edge case handling)
 
-        Format as:
+class PromptBatchAgent(BaseAgent):
+    """合并请求Agent - 一次调用同时完成prompt生成、评估和改进"""
+    
+    __slots__ = ()
+    
+    async def optimize_in_one_call(self, state: PromptOptimizerState) -> Dict:
+        """用一次JSON输出请求完成生成、评估和改进，解析失败时抛出异常"""
+        self._ensure_model()
         
-        ALTERNATIVE 1: [Focus: specific improvement area]
-        [Improved prompt 1]
-
-        ALTERNATIVE 2: [Focus: specific improvement area]  
-        [Improved prompt 2]
-
-        ALTERNATIVE 3: [Focus: specific improvement area]
-        [Improved prompt 3]
-
-        For each alternative, briefly explain the key improvements made.
-        """
+        all_variables = state.get('example_variables', ())
+        
+        batched_prompt = _BATCHED_TPL.format(
+            role=state['role'],
+            basic_requirements=state.get('basic_requirements', ''),
+            examples_text=state['examples_text'],
+            variables=', '.join(all_variables) or "none",
+            focuses=', '.join(IMPROVEMENT_FOCUSES)
+        )
         
         try:
-            response = await self.model.ainvoke([HumanMessage(content=improvement_prompt)])
-            response_content = response.content if hasattr(response, 'content') else str(response)
-            
-            # 解析生成的alternative prompts
-            alternative_prompts = self._extract_alternatives(response_content)
-            
-            # 确保至少有一个改进方案
-            if not alternative_prompts:
-                alternative_prompts = [state['current_prompt']]  # 如果解析失败，使用原prompt
-            
-            return {
-                "messages": [response],
-                "alternative_prompts": alternative_prompts,
-                "step": "alternatives_generated"
-            }
+            response = await self.model.ainvoke(
+                [HumanMessage(content=batched_prompt)],
+                **_JSON_MODE_KWARGS.get(self.model_type.lower(), {}),
+                **self._output_limit(Config.BATCHED_MAX_TOKENS)
+            )
+            data = _json_loads(_content(response))
         except Exception as e:
-            raise RuntimeError(f"Failed to generate improved prompts: {str(e)}")
-    
-    def _extract_alternatives(self, response: str) -> List[str]:
-        """从响应中提取alternative prompts，改进解析逻辑"""
-        if not response:
-            return []
-            
-        alternatives = []
-        lines = response.split('\n')
-        current_alternative = []
-        in_alternative = False
-        
-        for line in lines:
-            if 'ALTERNATIVE' in line and ':' in line:
-                if current_alternative and in_alternative:
-                    alt_text = '\n'.join(current_alternative).strip()
-                    if alt_text:  # 确保内容不为空
-                        alternatives.append(alt_text)
-                current_alternative = []
-                in_alternative = True
-            elif in_alternative and line.strip():
-                # 跳过Focus说明行
-                if not (line.strip().startswith('[Focus:') and line.strip().endswith(']')):
-                    current_alternative.append(line)
-        
-        # 添加最后一个alternative
-        if current_alternative and in_alternative:
-            alt_text = '\n'.join(current_alternative).strip()
-            if alt_text:
-                alternatives.append(alt_text)
-        
-        return alternatives
-    
-    def _format_examples(self, examples: List[Dict[str, str]]) -> str:
-        """格式化示例，与评估器保持一致"""
-        if not examples:
-            return "No examples provided"
-            
-        formatted_examples = []
-        for ex in examples:
-            if isinstance(ex, dict) and 'input' in ex and 'output' in ex:
-                formatted_examples.append(f"Input: {ex['input']}\nOutput: {ex['output']}")
+            raise RuntimeError(f"Failed to run batched optimization: {str(e)}")
         
-        return "\n\n".join(formatted_examples) if formatted_examples else "No valid examples found"
+        current_prompt = data.get("prompt") if isinstance(data, dict) else None
+        if not isinstance(current_prompt, str) or not current_prompt.strip():
+            raise ValueError("Batched response is missing a prompt")
+        current_prompt = current_prompt.strip()
+        
+        # 验证所有变量都在生成的prompt中使用
+        if any(f"{{{var}}}" not in current_prompt for var in all_variables):
+            current_prompt += f"\n\nAvailable variables: {', '.join(f'{{{var}}}' for var in all_variables)}"
+        
+        alternative_prompts = []
+        alt_scores = []
+        for alternative in data.get("alternatives") or []:
+            if isinstance(alternative, dict) and isinstance(alternative.get("prompt"), str) and alternative["prompt"].strip():
+                alternative_prompts.append(alternative["prompt"].strip())
+                alt_scores.append(_to_score(alternative.get("score")))
+        
+        score = _to_score(data.get("score"))
+        # 与多次调用的流程一致：得分足够高时不采用改进方案
+        if score >= Config.SKIP_IMPROVEMENT_SCORE:
+            alternative_prompts, alt_scores = [], []
+        
+        return {
+            "messages": [response],
+            "current_prompt": current_prompt,
+            "evaluations": state.get("evaluations", []) + [str(data.get("evaluation", ""))],
+            "score": score,
+            "alternative_prompts": alternative_prompts,
+            "alt_scores": alt_scores,
+            "step": "batched_optimized"
+        }
+
+
+def _to_score(value) -> float:
+    """把JSON中的得分转换为浮点数，无法转换时返回0"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _workflow_node(method_name: str):
+    """创建图节点：从运行配置中取出当前工作流实例，调用其同名节点方法"""
+    async def node(state: PromptOptimizerState, config: RunnableConfig):
+        workflow = config["configurable"]["workflow"]
+        return await getattr(workflow, method_name)(state)
+    
+    node.__name__ = method_name
+    return node
 
 
 class PromptOptimizerWorkflow:
     """协调多个Agent的工作流，优化错误处理和状态管理"""
     
-    def __init__(self):
+    # 编译后的图与实例无关，按(是否合并请求, 是否推测执行改进)缓存，所有实例共享
+    _compiled_workflows: Dict[Tuple[bool, bool], StateGraph] = {}
+    
+    def __init__(self, model_type: Optional[str] = None):
+        self._model_type = model_type
+        self._agents: Dict[Tuple[type, str], BaseAgent] = {}  # Agent在节点首次执行时才创建
+        self._inflight: Dict[str, asyncio.Future] = {}  # 正在执行的优化请求
         try:
-            self.generator = PromptGeneratorAgent()
-            self.evaluator = PromptEvaluatorAgent()
-            self.improver = PromptImproverAgent()
             self.workflow = self._build_workflow()
         except Exception as e:
             raise RuntimeError(f"Failed to initialize workflow: {str(e)}")
     
-    def _build_workflow(self) -> StateGraph:
-        """构建LangGraph工作流"""
-        workflow = StateGraph(PromptOptimizerState)
+    def _agent(self, agent_cls, state: PromptOptimizerState):
+        """按本次运行的模型类型获取Agent，每种模型类型各有一组Agent，并发运行互不影响"""
+        model_type = (state.get('model_type') or self._model_type or Config.DEFAULT_MODEL_TYPE).lower()
+        agent = self._agents.get((agent_cls, model_type))
+        if agent is None:
+            agent = self._agents[(agent_cls, model_type)] = agent_cls(model_type=model_type)
+        return agent
+    
+    def prewarm(self, model_types: Optional[List[str]] = None):
+        """预热：提前创建模型实例（不调用LLM），把一次性初始化开销移出首个请求"""
+        for model_type in model_types or [Config.DEFAULT_MODEL_TYPE]:
+            try:
+                # 模型由该类型的Agent持有，弱引用缓存中的实例随工作流存活
+                self._agent(PromptGeneratorAgent, {'model_type': model_type})._ensure_model()
+            except Exception as e:
+                logger.warning("Warning: Failed to prewarm %s model: %s", model_type, e)
+    
+    @classmethod
+    def _build_workflow(cls) -> StateGraph:
+        """构建LangGraph工作流（与具体实例无关，每种配置只编译一次）"""
+        key = (Config.ENABLE_BATCHED_JSON, Config.ENABLE_SPECULATIVE_IMPROVEMENT)
+        compiled = cls._compiled_workflows.get(key)
+        if compiled is not None:
+            return compiled
         
+        workflow = StateGraph(PromptOptimizerState)
+        if Config.ENABLE_BATCHED_JSON:
+            compiled = cls._build_batched_workflow(workflow)
+        elif Config.ENABLE_SPECULATIVE_IMPROVEMENT:
+            compiled = cls._build_speculative_workflow(workflow)
+        else:
+            compiled = cls._build_default_workflow(workflow)
+        cls._compiled_workflows[key] = compiled
+        return compiled
+    
+    @classmethod
+    def _build_default_workflow(cls, workflow: StateGraph) -> StateGraph:
+        """构建逐步调用的工作流"""
         # 添加节点
-        workflow.add_node("generate_guide", self._generate_guide_node)
-        workflow.add_node("generate_prompt", self._generate_prompt_node)
-        workflow.add_node("generate_eval_guide", self._generate_eval_guide_node)
-        workflow.add_node("evaluate_prompt", self._evaluate_prompt_node)
-        workflow.add_node("improve_prompts", self._improve_prompts_node)
-        workflow.add_node("finalize", self._finalize_node)
-        
-        # 定义流程
-        workflow.add_edge(START, "generate_guide")
-        workflow.add_edge("generate_guide", "generate_prompt")
-        workflow.add_edge("generate_prompt", "generate_eval_guide")
-        workflow.add_edge("generate_eval_guide", "evaluate_prompt")
-        workflow.add_edge("evaluate_prompt", "improve_prompts")
+        workflow.add_node("generate_guides", _workflow_node("_generate_guides_node"))
+        workflow.add_node("generate_prompt", _workflow_node("_generate_prompt_node"))
+        workflow.add_node("evaluate_prompt", _workflow_node("_evaluate_prompt_node"))
+        workflow.add_node("improve_prompts", _workflow_node("_improve_prompts_node"))
+        workflow.add_node("finalize", _workflow_node("_finalize_node"))
+        
+        # 定义流程：两份指导（同一节点内并发请求）和初始prompt都只依赖请求本身，
+        # 从START并行执行，全部完成后再进入评估
+        workflow.add_edge(START, "generate_guides")
+        workflow.add_edge(START, "generate_prompt")
+        workflow.add_edge(["generate_guides", "generate_prompt"], "evaluate_prompt")
+        # 评估得分已经足够高时跳过改进，直接最终化
+        workflow.add_conditional_edges(
+            "evaluate_prompt",
+            cls._route_after_evaluation,
+            {"finalize": "finalize", "improve_prompts": "improve_prompts"}
+        )
         workflow.add_edge("improve_prompts", "finalize")
         workflow.add_edge("finalize", END)
         
         return workflow.compile()
     
+    @classmethod
+    def _build_speculative_workflow(cls, workflow: StateGraph) -> StateGraph:
+        """构建推测执行的工作流：评估和改进在同一节点内并发，评估结果到达后再筛选改进方案"""
+        workflow.add_node("generate_guides", _workflow_node("_generate_guides_node"))
+        workflow.add_node("generate_prompt", _workflow_node("_generate_prompt_node"))
+        workflow.add_node("evaluate_and_improve", _workflow_node("_evaluate_and_improve_node"))
+        workflow.add_node("finalize", _workflow_node("_finalize_node"))
+        
+        workflow.add_edge(START, "generate_guides")
+        workflow.add_edge(START, "generate_prompt")
+        workflow.add_edge(["generate_guides", "generate_prompt"], "evaluate_and_improve")
+        workflow.add_edge("evaluate_and_improve", "finalize")
+        workflow.add_edge("finalize", END)
+        
+        return workflow.compile()
+    
+    @classmethod
+    def _build_batched_workflow(cls, workflow: StateGraph) -> StateGraph:
+        """构建合并请求的工作流：生成、评估、改进由一个节点一次调用完成"""
+        workflow.add_node("generate_guides", _workflow_node("_generate_guides_node"))
+        workflow.add_node("batched_optimize", _workflow_node("_batched_optimize_node"))
+        workflow.add_node("finalize", _workflow_node("_finalize_node"))
+        
+        workflow.add_edge(START, "generate_guides")
+        workflow.add_edge(START, "batched_optimize")
+        workflow.add_edge(["generate_guides", "batched_optimize"], "finalize")
+        workflow.add_edge("finalize", END)
+        
+        return workflow.compile()
+    
+    def _run_config(self) -> RunnableConfig:
+        """运行配置：把当前实例传给共享图中的节点"""
+        return {"configurable": {"workflow": self}}
+    
+    async def _generate_guides_node(self, state: PromptOptimizerState):
+        """并发生成prompt工程指导和评估指导，单个指导失败不影响另一个"""
+        results = await asyncio.gather(
+            self._agent(PromptGeneratorAgent, state).generate_prompt_engineering_guide(state),
+            self._agent(PromptEvaluatorAgent, state).generate_evaluation_guide(state),
+            return_exceptions=True
+        )
+        
+        messages = []
+        steps = []
+        for name, result in zip(("guide", "evaluation guide"), results):
+            if isinstance(result, BaseException):
+                logger.warning("Warning: Failed to generate %s: %s", name, result)
+                continue
+            messages.extend(result.get("messages", []))
+            steps.append(result["step"])
+        
+        update = {
+            "messages": messages,
+            "step": "guides_generated" if len(steps) == 2 else (steps[0] if steps else "guides_skipped")
+        }
+        if len(steps) < 2:
+            update["used_fallback"] = True
+        return update
+    
     async def _generate_guide_node(self, state: PromptOptimizerState):
         """生成指导节点，增加错误处理"""
         try:
-            return await self.generator.generate_prompt_engineering_guide(state)
+            return await self._agent(PromptGeneratorAgent, state).generate_prompt_engineering_guide(state)
         except Exception as e:
-            logger.warning(f"Warning: Failed to generate guide: {str(e)}")
-            return {"step": "guide_skipped", "messages": []}
+            logger.warning("Warning: Failed to generate guide: %s", e)
+            return {"step": "guide_skipped", "messages": [], "used_fallback": True}
     
     async def _generate_prompt_node(self, state: PromptOptimizerState):
         """生成prompt节点，增加错误处理"""
         try:
-            return await self.generator.generate_prompt_from_examples(state)
+            return await self._agent(PromptGeneratorAgent, state).generate_prompt_from_examples(state)
         except Exception as e:
-            logger.error(f"Error: Failed to generate prompt: {str(e)}")
+            logger.error("Error: Failed to generate prompt: %s", e)
             # 返回一个基本的prompt作为fallback
             return {
                 "current_prompt": "Please provide a clear and specific response to the user's request.",
-                "step": "prompt_fallback"
+                "step": "prompt_fallback",
+                "used_fallback": True
             }
     
+    async def _batched_optimize_node(self, state: PromptOptimizerState):
+        """合并请求节点，JSON解析失败时退回生成、评估、改进的多次调用"""
+        try:
+            return await self._agent(PromptBatchAgent, state).optimize_in_one_call(state)
+        except Exception as e:
+            logger.warning("Warning: Batched optimization failed, falling back to separate calls: %s", e)
+        
+        current = dict(state)
+        updates = {}
+        messages = []
+        for node in (self._generate_prompt_node, self._evaluate_prompt_node, self._improve_prompts_node):
+            # 与多次调用的流程一致：评估得分足够高时跳过改进
+            if node == self._improve_prompts_node and self._route_after_evaluation(current) == "finalize":
+                break
+            update = await node(current)
+            messages.extend(update.get("messages", []))
+            current.update(update)
+            updates.update(update)
+        updates["messages"] = messages
+        return updates
+    
     async def _generate_eval_guide_node(self, state: PromptOptimizerState):
         """生成评估指导节点"""
         try:
-            return await self.evaluator.generate_evaluation_guide(state)
+            return await self._agent(PromptEvaluatorAgent, state).generate_evaluation_guide(state)
         except Exception as e:
-            logger.warning(f"Warning: Failed to generate evaluation guide: {str(e)}")
-            return {"step": "eval_guide_skipped", "messages": []}
+            logger.warning("Warning: Failed to generate evaluation guide: %s", e)
+            return {"step": "eval_guide_skipped", "messages": [], "used_fallback": True}
     
     async def _evaluate_prompt_node(self, state: PromptOptimizerState):
         """评估prompt节点"""
         try:
-            return await self.evaluator.evaluate_prompt(state)
+            return await self._agent(PromptEvaluatorAgent, state).evaluate_prompt(state)
         except Exception as e:
-            logger.warning(f"Warning: Failed to evaluate prompt: {str(e)}")
+            logger.warning("Warning: Failed to evaluate prompt: %s", e)
             # 提供基本评估
             return {
                 "evaluations": state.get("evaluations", []) + ["Basic evaluation: The prompt appears functional but may need refinement."],
-                "step": "evaluation_fallback"
+                "step": "evaluation_fallback",
+                "used_fallback": True
             }
     
-    async def _improve_prompts_node(self, state: PromptOptimizerState):
+    @staticmethod
+    def _route_after_evaluation(state: PromptOptimizerState) -> str:
+        """根据评估得分决定是否需要改进"""
+        if state.get("score", 0) >= Config.SKIP_IMPROVEMENT_SCORE:
+            logger.info("Prompt scored %s/10, skipping improvement", state['score'])
+            return "finalize"
+        return "improve_prompts"
+    
+    async def _improve_prompts_node(self, state: PromptOptimizerState, speculative: bool = False):
         """改进prompt节点"""
         try:
-            return await self.improver.generate_improved_prompts(state)
+            return await self._agent(PromptImproverAgent, state).generate_improved_prompts(state, speculative)
         except Exception as e:
-            logger.warning(f"Warning: Failed to generate improvements: {str(e)}")
+            logger.warning("Warning: Failed to generate improvements: %s", e)
             # 如果改进失败，使用当前prompt作为alternative
             current_prompt = state.get('current_prompt', '')
             return {
                 "alternative_prompts": [current_prompt] if current_prompt else [],
-                "step": "improvement_fallback"
+                "alt_scores": [],
+                "step": "improvement_fallback",
+                "used_fallback": True
             }
     
+    async def _evaluate_and_improve_node(self, state: PromptOptimizerState):
+        """并发执行评估和推测改进，评估得分足够高时丢弃改进方案，与逐步执行的结果保持一致"""
+        evaluation, improvement = await asyncio.gather(
+            self._evaluate_prompt_node(state),
+            self._improve_prompts_node(state, speculative=True)
+        )
+        
+        update = {**improvement, **evaluation}
+        update["messages"] = evaluation.get("messages", []) + improvement.get("messages", [])
+        if self._route_after_evaluation({**state, **evaluation}) == "finalize":
+            update["alternative_prompts"] = []
+            update["alt_scores"] = []
+            # 改进方案被丢弃，其失败不影响结果
+            if "used_fallback" not in evaluation:
+                update.pop("used_fallback", None)
+        else:
+            update["step"] = improvement["step"]
+        return update
+    
     async def _finalize_node(self, state: PromptOptimizerState):
         """最终化处理，选择最佳prompt，改进选择逻辑"""
         current_prompt = state.get("current_prompt", "")
         alternative_prompts = state.get("alternative_prompts", [])
         
+        alt_scores = state.get("alt_scores", [])
+        
         # 改进的选择逻辑
-        if alternative_prompts:
-            # 选择最长的alternative作为最终推荐（通常更详细）
-            final_prompt = max(alternative_prompts, key=len)
+        if alternative_prompts and len(alt_scores) == len(alternative_prompts) and any(alt_scores):
+            # 选择自评得分最高的alternative
+            final_prompt = alternative_prompts[max(range(len(alt_scores)), key=alt_scores.__getitem__)]
+        elif alternative_prompts:
+            # 没有可用得分时，优先选择用到示例变量最多的alternative，其次选择最长的（通常更详细）
+            variables = state.get("example_variables", ())
+            final_prompt = max(
+                alternative_prompts,
+                key=lambda alt: (sum(f"{{{var}}}" in alt for var in variables), len(alt))
+            )
         else:
             final_prompt = current_prompt
         
@@ -709,16 +1416,15 @@ class PromptOptimizerWorkflow:
             "step": "completed"
         }
     
-    async def optimize_prompt(self, request: PromptRequest) -> Dict:
-        """执行prompt优化流程，增加输入验证和错误处理"""
+    def _build_initial_state(self, request: PromptRequest) -> PromptOptimizerState:
+        """验证请求并构建工作流初始状态"""
         # 输入验证
         if not request.role.strip():
             raise ValueError("Role cannot be empty")
             
-        # 验证示例（如果有）
+        # 验证示例（如果有），第一个示例的字段名即为prompt中要使用的变量
+        first_example_fields = None
         if request.examples:
-            # 存储第一个示例的字段名
-            first_example_fields = None
             
             for i, example in enumerate(request.examples):
                 if not isinstance(example, dict):
@@ -730,16 +1436,16 @@ class PromptOptimizerWorkflow:
                 
                 # 解析input JSON并验证字段名一致性
                 try:
-                    input_data = json.loads(example['input']) if isinstance(example['input'], str) else example['input']
+                    input_data = _json_loads(example['input']) if isinstance(example['input'], str) else example['input']
                     if not isinstance(input_data, dict):
                         raise ValueError(f"Example {i+1} input must be a valid JSON object")
                     
-                    # 获取当前示例的字段名集合
-                    current_fields = set(input_data.keys())
+                    # 字段名视图本身支持集合运算，直接与第一个示例比较，不为每个示例构建新集合
+                    current_fields = input_data.keys()
                     
                     # 如果是第一个示例，保存其字段名
                     if first_example_fields is None:
-                        first_example_fields = current_fields
+                        first_example_fields = frozenset(current_fields)
                     # 否则比较字段名是否一致
                     elif current_fields != first_example_fields:
                         # 找出不一致的字段
@@ -755,7 +1461,9 @@ class PromptOptimizerWorkflow:
                 except json.JSONDecodeError:
                     raise ValueError(f"Example {i+1} input must be a valid JSON object")
         
-        initial_state = PromptOptimizerState(
+        inputs = tuple(ex['input'] for ex in request.examples)
+        outputs = tuple(ex['output'] for ex in request.examples)
+        return PromptOptimizerState(
             messages=[],
             role=request.role.strip(),
             basic_requirements=request.basic_requirements,
@@ -765,22 +1473,78 @@ class PromptOptimizerWorkflow:
             alternative_prompts=[],
             final_prompt="",
             step="started",
-            model_type=request.model_type
+            model_type=request.model_type,
+            examples_inputs=inputs,
+            examples_outputs=outputs,
+            examples_text=_format_examples(inputs, outputs),
+            example_variables=tuple(sorted(first_example_fields or ())),
+            score=0.0,
+            alt_scores=[],
+            used_fallback=False
         )
+    
+    @staticmethod
+    def _format_result(result: PromptOptimizerState) -> Dict:
+        """将工作流最终状态整理为返回结果"""
+        return {
+            "role": result["role"],
+            "model_type": result["model_type"],
+            "original_examples": result["examples"],
+            "generated_prompt": result.get("current_prompt", ""),
+            "evaluations": result.get("evaluations", []),
+            "alternative_prompts": result.get("alternative_prompts", []),
+            "final_recommendation": result.get("final_prompt", ""),
+            "step": result.get("step", "unknown"),
+            "used_fallback": result.get("used_fallback", False)
+        }
+    
+    async def optimize_prompt(self, request: PromptRequest) -> Dict:
+        """执行prompt优化流程，增加输入验证和错误处理；相同请求正在执行时（如客户端超时重试）等待同一结果"""
+        initial_state = self._build_initial_state(request)
+        
+        key = request.model_dump_json()
+        task = self._inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._run_workflow(initial_state))
+            self._inflight[key] = task
+            task.add_done_callback(partial(self._on_run_done, key))
+        else:
+            logger.info("Joined an in-flight optimization for an identical request")
+        # shield：某个调用方被取消时不影响其他等待同一请求的调用方
+        return dict(await asyncio.shield(task))
+    
+    def _on_run_done(self, key: str, task: asyncio.Future):
+        """进行中的优化完成，移出等待表"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+    
+    async def _run_workflow(self, initial_state: PromptOptimizerState) -> Dict:
+        """执行工作流并整理结果"""
+        try:
+            result = await self.workflow.ainvoke(initial_state, config=self._run_config())
+            return self._format_result(result)
+        except Exception as e:
+            raise RuntimeError(f"Workflow execution failed: {str(e)}")
+    
+    async def astream(self, request: PromptRequest) -> AsyncIterator[Dict]:
+        """流式执行prompt优化流程，每个节点完成后产出 {"node", "update"}，每个改进方案完成时产出
+        {"node": "alternative", "update"}，最后产出 {"node": "result", "result"}"""
+        initial_state = self._build_initial_state(request)
+        final_state = initial_state
         
         try:
-            # 执行工作流
-            result = await self.workflow.ainvoke(initial_state)
-            
-            return {
-                "role": result["role"],
-                "model_type": result["model_type"],
-                "original_examples": result["examples"],
-                "generated_prompt": result.get("current_prompt", ""),
-                "evaluations": result.get("evaluations", []),
-                "alternative_prompts": result.get("alternative_prompts", []),
-                "final_recommendation": result.get("final_prompt", ""),
-                "step": result.get("step", "unknown")
-            }
+            async for mode, chunk in self.workflow.astream(
+                initial_state, config=self._run_config(), stream_mode=["updates", "values", "custom"]
+            ):
+                if mode == "values":
+                    final_state = chunk
+                    continue
+                if mode == "custom":
+                    yield {"node": "alternative", "update": chunk}
+                    continue
+                for node, update in chunk.items():
+                    yield {"node": node, "update": update or {}}
         except Exception as e:
-            raise RuntimeError(f"Workflow execution failed: {str(e)}") 
\ No newline at end of file
+            raise RuntimeError(f"Workflow execution failed: {str(e)}")
+        
+        yield {"node": "result", "result": self._format_result(final_state)}
@@ -1,22 +1,215 @@
+import asyncio
 import json
 import logging
-from typing import Dict, Any, Optional
+import re
+from typing import Dict, Any, List, Optional
+from pydantic import BaseModel, ValidationError, field_validator
 from a2a.server.agent_execution import AgentExecutor, RequestContext
 from a2a.server.events import EventQueue
 from a2a.utils import new_agent_text_message
-from prompt_optimizer import PromptOptimizerWorkflow, PromptRequest
+from prompt_optimizer import Config, PromptOptimizerWorkflow, PromptRequest
+
+# 优先使用orjson解析JSON，未安装时退回标准库json
+# （orjson.JSONDecodeError继承自json.JSONDecodeError，现有异常处理不受影响）
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 # 设置日志记录
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 自然语言快速入口：按优先级排列的(关键词正则, 预设请求)，模块加载时构建一次
+_NATURAL_LANGUAGE_PRESETS = (
+    (re.compile(r"developer|programming|code|software"), {
+        "role": "software developers",
+        "basic_requirements": "编写高质量、可维护的代码，包括函数、类和API设计",
+        "model_type": "openai"
+    }),
+    (re.compile(r"writer|author|content|writing"), {
+        "role": "content writers",
+        "basic_requirements": "创作引人入胜、结构清晰的内容，包括文章、博客和营销文案",
+        "model_type": "openai"
+    }),
+    (re.compile(r"data|analysis|scientist|analytics"), {
+        "role": "data scientists",
+        "basic_requirements": "进行数据分析和可视化，生成清晰的见解报告",
+        "model_type": "openai"
+    }),
+)
+
+
+def _truncate(text: str, limit: int) -> str:
+    """超过长度上限时截断并加省略号，未超过时直接返回原字符串"""
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+# 使用帮助和结果展示模板，模块加载时构建一次
+_USAGE_HELP = """
+📋 **Prompt优化器使用指南**
+
+请提供JSON格式的输入，包含以下字段：
+
+```json
+{
+    "role": "目标用户角色，如 'software developers', 'book authors'",
+    "basic_requirements": "该角色需要完成的基本任务和要求",
+    "examples": [  // 可选
+        {
+            "input": "示例输入1",
+            "output": "期望输出1"
+        },
+        {
+            "input": "示例输入2", 
+            "output": "期望输出2"
+        }
+    ],
+    "model_type": "模型类型，支持 'gemini' 或 'openai'（默认）",
+    "additional_requirements": "额外要求（可选）"
+}
+```
+
+**🤖 支持的模型类型:**
+- `openai`: OpenAI GPT-4o-mini (默认)
+- `gemini`: Google Gemini 2.0 Flash
+
+**🌐 代理配置:**
+系统已配置代理支持，默认使用 `http://127.0.0.1:7890`
+如需修改，请在环境变量中设置 `HTTPS_PROXY` 和 `HTTP_PROXY`
+
+**💡 快速开始示例:**
+直接发送 "software developer" 或 "content writer" 等关键词，系统会自动生成基础配置
+
+**示例：软件开发prompt优化**
+```json
+{
+    "role": "software developers",
+    "basic_requirements": "编写高质量、可维护的Python代码，包括函数、类和API设计",
+    "model_type": "openai",
+    "examples": [
+        {
+            "input": "Write a function to calculate fibonacci numbers",
+            "output": "def fibonacci(n):\\n    if n <= 1:\\n        return n\\n    return fibonacci(n-1) + fibonacci(n-2)"
+        }
+    ],
+    "additional_requirements": "代码需要包含详细的注释和错误处理"
+}
+```
+
+**示例：内容创作prompt优化**
+```json
+{
+    "role": "content writers",
+    "basic_requirements": "创作引人入胜、结构清晰的博客文章和营销文案",
+    "model_type": "openai",
+    "examples": [
+        {
+            "input": "Write a blog post about AI",
+            "output": "Title: The Future of AI\\n\\nArtificial Intelligence has transformed..."
+        }
+    ]
+}
+```
+        """
+
+_RESULT_HEAD_TPL = """
+✅ **Prompt优化完成**
+
+🎯 **目标用户角色:** {role}
+📝 **基本要求:** {basic_requirements}
+🤖 **使用模型:** {model_type}
+📊 **处理示例数量:** {examples_count}
+
+📝 **生成的主要Prompt:**
+```
+{generated_prompt}
+```"""
+
+_RESULT_EVALUATION_TPL = """
+
+🔍 **评估结果:**
+{evaluation}"""
+
+_RESULT_ALTERNATIVES_TPL = """
+
+🚀 **改进方案 ({count} 个):**"""
+
+_RESULT_ALTERNATIVE_TPL = """
+
+**方案 {index}:**
+```
+{prompt}
+```"""
+
+_RESULT_TAIL_TPL = """
+
+💡 **最终推荐 (根据评估选择的最佳方案):**
+```
+{final_recommendation}
+```
+
+---
+✨ **使用建议:** 您可以直接使用最终推荐的prompt，或根据具体需求选择其中一个改进方案。
+"""
+
+
+class _ExampleSchema(BaseModel):
+    """请求中的单个示例：input必须是JSON对象字符串，input和output都不能为空"""
+    input: str
+    output: str
+
+    @field_validator("input", "output")
+    @classmethod
+    def _not_blank(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("must not be blank")
+        return value
+
+    @field_validator("input")
+    @classmethod
+    def _json_object(cls, value: str) -> str:
+        if not isinstance(_json_loads(value), dict):
+            raise ValueError("must be a JSON object")
+        return value
+
+
+class _RequestSchema(BaseModel):
+    """合法JSON请求的结构，由pydantic-core一次完成JSON解析和校验"""
+    role: str
+    basic_requirements: str
+    examples: List[_ExampleSchema] = []
+    additional_requirements: str = ""
+    model_type: str = "gemini"
+
+    @field_validator("role", "basic_requirements")
+    @classmethod
+    def _not_blank(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("must not be blank")
+        return value
+
 
 class PromptOptimizerAgentExecutor(AgentExecutor):
     """Prompt优化器Agent执行器，集成多Agent工作流到A2A框架"""
 
     def __init__(self):
-        # 不再预先创建workflow，而是在执行时根据模型类型动态创建
         self._workflows = {}  # 缓存不同模型类型的workflow
+        self._workflows_lock = asyncio.Lock()  # 避免并发请求重复创建同一类型的workflow
+        self._prewarm()
+
+    def _prewarm(self):
+        """启动时为已配置API密钥的模型类型创建workflow和模型实例，把初始化开销移出首个请求"""
+        for model_type, api_key in (("openai", Config.OPENAI_API_KEY), ("gemini", Config.GOOGLE_API_KEY)):
+            if not api_key:
+                continue
+            try:
+                workflow = PromptOptimizerWorkflow(model_type=model_type)
+                workflow.prewarm([model_type])
+                self._workflows[model_type] = workflow
+            except Exception as e:
+                logger.warning("Failed to prewarm workflow for %s: %s", model_type, e)
 
     async def execute(self, context: RequestContext, event_queue: EventQueue) -> None:
         """执行prompt优化流程"""
@@ -28,18 +221,21 @@ class PromptOptimizerAgentExecutor(AgentExecutor):
                 await self._send_error_message(event_queue, "请提供需要优化的prompt信息")
                 return
 
-            # 尝试解析JSON格式的输入
-            request_data = self._parse_input(user_input)
-            
-            if not request_data:
-                self._send_usage_help(event_queue)
-                return
+            # 合法的JSON请求一次完成解析和校验，其余输入再逐项检查以给出具体的错误提示
+            request_data = self._parse_valid_request(user_input)
+            if request_data is None:
+                # 尝试解析JSON格式的输入
+                request_data = self._parse_input(user_input)
+                
+                if not request_data:
+                    await self._send_usage_help(event_queue)
+                    return
 
-            # 验证输入数据
-            validation_error = self._validate_request_data(request_data)
-            if validation_error:
-                await self._send_error_message(event_queue, validation_error)
-                return
+                # 验证输入数据
+                validation_error = self._validate_request_data(request_data)
+                if validation_error:
+                    await self._send_error_message(event_queue, validation_error)
+                    return
 
             # 提取模型类型，默认为gemini
             model_type = request_data.get("model_type", "gemini").lower()
@@ -61,58 +257,77 @@ class PromptOptimizerAgentExecutor(AgentExecutor):
                 model_type=model_type
             )
 
-            # 发送开始处理的消息
-            event_queue.enqueue_event(
-                new_agent_text_message(f"🚀 开始为 '{prompt_request.role}' 使用 {model_type.upper()} 模型优化prompt...")
-            )
+            # 开始处理的提示与结果合并为一条消息发送：A2A中Message是终止事件，
+            # 单独先发送会让客户端在拿到结果前就结束本次响应
+            start_notice = f"🚀 开始为 '{prompt_request.role}' 使用 {model_type.upper()} 模型优化prompt..."
 
             # 获取或创建workflow实例
             workflow = await self._get_workflow(model_type)
 
             # 执行优化工作流
-            logger.info(f"Starting prompt optimization for role: {prompt_request.role}, model: {model_type}")
+            logger.info("Starting prompt optimization for role: %s, model: %s", prompt_request.role, model_type)
             result = await workflow.optimize_prompt(prompt_request)
 
             # 格式化并发送结果
             formatted_result = self._format_result(result)
-            event_queue.enqueue_event(new_agent_text_message(formatted_result))
+            await event_queue.enqueue_event(new_agent_text_message(f"{start_notice}\n{formatted_result}"))
             
-            logger.info(f"Prompt optimization completed successfully for role: {prompt_request.role}")
+            logger.info("Prompt optimization completed successfully for role: %s", prompt_request.role)
 
         except ValueError as e:
             await self._send_error_message(event_queue, f"❌ 输入验证错误: {str(e)}")
-            logger.warning(f"Input validation error: {str(e)}")
+            logger.warning("Input validation error: %s", e)
         except RuntimeError as e:
             await self._send_error_message(event_queue, f"❌ 系统运行错误: {str(e)}")
-            logger.error(f"Runtime error: {str(e)}")
+            logger.error("Runtime error: %s", e)
         except Exception as e:
             await self._send_error_message(event_queue, f"❌ 处理过程中出现未知错误: {str(e)}")
-            logger.error(f"Unexpected error during execution: {str(e)}", exc_info=True)
+            logger.error("Unexpected error during execution: %s", e, exc_info=True)
 
     async def cancel(self, context: RequestContext, event_queue: EventQueue) -> None:
         """取消执行"""
-        event_queue.enqueue_event(
+        await event_queue.enqueue_event(
             new_agent_text_message("❌ Prompt优化任务已取消")
         )
         logger.info("Prompt optimization task cancelled")
 
     async def _get_workflow(self, model_type: str) -> PromptOptimizerWorkflow:
-        """获取或创建workflow实例，使用缓存提高性能"""
-        if model_type not in self._workflows:
-            try:
-                self._workflows[model_type] = PromptOptimizerWorkflow()
-                logger.info(f"Created new workflow for model type: {model_type}")
-            except Exception as e:
-                logger.error(f"Failed to create workflow for {model_type}: {str(e)}")
-                raise RuntimeError(f"无法创建 {model_type} 工作流: {str(e)}")
+        """获取或创建workflow实例，使用缓存提高性能（命中时不加锁）"""
+        workflow = self._workflows.get(model_type)
+        if workflow is not None:
+            return workflow
+        
+        async with self._workflows_lock:
+            # 双重检查：等待锁期间其他请求可能已经创建完成
+            if model_type not in self._workflows:
+                try:
+                    # 构建workflow和模型是同步操作，放到线程中执行，不阻塞事件循环
+                    self._workflows[model_type] = await asyncio.to_thread(PromptOptimizerWorkflow, model_type)
+                    logger.info("Created new workflow for model type: %s", model_type)
+                except Exception as e:
+                    logger.error("Failed to create workflow for %s: %s", model_type, e)
+                    raise RuntimeError(f"无法创建 {model_type} 工作流: {str(e)}")
         
         return self._workflows[model_type]
 
+    def _parse_valid_request(self, content: str) -> Optional[Dict[str, Any]]:
+        """用请求schema直接解析并校验JSON输入，输入不合法时返回None"""
+        if not content.lstrip().startswith('{'):
+            return None
+        try:
+            return _RequestSchema.model_validate_json(content).model_dump()
+        except (ValidationError, ValueError):
+            return None
+
     def _parse_input(self, content: str) -> Optional[Dict[str, Any]]:
         """解析用户输入，支持JSON和自然语言"""
+        # 不是以{或[开头的输入不可能是请求对象，直接按自然语言解析，省去一次必然失败的JSON解析
+        if not content.lstrip().startswith(('{', '[')):
+            return self._parse_natural_language(content)
+        
         try:
             # 尝试解析JSON格式
-            parsed_data = json.loads(content)
+            parsed_data = _json_loads(content)
             logger.info("Successfully parsed JSON input")
             return parsed_data
         except json.JSONDecodeError:
@@ -124,31 +339,13 @@ class PromptOptimizerAgentExecutor(AgentExecutor):
         """解析自然语言输入（改进实现）"""
         content = content.strip().lower()
         
-        # 简单的自然语言解析逻辑
-        if any(keyword in content for keyword in ['developer', 'programming', 'code', 'software']):
-            return {
-                "role": "software developers",
-                "basic_requirements": "编写高质量、可维护的代码，包括函数、类和API设计",
-                "examples": [],  # 不提供示例
-                "model_type": "openai"
-            }
-        elif any(keyword in content for keyword in ['writer', 'author', 'content', 'writing']):
-            return {
-                "role": "content writers",
-                "basic_requirements": "创作引人入胜、结构清晰的内容，包括文章、博客和营销文案",
-                "examples": [],  # 不提供示例
-                "model_type": "openai"
-            }
-        elif any(keyword in content for keyword in ['data', 'analysis', 'scientist', 'analytics']):
-            return {
-                "role": "data scientists",
-                "basic_requirements": "进行数据分析和可视化，生成清晰的见解报告",
-                "examples": [],  # 不提供示例
-                "model_type": "openai"
-            }
-        else:
-            logger.info("Could not parse natural language input")
-            return None
+        # 按优先级依次匹配，每个类别的关键词由一个预编译正则一次扫描完成
+        for pattern, preset in _NATURAL_LANGUAGE_PRESETS:
+            if pattern.search(content):
+                return dict(preset, examples=[])  # 不提供示例
+        
+        logger.info("Could not parse natural language input")
+        return None
 
     def _validate_request_data(self, request_data: Dict[str, Any]) -> Optional[str]:
         """验证请求数据的完整性和正确性"""
@@ -194,7 +391,7 @@ class PromptOptimizerAgentExecutor(AgentExecutor):
                 
                 # 验证input是否为有效的JSON对象
                 try:
-                    input_json = json.loads(example["input"])
+                    input_json = _json_loads(example["input"])
                     if not isinstance(input_json, dict):
                         return f"示例 {i+1} 的 'input' 必须是有效的JSON对象"
                 except json.JSONDecodeError:
@@ -204,133 +401,40 @@ class PromptOptimizerAgentExecutor(AgentExecutor):
 
     async def _send_error_message(self, event_queue: EventQueue, error_message: str) -> None:
         """发送错误消息"""
-        event_queue.enqueue_event(new_agent_text_message(error_message))
+        await event_queue.enqueue_event(new_agent_text_message(error_message))
 
-    def _send_usage_help(self, event_queue: EventQueue):
+    async def _send_usage_help(self, event_queue: EventQueue) -> None:
         """发送使用帮助信息"""
-        help_message = """
-📋 **Prompt优化器使用指南**
-
-请提供JSON格式的输入，包含以下字段：
-
-```json
-{
-    "role": "目标用户角色，如 'software developers', 'book authors'",
-    "basic_requirements": "该角色需要完成的基本任务和要求",
-    "examples": [  // 可选
-        {
-            "input": "示例输入1",
-            "output": "期望输出1"
-        },
-        {
-            "input": "示例输入2", 
-            "output": "期望输出2"
-        }
-    ],
-    "model_type": "模型类型，支持 'gemini' 或 'openai'（默认）",
-    "additional_requirements": "额外要求（可选）"
-}
-```
-
-**🤖 支持的模型类型:**
-- `openai`: OpenAI GPT-4o-mini (默认)
-- `gemini`: Google Gemini 2.0 Flash
-
-**🌐 代理配置:**
-系统已配置代理支持，默认使用 `http://127.0.0.1:7890`
-如需修改，请在环境变量中设置 `HTTPS_PROXY` 和 `HTTP_PROXY`
-
-**💡 快速开始示例:**
-直接发送 "software developer" 或 "content writer" 等关键词，系统会自动生成基础配置
-
-**示例：软件开发prompt优化**
-```json
-{
-    "role": "software developers",
-    "basic_requirements": "编写高质量、可维护的Python代码，包括函数、类和API设计",
-    "model_type": "openai",
-    "examples": [
-        {
-            "input": "Write a function to calculate fibonacci numbers",
-            "output": "def fibonacci(n):\\n    if n <= 1:\\n        return n\\n    return fibonacci(n-1) + fibonacci(n-2)"
-        }
-    ],
-    "additional_requirements": "代码需要包含详细的注释和错误处理"
-}
-```
-
-**示例：内容创作prompt优化**
-```json
-{
-    "role": "content writers",
-    "basic_requirements": "创作引人入胜、结构清晰的博客文章和营销文案",
-    "model_type": "openai",
-    "examples": [
-        {
-            "input": "Write a blog post about AI",
-            "output": "Title: The Future of AI\\n\\nArtificial Intelligence has transformed..."
-        }
-    ]
-}
-```
-        """
-        event_queue.enqueue_event(new_agent_text_message(help_message))
+        await event_queue.enqueue_event(new_agent_text_message(_USAGE_HELP))
 
     def _format_result(self, result: Dict[str, Any]) -> str:
         """格式化优化结果，改进显示效果"""
-        model_type = result.get('model_type', 'unknown').upper()
-        role = result.get('role', 'Unknown')
-        basic_requirements = result.get('basic_requirements', 'N/A')
         generated_prompt = result.get('generated_prompt', 'N/A')
         evaluations = result.get('evaluations', [])
         alternative_prompts = result.get('alternative_prompts', [])
-        final_recommendation = result.get('final_recommendation', generated_prompt)
-        original_examples_count = len(result.get('original_examples', []))
         
-        formatted = f"""
-✅ **Prompt优化完成**
-
-🎯 **目标用户角色:** {role}
-📝 **基本要求:** {basic_requirements}
-🤖 **使用模型:** {model_type}
-📊 **处理示例数量:** {original_examples_count}
-
-📝 **生成的主要Prompt:**
-```
-{generated_prompt}
-```"""
+        parts = [_RESULT_HEAD_TPL.format(
+            role=result.get('role', 'Unknown'),
+            basic_requirements=result.get('basic_requirements', 'N/A'),
+            model_type=result.get('model_type', 'unknown').upper(),
+            examples_count=len(result.get('original_examples', [])),
+            generated_prompt=generated_prompt
+        )]
 
         # 添加评估结果
         if evaluations:
-            formatted += f"""
-
-🔍 **评估结果:**
-{evaluations[0][:500]}{'...' if len(evaluations[0]) > 500 else ''}"""
+            parts.append(_RESULT_EVALUATION_TPL.format(evaluation=_truncate(evaluations[0], 500)))
 
-        # 添加改进方案
+        # 添加改进方案（限制显示前3个）
         if alternative_prompts:
-            formatted += f"""
-
-🚀 **改进方案 ({len(alternative_prompts)} 个):**"""
-            
-            for i, alt_prompt in enumerate(alternative_prompts[:3], 1):  # 限制显示前3个
-                formatted += f"""
-
-**方案 {i}:**
-```
-{alt_prompt[:300]}{'...' if len(alt_prompt) > 300 else ''}
-```"""
+            parts.append(_RESULT_ALTERNATIVES_TPL.format(count=len(alternative_prompts)))
+            parts.extend(
+                _RESULT_ALTERNATIVE_TPL.format(index=i, prompt=_truncate(alt_prompt, 300))
+                for i, alt_prompt in enumerate(alternative_prompts[:3], 1)
+            )
 
         # 添加最终推荐
-        formatted += f"""
-
-💡 **最终推荐 (根据评估选择的最佳方案):**
-```
-{final_recommendation}
-```
-
----
-✨ **使用建议:** 您可以直接使用最终推荐的prompt，或根据具体需求选择其中一个改进方案。
-"""
-        
-        return formatted 
\ No newline at end of file
+        parts.append(_RESULT_TAIL_TPL.format(
+            final_recommendation=result.get('final_recommendation', generated_prompt)
+        ))
+        return "".join(parts)
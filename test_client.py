@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import json
 
@@ -5,6 +6,7 @@ from typing import Any
 from uuid import uuid4
 
 import httpx
+import orjson
 
 from a2a.client import A2ACardResolver, A2AClient
 from a2a.types import (
@@ -14,6 +16,13 @@ from a2a.types import (
     SendStreamingMessageRequest,
 )
 
+from prompt_optimizer import install_uvloop
+
+
+def _dumps(obj) -> str:
+    """序列化请求负载，orjson输出本身不转义非ASCII字符"""
+    return orjson.dumps(obj).decode()
+
 
 async def test_prompt_optimization(client: A2AClient, logger: logging.Logger) -> None:
     """测试Prompt优化请求"""
@@ -36,22 +45,6 @@ async def test_prompt_optimization(client: A2AClient, logger: logging.Logger) ->
         "model_type": "openai"
     }
     
-    logger.info("\n=== 测试软件开发场景 ===")
-    request = SendMessageRequest(
-        id=str(uuid4()),
-        params=MessageSendParams(
-            message={
-                'role': 'user',
-                'parts': [{'kind': 'text', 'text': json.dumps(software_dev_payload, ensure_ascii=False)}],
-                'messageId': uuid4().hex,
-            }
-        )
-    )
-    
-    response = await client.send_message(request)
-    logger.info("软件开发场景响应:")
-    logger.info(response.model_dump(mode='json', exclude_none=True))
-    
     # 测试用例2: 内容创作场景
     content_creation_payload = {
         "role": "content creators",
@@ -71,22 +64,6 @@ async def test_prompt_optimization(client: A2AClient, logger: logging.Logger) ->
         "model_type": "openai"
     }
     
-    logger.info("\n=== 测试内容创作场景 ===")
-    request = SendMessageRequest(
-        id=str(uuid4()),
-        params=MessageSendParams(
-            message={
-                'role': 'user',
-                'parts': [{'kind': 'text', 'text': json.dumps(content_creation_payload, ensure_ascii=False)}],
-                'messageId': uuid4().hex,
-            }
-        )
-    )
-    
-    response = await client.send_message(request)
-    logger.info("内容创作场景响应:")
-    logger.info(response.model_dump(mode='json', exclude_none=True))
-    
     # 测试用例3: 无示例场景
     no_examples_payload = {
         "role": "data scientists",
@@ -95,21 +72,36 @@ async def test_prompt_optimization(client: A2AClient, logger: logging.Logger) ->
         "model_type": "openai"
     }
     
-    logger.info("\n=== 测试无示例场景 ===")
-    request = SendMessageRequest(
-        id=str(uuid4()),
-        params=MessageSendParams(
-            message={
-                'role': 'user',
-                'parts': [{'kind': 'text', 'text': json.dumps(no_examples_payload, ensure_ascii=False)}],
-                'messageId': uuid4().hex,
-            }
+    # 三个场景互不依赖，并发发送，总耗时约等于最慢的一个
+    scenarios = [
+        ("软件开发场景", software_dev_payload),
+        ("内容创作场景", content_creation_payload),
+        ("无示例场景", no_examples_payload),
+    ]
+    requests = [
+        SendMessageRequest(
+            id=str(uuid4()),
+            params=MessageSendParams(
+                message={
+                    'role': 'user',
+                    'parts': [{'kind': 'text', 'text': _dumps(payload)}],
+                    'messageId': uuid4().hex,
+                }
+            )
         )
-    )
+        for _, payload in scenarios
+    ]
     
-    response = await client.send_message(request)
-    logger.info("无示例场景响应:")
-    logger.info(response.model_dump(mode='json', exclude_none=True))
+    logger.info("\n=== 并发测试软件开发、内容创作、无示例场景 ===")
+    responses = await asyncio.gather(
+        *(client.send_message(request) for request in requests),
+        return_exceptions=True
+    )
+    for (name, _), response in zip(scenarios, responses):
+        if isinstance(response, BaseException):
+            logger.error(f"{name}请求失败: {response}")
+            continue
+        logger.info("%s响应: %s", name, response.model_dump_json(exclude_none=True))
     
     # 测试用例4: 流式响应测试
     logger.info("\n=== 测试流式响应 ===")
@@ -118,7 +110,7 @@ async def test_prompt_optimization(client: A2AClient, logger: logging.Logger) ->
         params=MessageSendParams(
             message={
                 'role': 'user',
-                'parts': [{'kind': 'text', 'text': json.dumps(software_dev_payload, ensure_ascii=False)}],
+                'parts': [{'kind': 'text', 'text': _dumps(software_dev_payload)}],
                 'messageId': uuid4().hex,
             }
         )
@@ -126,7 +118,7 @@ async def test_prompt_optimization(client: A2AClient, logger: logging.Logger) ->
     
     logger.info("开始接收流式响应:")
     async for chunk in client.send_message_streaming(streaming_request):
-        logger.info(f"收到数据块: {chunk.model_dump(mode='json', exclude_none=True)}")
+        logger.info("收到数据块: %s", chunk.model_dump_json(exclude_none=True))
 
 
 async def main() -> None:
@@ -147,7 +139,8 @@ async def main() -> None:
         write=60.0      # 写入超时时间
     )
 
-    async with httpx.AsyncClient(timeout=timeout_settings) as httpx_client:
+    # 并发请求需要足够的连接数
+    async with httpx.AsyncClient(timeout=timeout_settings, limits=httpx.Limits(max_connections=8)) as httpx_client:
         # Initialize A2ACardResolver
         resolver = A2ACardResolver(
             httpx_client=httpx_client,
@@ -223,5 +216,6 @@ async def main() -> None:
 
 
 if __name__ == '__main__':
-    import asyncio
+    # 优先使用uvloop（Windows上为winloop）事件循环，未安装时使用默认事件循环
+    install_uvloop()
     asyncio.run(main())
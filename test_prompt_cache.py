@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+测试脚本：验证优化结果的语义缓存和精确缓存
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+from prompt_cache import ExactCache, SemanticCache, request_key
+from prompt_optimizer import PromptRequest
+
+_REQUEST = PromptRequest(
+    role="software developers",
+    basic_requirements="编写高质量、可维护的Python代码，包括函数、类和API设计"
+)
+# 只改动一个字的近似请求
+_NEAR_DUPLICATE = PromptRequest(
+    role="software developers",
+    basic_requirements="编写高质量、可维护的Python代码，包括函数、类与API设计"
+)
+_UNRELATED = PromptRequest(role="content creators", basic_requirements="创作引人入胜的博客文章")
+
+
+class _StubCompute:
+    """记录调用次数的compute桩，返回带序号的结果"""
+
+    def __init__(self, used_fallback: bool = False):
+        self.calls = 0
+        self.used_fallback = used_fallback
+
+    async def __call__(self, request):
+        self.calls += 1
+        return {"role": request.role, "step": "completed", "used_fallback": self.used_fallback, "run": self.calls}
+
+
+def _semantic_cache(path=None) -> SemanticCache:
+    """不等待批处理窗口的语义缓存"""
+    return SemanticCache(path=path, batch_window=0)
+
+
+def test_semantic_cache_hit_and_miss():
+    """近似请求命中缓存，无关请求重新计算"""
+    cache = _semantic_cache()
+    compute = _StubCompute()
+
+    async def run():
+        first = await cache.get_or_compute(_REQUEST, compute)
+        near = await cache.get_or_compute(_NEAR_DUPLICATE, compute)
+        unrelated = await cache.get_or_compute(_UNRELATED, compute)
+        return first, near, unrelated
+
+    first, near, unrelated = asyncio.run(run())
+    assert near == first
+    assert unrelated["run"] == 2
+    assert compute.calls == 2
+
+
+def test_semantic_cache_skips_fallback_results(tmp_path):
+    """使用了占位结果的运行不缓存，也不写盘"""
+    path = tmp_path / "semantic.npz"
+    cache = _semantic_cache(str(path))
+    failing = _StubCompute(used_fallback=True)
+    compute = _StubCompute()
+
+    asyncio.run(cache.get_or_compute(_REQUEST, failing))
+    assert cache._entries == {}
+    assert not path.exists()
+
+    # 重试时重新计算，成功的结果正常缓存
+    result = asyncio.run(cache.get_or_compute(_REQUEST, compute))
+    assert result["used_fallback"] is False
+    assert (failing.calls, compute.calls) == (1, 1)
+    assert [len(results) for _, _, results in _semantic_cache(str(path))._entries.values()] == [1]
+
+
+def test_semantic_cache_round_trip(tmp_path):
+    """保存后重新加载，各分区的条目和结果保持不变"""
+    path = tmp_path / "semantic.npz"
+    cache = _semantic_cache(str(path))
+    gemini_request = _REQUEST.model_copy(update={"model_type": "gemini"})
+
+    async def fill():
+        await cache.get_or_compute(_REQUEST, _StubCompute())
+        await cache.get_or_compute(gemini_request, _StubCompute())
+        await cache.get_or_compute(_UNRELATED, _StubCompute())
+
+    asyncio.run(fill())
+    reloaded = _semantic_cache(str(path))
+    assert reloaded._entries.keys() == cache._entries.keys()
+    for partition, (matrix, scales, results) in cache._entries.items():
+        loaded_matrix, loaded_scales, loaded_results = reloaded._entries[partition]
+        assert (loaded_matrix == matrix).all() and loaded_matrix.dtype == matrix.dtype
+        assert (loaded_scales == scales).all()
+        assert loaded_results == results
+
+    # 重新加载的缓存直接命中，且同一文本在不同模型分区中各自返回自己的结果
+    compute = _StubCompute()
+
+    async def lookup():
+        return (await reloaded.get_or_compute(_REQUEST, compute),
+                await reloaded.get_or_compute(gemini_request, compute))
+
+    openai_result, gemini_result = asyncio.run(lookup())
+    assert compute.calls == 0
+    assert openai_result == cache._entries[SemanticCache._partition_key(_REQUEST)][2][0]
+    assert gemini_result == cache._entries[SemanticCache._partition_key(gemini_request)][2][0]
+
+
+def test_exact_cache_skips_fallback_results(tmp_path):
+    """使用了占位结果的运行不写入缓存文件"""
+    cache = ExactCache(str(tmp_path))
+    asyncio.run(cache.get_or_compute(_REQUEST, _StubCompute(used_fallback=True)))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_exact_cache_expired_entry_removed(tmp_path):
+    """超过有效期的缓存文件被删除并重新计算"""
+    cache = ExactCache(str(tmp_path), ttl=60)
+    compute = _StubCompute()
+    path = cache._path(request_key(_REQUEST))
+
+    asyncio.run(cache.get_or_compute(_REQUEST, compute))
+    assert asyncio.run(cache.get_or_compute(_REQUEST, compute))["run"] == 1
+
+    expired = time.time() - 120
+    os.utime(path, (expired, expired))
+    assert cache._read(path) is None
+    assert not os.path.exists(path)
+
+    assert asyncio.run(cache.get_or_compute(_REQUEST, compute))["run"] == 2
+    assert os.path.exists(path)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -4,261 +4,93 @@
 """
 
 import os
-import asyncio
+import sys
 import logging
-from typing import Dict, Any
-from prompt_optimizer import PromptOptimizerWorkflow, PromptRequest, ModelFactory
+from unittest import mock
+
+import pytest
+
+import prompt_optimizer
+from prompt_optimizer import Config, ModelFactory, PromptRequest
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class ProxyAndOptimizationTester:
-    """代理配置和优化测试器"""
-    
-    def __init__(self):
-        self.test_results = []
-    
-    def test_proxy_configuration(self):
-        """测试代理配置"""
-        print("🌐 测试代理配置...")
-        
-        # 保存原始环境变量
-        original_https_proxy = os.environ.get('HTTPS_PROXY')
-        original_http_proxy = os.environ.get('HTTP_PROXY')
-        
-        # 清除现有代理设置
-        if 'HTTPS_PROXY' in os.environ:
-            del os.environ['HTTPS_PROXY']
-        if 'HTTP_PROXY' in os.environ:
-            del os.environ['HTTP_PROXY']
-        if 'https_proxy' in os.environ:
-            del os.environ['https_proxy']
-        if 'http_proxy' in os.environ:
-            del os.environ['http_proxy']
-        
-        try:
-            # 创建模型以触发代理设置
-            ModelFactory.create_model("gemini")
-            
-            # 检查代理是否已设置
-            https_proxy = os.environ.get('HTTPS_PROXY')
-            http_proxy = os.environ.get('HTTP_PROXY')
-            
-            if https_proxy == "http://127.0.0.1:7890" and http_proxy == "http://127.0.0.1:7890":
-                print("✅ 代理配置测试通过：默认代理已正确设置")
-                self.test_results.append(("代理配置", True, "默认代理设置正确"))
-            else:
-                print(f"❌ 代理配置测试失败：HTTPS_PROXY={https_proxy}, HTTP_PROXY={http_proxy}")
-                self.test_results.append(("代理配置", False, f"代理设置不正确"))
-                
-        except Exception as e:
-            print(f"❌ 代理配置测试出错：{str(e)}")
-            self.test_results.append(("代理配置", False, str(e)))
-        finally:
-            # 恢复原始环境变量
-            if original_https_proxy:
-                os.environ['HTTPS_PROXY'] = original_https_proxy
-            if original_http_proxy:
-                os.environ['HTTP_PROXY'] = original_http_proxy
-    
-    def test_model_factory_caching(self):
-        """测试模型工厂缓存功能"""
-        print("\n🔄 测试模型工厂缓存...")
-        
-        try:
-            # 清除缓存
-            ModelFactory.clear_cache()
-            
-            # 第一次创建模型
-            model1 = ModelFactory.create_model("gemini")
-            cache_size_1 = len(ModelFactory._model_instances)
-            
-            # 第二次创建相同模型（应该使用缓存）
-            model2 = ModelFactory.create_model("gemini")
-            cache_size_2 = len(ModelFactory._model_instances)
-            
-            if model1 is model2 and cache_size_1 == cache_size_2 == 1:
-                print("✅ 模型缓存测试通过：模型实例正确复用")
-                self.test_results.append(("模型缓存", True, "缓存机制正常工作"))
-            else:
-                print("❌ 模型缓存测试失败：模型实例未正确复用")
-                self.test_results.append(("模型缓存", False, "缓存机制异常"))
-                
-        except Exception as e:
-            print(f"❌ 模型缓存测试出错：{str(e)}")
-            self.test_results.append(("模型缓存", False, str(e)))
-    
-    def test_input_validation(self):
-        """测试输入验证功能"""
-        print("\n✅ 测试输入验证...")
-        
-        test_cases = [
-            # (测试名称, 请求数据, 是否应该成功)
-            ("完整正常请求", {
-                "role": "software developers",
-                "basic_requirements": "编写高质量、可维护的代码",
-                "examples": [{"input": "test", "output": "result"}],
-                "model_type": "openai"
-            }, True),
-            ("无示例正常请求", {
-                "role": "content writers",
-                "basic_requirements": "创作引人入胜的文章",
-                "examples": [],
-                "model_type": "openai"
-            }, True),
-            ("空角色", {
-                "role": "",
-                "basic_requirements": "编写代码",
-                "examples": [{"input": "test", "output": "result"}],
-                "model_type": "openai"
-            }, False),
-            ("空基本要求", {
-                "role": "developers",
-                "basic_requirements": "",
-                "examples": [{"input": "test", "output": "result"}],
-                "model_type": "openai"
-            }, False),
-            ("示例格式错误", {
-                "role": "developers",
-                "basic_requirements": "编写代码",
-                "examples": [{"input": "test"}],  # 缺少output
-                "model_type": "openai"
-            }, False),
-        ]
-        
-        for test_name, request_data, should_succeed in test_cases:
-            try:
-                request = PromptRequest(
-                    role=request_data.get("role", ""),
-                    basic_requirements=request_data.get("basic_requirements", ""),
-                    examples=request_data.get("examples", []),
-                    model_type=request_data.get("model_type", "openai")
-                )
-                
-                # 尝试创建工作流并进行基本验证
-                workflow = PromptOptimizerWorkflow(model_type=request.model_type)
-                
-                # 简单的验证逻辑（模拟实际验证）
-                if not request.role.strip():
-                    raise ValueError("Role cannot be empty")
-                if not request.basic_requirements.strip():
-                    raise ValueError("Basic requirements cannot be empty")
-                if request.examples:  # 只在有示例时验证
-                    for i, example in enumerate(request.examples):
-                        if not isinstance(example, dict):
-                            raise ValueError(f"Example {i+1} must be a dictionary")
-                        if 'input' not in example or 'output' not in example:
-                            raise ValueError(f"Example {i+1} must have input and output")
-                
-                if should_succeed:
-                    print(f"✅ {test_name}: 验证通过")
-                    self.test_results.append((f"输入验证-{test_name}", True, "验证正确"))
-                else:
-                    print(f"❌ {test_name}: 应该失败但验证通过")
-                    self.test_results.append((f"输入验证-{test_name}", False, "验证逻辑有误"))
-                    
-            except Exception as e:
-                if not should_succeed:
-                    print(f"✅ {test_name}: 正确捕获错误 - {str(e)}")
-                    self.test_results.append((f"输入验证-{test_name}", True, f"正确捕获：{str(e)}"))
-                else:
-                    print(f"❌ {test_name}: 意外错误 - {str(e)}")
-                    self.test_results.append((f"输入验证-{test_name}", False, f"意外错误：{str(e)}"))
-    
-    async def test_error_handling(self):
-        """测试错误处理和恢复机制"""
-        print("\n🛡️ 测试错误处理...")
-        
-        try:
-            # 创建一个有效的请求
-            request = PromptRequest(
-                role="test_role",
-                basic_requirements="测试基本要求",
-                examples=[{"input": "test input", "output": "test output"}],
-                model_type="openai"
-            )
-            
-            workflow = PromptOptimizerWorkflow(model_type="openai")
-            
-            # 模拟工作流执行（不实际调用API以避免费用）
-            print("✅ 错误处理测试通过：工作流初始化成功")
-            self.test_results.append(("错误处理", True, "工作流错误处理机制正常"))
-            
-        except Exception as e:
-            print(f"❌ 错误处理测试失败：{str(e)}")
-            self.test_results.append(("错误处理", False, str(e)))
-    
-    def test_alternative_extraction(self):
-        """测试改进方案提取逻辑"""
-        print("\n📝 测试改进方案提取...")
-        
-        from prompt_optimizer import PromptImproverAgent
-        
-        try:
-            improver = PromptImproverAgent(model_type="openai")
-            
-            # 测试响应文本
-            test_response = """
-            ALTERNATIVE 1: [Focus: clarity and structure]
-            This is the first improved prompt with better clarity and structure.
-            It includes role-specific requirements and clear task definitions.
-            
-            ALTERNATIVE 2: [Focus: task decomposition]
-            This is the second improved prompt with detailed task breakdown.
-            It helps users understand the requirements step by step.
-            
-            ALTERNATIVE 3: [Focus: quality standards]
-            This is the third improved prompt that emphasizes quality criteria.
-            It includes specific metrics and evaluation points.
-            """
-            
-            alternatives = improver._extract_alternatives(test_response)
-            
-            if len(alternatives) == 3:
-                print("✅ 改进方案提取测试通过：成功提取3个方案")
-                self.test_results.append(("改进方案提取", True, "提取逻辑正常工作"))
-            else:
-                print(f"❌ 改进方案提取测试失败：预期3个方案，实际提取{len(alternatives)}个")
-                self.test_results.append(("改进方案提取", False, f"提取数量不正确：{len(alternatives)}"))
-                
-        except Exception as e:
-            print(f"❌ 改进方案提取测试失败：{str(e)}")
-            self.test_results.append(("改进方案提取", False, str(e)))
-    
-    def print_test_summary(self):
-        """打印测试结果汇总"""
-        print("\n📊 测试结果汇总")
-        print("=" * 50)
-        
-        total_tests = len(self.test_results)
-        passed_tests = sum(1 for _, passed, _ in self.test_results if passed)
-        
-        for test_name, passed, message in self.test_results:
-            status = "✅" if passed else "❌"
-            print(f"{status} {test_name}: {message}")
-        
-        print("=" * 50)
-        print(f"总计测试: {total_tests}")
-        print(f"通过测试: {passed_tests}")
-        print(f"失败测试: {total_tests - passed_tests}")
-        print(f"通过率: {(passed_tests/total_tests*100):.1f}%")
+_PROXY_ENV_KEYS = ("HTTPS_PROXY", "HTTP_PROXY", "https_proxy", "http_proxy")
+
+def test_proxy_configuration(monkeypatch):
+    """测试代理配置"""
+    # 未显式配置代理时应启用默认代理；重置指纹以强制重新设置
+    monkeypatch.setattr(Config, "HTTPS_PROXY", "")
+    monkeypatch.setattr(Config, "HTTP_PROXY", "")
+    monkeypatch.setattr(Config, "ENABLE_DEFAULT_PROXY", True)
+    monkeypatch.setattr(prompt_optimizer, "_proxy_fingerprint", None)
+
+    # 清除现有代理设置；patch.dict退出时还原整个环境，包括_setup_proxy新写入的变量
+    with mock.patch.dict(os.environ):
+        for key in _PROXY_ENV_KEYS:
+            monkeypatch.delenv(key, raising=False)
+        ModelFactory._setup_proxy()
+        assert all(os.environ.get(key) == Config.DEFAULT_PROXY for key in _PROXY_ENV_KEYS)
+
+def test_model_factory_caching(gemini_model):
+    """测试模型工厂缓存功能"""
+    # 夹具持有的模型仍然存活，再次创建应该使用缓存
+    assert ModelFactory.create_model("gemini") is gemini_model
+
+@pytest.mark.parametrize("request_data,should_succeed", [
+    # 完整正常请求
+    ({"role": "software developers", "basic_requirements": "编写高质量、可维护的代码",
+      "examples": [{"input": "test", "output": "result"}]}, True),
+    # 无示例正常请求
+    ({"role": "content writers", "basic_requirements": "创作引人入胜的文章", "examples": []}, True),
+    # 空角色
+    ({"role": "", "basic_requirements": "编写代码", "examples": [{"input": "test", "output": "result"}]}, False),
+    # 空基本要求
+    ({"role": "developers", "basic_requirements": "", "examples": [{"input": "test", "output": "result"}]}, False),
+    # 示例格式错误（缺少output）
+    ({"role": "developers", "basic_requirements": "编写代码", "examples": [{"input": "test"}]}, False),
+], ids=["完整正常请求", "无示例正常请求", "空角色", "空基本要求", "示例格式错误"])
+def test_input_validation(request_data, should_succeed):
+    """测试输入验证功能（由PromptRequest模型完成，无需创建工作流）"""
+    if should_succeed:
+        PromptRequest.model_validate(request_data)
+    else:
+        with pytest.raises(ValueError):
+            PromptRequest.model_validate(request_data)
+
+def test_error_handling(workflow):
+    """测试错误处理和恢复机制"""
+    # 创建一个有效的请求；模拟工作流执行（不实际调用API以避免费用）
+    request = PromptRequest(
+        role="test_role",
+        basic_requirements="测试基本要求",
+        examples=[{"input": "test input", "output": "test output"}],
+        model_type="openai"
+    )
+    assert request.examples
+    assert workflow is not None
+
+def test_alternative_extraction(improver):
+    """测试改进方案提取逻辑"""
+    # 测试响应文本
+    test_response = """
+    ALTERNATIVE 1: [Focus: clarity and structure]
+    This is the first improved prompt with better clarity and structure.
+    It includes role-specific requirements and clear task definitions.
+
+    ALTERNATIVE 2: [Focus: task decomposition]
+    This is the second improved prompt with detailed task breakdown.
+    It helps users understand the requirements step by step.
+
+    ALTERNATIVE 3: [Focus: quality standards]
+    This is the third improved prompt that emphasizes quality criteria.
+    It includes specific metrics and evaluation points.
+    """
 
-async def main():
-    """主测试函数"""
-    tester = ProxyAndOptimizationTester()
-    
-    # 运行所有测试
-    print("\n🚀 开始运行测试套件...")
-    
-    tester.test_proxy_configuration()
-    tester.test_model_factory_caching()
-    tester.test_input_validation()
-    await tester.test_error_handling()
-    tester.test_alternative_extraction()
-    
-    # 打印测试汇总
-    tester.print_test_summary()
+    alternatives = improver._extract_alternatives(test_response)
+    assert len(alternatives) == 3, f"预期3个方案，实际提取{len(alternatives)}个"
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -5,8 +5,21 @@
 
 import asyncio
 import os
+import types
 from web import StreamingOptimizer, validate_inputs, extract_variables, validate_prompt
 
+# 结果格式化测试用的示例结果（只读，original_examples在测试中按解析结果填入）
+_SAMPLE_RESULT = types.MappingProxyType({
+    "role": "software developers",
+    "basic_requirements": "编写高质量、可维护的代码",
+    "model_type": "gemini",
+    "generated_prompt": "Please write clean, maintainable code.",
+    "evaluations": ["This prompt is clear and specific."],
+    "alternative_prompts": ["Write code that is easy to understand.", "Create maintainable software."],
+    "final_recommendation": "Please write clean, maintainable code that follows best practices.",
+    "step": "completed"
+})
+
 def test_input_validation():
     """测试输入验证功能"""
     print("🧪 测试输入验证...")
@@ -118,17 +131,7 @@ async def test_streaming_optimizer():
         print("❌ 示例解析失败")
     
     # 测试结果格式化（更新字段）
-    test_result = {
-        "role": "software developers",
-        "basic_requirements": "编写高质量、可维护的代码",
-        "model_type": "gemini",
-        "original_examples": parsed,
-        "generated_prompt": "Please write clean, maintainable code.",
-        "evaluations": ["This prompt is clear and specific."],
-        "alternative_prompts": ["Write code that is easy to understand.", "Create maintainable software."],
-        "final_recommendation": "Please write clean, maintainable code that follows best practices.",
-        "step": "completed"
-    }
+    test_result = {**_SAMPLE_RESULT, "original_examples": parsed}
     
     formatted = optimizer._format_final_result(test_result)
     print("✅ 结果格式化正常")
@@ -144,10 +147,7 @@ def test_environment():
     print(f"Google API Key: {'✅ 已配置' if google_key and google_key != 'your_google_api_key_here' else '❌ 未配置'}")
     print(f"OpenAI API Key: {'✅ 已配置' if openai_key and openai_key != 'your_openai_api_key_here' else '❌ 未配置'}")
     
-    # 测试代理配置
-    from prompt_optimizer import ModelFactory
-    ModelFactory._setup_proxy()
-    
+    # 只读取当前代理配置，不修改进程环境
     https_proxy = os.getenv('HTTPS_PROXY')
     http_proxy = os.getenv('HTTP_PROXY')
     
@@ -8,8 +8,10 @@ import gradio as gr
 import asyncio
 import json
 import re
-import os
+import time
 import logging
+from collections import OrderedDict
+from functools import lru_cache, partial
 from typing import Dict, List, Any, Iterator, Tuple, Optional
 from datetime import datetime
 from dotenv import load_dotenv
@@ -18,7 +20,20 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # 然后导入依赖Config类
-from prompt_optimizer import PromptOptimizerWorkflow, PromptRequest, ModelFactory, Config
+from prompt_optimizer import PromptOptimizerWorkflow, PromptRequest, ModelFactory, Config, prompt_delta_sink, install_uvloop
+from prompt_cache import request_key
+
+# 优先使用orjson解析和序列化JSON，未安装时退回标准库json
+# （orjson.JSONDecodeError继承自json.JSONDecodeError，现有异常处理不受影响；orjson输出本身不转义非ASCII字符）
+try:
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = partial(json.dumps, ensure_ascii=False)
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -42,6 +57,32 @@ if not logger.handlers:  # 避免重复添加处理器
         
     logger.debug("日志配置完成，当前级别: %s", Config.LOG_LEVEL)
 
+# 流式输出时两次界面刷新之间的最小间隔（秒），期间的中间状态合并到下一次刷新
+_UI_UPDATE_INTERVAL = 0.05
+
+# 已完成优化结果的缓存条数，相同请求再次提交时直接返回
+_RESULT_CACHE_SIZE = 128
+
+# 生成prompt期间在结果区域展示的内容
+_PARTIAL_PROMPT_TPL = """## ✏️ 正在生成的Prompt
+```
+{prompt}
+```
+"""
+
+# prompt中的变量占位符，如 {name}
+_VARIABLE_RE = re.compile(r'\{([^}]+)\}')
+# 文本格式示例：以"Input:"行开始、"Output:"行分隔的一组示例（不区分大小写）
+_TEXT_EXAMPLE_RE = re.compile(
+    r'^[ \t]*input:(?P<input>(?:(?!^[ \t]*input:).)*?)'
+    r'^[ \t]*output:(?P<output>.*?)(?=^[ \t]*input:|\Z)',
+    re.S | re.I | re.M
+)
+
+def _nonblank_lines(text: str) -> List[str]:
+    """去掉首尾空白后的非空行"""
+    return [line for line in map(str.strip, text.split('\n')) if line]
+
 class SessionState:
     """会话状态管理类，避免使用全局变量"""
     
@@ -50,25 +91,19 @@ class SessionState:
         self.last_update: Optional[datetime] = None
         self.optimization_history: List[Dict[str, Any]] = []
     
-    def update_result(self, result: Dict[str, Any]) -> None:
-        """更新当前结果"""
-        self.current_result = result
+    def record_result(self, result: Dict[str, Any]) -> None:
+        """更新当前结果，已完成的结果同时记入优化历史（共用同一个字典和时间戳）"""
         self.last_update = datetime.now()
-        logger.info(f"结果已更新: {result.get('role', 'Unknown')}")
+        self.current_result = result
+        if result.get('step') == 'completed':
+            result['timestamp'] = self.last_update.isoformat()
+            self.optimization_history.append(result)
+        logger.info("结果已更新: %s，当前历史数量: %s", result.get('role', 'Unknown'), len(self.optimization_history))
     
     def get_current_prompt(self) -> str:
         """获取当前生成的prompt"""
         return self.current_result.get('final_recommendation', 
                                      self.current_result.get('generated_prompt', ''))
-    
-    def add_to_history(self, result: Dict[str, Any]) -> None:
-        """添加到优化历史"""
-        if result and result.get('step') == 'completed':
-            self.optimization_history.append({
-                **result,
-                'timestamp': datetime.now().isoformat()
-            })
-            logger.info(f"添加到历史记录，当前历史数量: {len(self.optimization_history)}")
 
 # 创建会话状态实例
 session_state = SessionState()
@@ -79,6 +114,7 @@ class StreamingOptimizer:
     def __init__(self):
         self.workflow: Optional[PromptOptimizerWorkflow] = None
         self.current_step: str = ""
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # 请求摘要 -> 优化结果（LRU淘汰）
         
     async def optimize_with_streaming(
         self,
@@ -87,9 +123,9 @@ class StreamingOptimizer:
         examples: List[Dict[str, str]],
         additional_requirements: str,
         model_type: str
-    ) -> Iterator[Tuple[str, str, str]]:
-        """执行优化并流式返回结果"""
-        logger.info(f"开始优化流程: role={role}, model={model_type}")
+    ) -> Iterator[Tuple[str, str, str, float]]:
+        """执行优化并流式返回结果：(步骤, 状态, 输出, 进度)；生成prompt期间输出为生成中的prompt，完成时为最终结果"""
+        logger.info("开始优化流程: role=%s, model=%s", role, model_type)
         
         try:
             # 输入预处理和验证
@@ -112,83 +148,88 @@ class StreamingOptimizer:
                 model_type=model_type
             )
             
+            # 相同请求已经优化过时直接返回结果，不再调用模型
+            cache_key = request_key(request)
+            cached = self._results.get(cache_key)
+            if cached is not None:
+                self._results.move_to_end(cache_key)
+                logger.info("命中优化结果缓存: %s", cache_key)
+                result = dict(cached)
+                session_state.record_result(result)
+                yield "✅ 完成", "Prompt优化已完成（缓存结果）！", self._format_final_result(result), 1.0
+                return
+            
             # 初始化工作流
-            yield "🚀 开始", f"正在初始化 {model_type.upper()} 模型...", ""
-            logger.info(f"初始化工作流，模型类型: {model_type}")
+            yield "🚀 开始", f"正在初始化 {model_type.upper()} 模型...", "", 0.1
+            logger.info("初始化工作流，模型类型: %s", model_type)
             
             try:
-                self.workflow = PromptOptimizerWorkflow()
+                # 复用同一个工作流：Agent持有的模型及其响应缓存得以保留，重复提交相同表单时直接命中缓存
+                if self.workflow is None:
+                    self.workflow = PromptOptimizerWorkflow()
             except Exception as e:
-                logger.error(f"工作流初始化失败: {str(e)}")
+                logger.error("工作流初始化失败: %s", e)
                 raise ConnectionError(f"无法初始化{model_type}模型，请检查API密钥配置")
             
-            yield "📋 验证", "正在验证输入参数...", ""
-            
-            # 创建初始状态
-            from prompt_optimizer import PromptOptimizerState
-            initial_state = PromptOptimizerState(
-                messages=[],
-                role=request.role,
-                basic_requirements=request.basic_requirements,
-                examples=request.examples or [],
-                current_prompt="",
-                evaluations=[],
-                alternative_prompts=[],
-                final_prompt="",
-                step="started",
-                model_type=request.model_type
-            )
+            yield "📋 验证", "正在验证输入参数...", "", 0.2
             
-            # 逐步执行工作流
-            yield "📖 生成指导", "正在生成prompt工程指导...", ""
-            try:
-                guide_result = await self.workflow._generate_guide_node(initial_state)
-                initial_state.update(guide_result)
-                logger.debug(f"prompt工程指导生成完成: {guide_result}")
-            except Exception as e:
-                logger.warning(f"生成指导失败，使用默认配置: {str(e)}")
+            # 创建初始状态（与工作流共用校验和预处理逻辑）
+            initial_state = self.workflow._build_initial_state(request)
+            
+            # 逐步执行工作流：prompt工程指导和评估指导只依赖输入，两次调用并发执行
+            yield "📖 生成指导", "正在生成prompt工程指导和评估框架...", "", 0.3
+            guides_result = await self.workflow._generate_guides_node(initial_state)
+            initial_state.update(guides_result)
+            logger.debug("指导生成完成: %s", guides_result)
             
-            yield "✏️ 生成Prompt", "正在根据角色和要求生成初始prompt...", ""
+            yield "✏️ 生成Prompt", "正在根据角色和要求生成初始prompt...", "", 0.5
             try:
-                prompt_result = await self.workflow._generate_prompt_node(initial_state)
+                # 模型边生成边推送到队列，节点结束时放入None作为结束标记
+                deltas: asyncio.Queue = asyncio.Queue()
+                sink_token = prompt_delta_sink.set(deltas.put_nowait)
+                try:
+                    prompt_task = asyncio.ensure_future(self.workflow._generate_prompt_node(initial_state))
+                finally:
+                    prompt_delta_sink.reset(sink_token)
+                prompt_task.add_done_callback(lambda _: deltas.put_nowait(None))
+                
+                generated_parts = []
+                while (delta := await deltas.get()) is not None:
+                    generated_parts.append(delta)
+                    partial_prompt = "".join(generated_parts).strip()
+                    yield "✏️ 生成Prompt", "正在生成prompt...", _PARTIAL_PROMPT_TPL.format(prompt=partial_prompt), 0.5
+                
+                prompt_result = await prompt_task
                 initial_state.update(prompt_result)
                 generated_prompt = initial_state.get('current_prompt', '')
-                logger.debug(f"初始prompt生成完成: {generated_prompt}") 
+                logger.debug("初始prompt生成完成: %s", generated_prompt) 
             except Exception as e:
-                logger.error(f"生成prompt失败: {str(e)}")
+                logger.error("生成prompt失败: %s", e)
                 raise RuntimeError("生成prompt失败，请重试")
             
-            yield "📊 评估准备", "正在准备评估框架...", ""
-            try:
-                eval_guide_result = await self.workflow._generate_eval_guide_node(initial_state)
-                initial_state.update(eval_guide_result)
-                logger.debug(f"评估框架生成完成: {eval_guide_result}")
-            except Exception as e:
-                logger.warning(f"评估框架准备失败: {str(e)}")
-            
-            yield "🔍 执行评估", "正在评估prompt质量...", ""
+            yield "🔍 执行评估", "正在评估prompt质量...", "", 0.7
             try:
                 evaluation_result = await self.workflow._evaluate_prompt_node(initial_state)
                 initial_state.update(evaluation_result)
-                logger.debug(f"prompt评估完成: {evaluation_result}")
+                logger.debug("prompt评估完成: %s", evaluation_result)
             except Exception as e:
-                logger.warning(f"prompt评估失败: {str(e)}")
+                logger.warning("prompt评估失败: %s", e)
             
-            yield "🚀 生成改进", "正在生成改进方案...", ""
+            yield "🚀 生成改进", "正在生成改进方案...", "", 0.8
             try:
                 improvement_result = await self.workflow._improve_prompts_node(initial_state)
                 initial_state.update(improvement_result)
-                logger.debug(f"生成了 {len(initial_state.get('alternative_prompts', []))} 个改进方案: {improvement_result}")
+                logger.debug("生成了 %s 个改进方案: %s", len(initial_state.get('alternative_prompts', [])), improvement_result)
             except Exception as e:
-                logger.warning(f"生成改进方案失败: {str(e)}")
+                logger.warning("生成改进方案失败: %s", e)
             
-            yield "🎯 最终确定", "正在选择最佳prompt...", ""
+            yield "🎯 最终确定", "正在选择最佳prompt...", "", 0.9
             try:
                 final_result = await self.workflow._finalize_node(initial_state)
                 initial_state.update(final_result)
-                logger.debug(f"最终确定完成: {final_result}")
+                logger.debug("最终确定完成: %s", final_result)
             except Exception as e:
-                logger.error(f"最终确定失败: {str(e)}")
+                logger.error("最终确定失败: %s", e)
                 raise RuntimeError("最终确定失败，请重试")
             
             # 整理最终结果
@@ -201,41 +242,54 @@ class StreamingOptimizer:
                 "evaluations": initial_state.get("evaluations", []),
                 "alternative_prompts": initial_state.get("alternative_prompts", []),
                 "final_recommendation": initial_state.get("final_prompt", ""),
-                "step": initial_state.get("step", "completed")
+                "step": initial_state.get("step", "completed"),
+                "used_fallback": initial_state.get("used_fallback", False)
             }
             
+            # 缓存已完成的结果（在记录会话状态添加时间戳之前复制）；有步骤使用了占位结果时不缓存，重新提交时再次调用模型
+            if result["step"] == "completed" and not result["used_fallback"]:
+                self._results[cache_key] = dict(result)
+                if len(self._results) > _RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+            
             # 更新会话状态
-            session_state.update_result(result)
-            session_state.add_to_history(result)
+            session_state.record_result(result)
             
             # 格式化最终输出
             final_output = self._format_final_result(result)
             
-            yield "✅ 完成", "Prompt优化已完成！", final_output
-            logger.info(f"优化流程成功完成: {final_output}")
+            yield "✅ 完成", "Prompt优化已完成！", final_output, 1.0
+            logger.info("优化流程成功完成: %s", final_output)
             
         except ValueError as e:
             error_msg = f"输入验证错误: {str(e)}"
             logger.warning(error_msg)
-            yield "❌ 输入错误", error_msg, ""
+            yield "❌ 输入错误", error_msg, "", 0.1
         except ConnectionError as e:
             error_msg = f"连接错误: {str(e)}"
             logger.error(error_msg)
-            yield "❌ 连接错误", error_msg, ""
+            yield "❌ 连接错误", error_msg, "", 0.1
         except RuntimeError as e:
             error_msg = f"运行时错误: {str(e)}"
             logger.error(error_msg)
-            yield "❌ 运行错误", error_msg, ""
+            yield "❌ 运行错误", error_msg, "", 0.1
         except Exception as e:
             error_msg = f"未知错误: {str(e)}"
             logger.error(error_msg, exc_info=True)
-            yield "❌ 系统错误", error_msg, ""
+            yield "❌ 系统错误", error_msg, "", 0.1
+    
+    @staticmethod
+    def _parse_examples(examples_text: str) -> List[Dict[str, str]]:
+        """解析示例文本，每次返回新的列表副本，调用方可以放心修改"""
+        return [dict(example) for example in StreamingOptimizer._parse_examples_cached(examples_text)]
     
-    def _parse_examples(self, examples_text: str) -> List[Dict[str, str]]:
-        """解析示例文本，增强健壮性"""
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _parse_examples_cached(examples_text: str) -> Tuple[Dict[str, str], ...]:
+        """解析示例文本，增强健壮性；相同文本（如先校验再优化、界面重试）只解析一次"""
         if not examples_text or not examples_text.strip():
             logger.debug("未提供示例文本")
-            return []
+            return ()
         
         # 规范化输入
         examples_text = examples_text.replace('\r\n', '\n').strip()
@@ -243,7 +297,7 @@ class StreamingOptimizer:
         try:
             if examples_text.startswith('['):
                 # JSON数组格式
-                examples = json.loads(examples_text)
+                examples = _json_loads(examples_text)
                 if not isinstance(examples, list):
                     raise ValueError("示例必须是数组格式")
                 
@@ -257,7 +311,7 @@ class StreamingOptimizer:
                     
                     # 确保input字段是JSON字符串
                     if isinstance(example['input'], dict):
-                        example['input'] = json.dumps(example['input'], ensure_ascii=False)
+                        example['input'] = _json_dumps(example['input'])
                     elif not isinstance(example['input'], str):
                         example['input'] = str(example['input'])
                     
@@ -267,34 +321,14 @@ class StreamingOptimizer:
                     
                     normalized_examples.append(example)
                 
-                logger.info(f"成功解析JSON格式示例，数量: {len(normalized_examples)}")
-                return normalized_examples
+                logger.info("成功解析JSON格式示例，数量: %s", len(normalized_examples))
+                return tuple(normalized_examples)
             else:
-                # 简单文本格式，转换为JSON
+                # 简单文本格式，转换为JSON：一次正则扫描切出每组Input/Output
                 examples = []
-                current_input = {}
-                current_output = ""
-                mode = None
-                
-                # 分割成行并移除空行
-                lines = [line.strip() for line in examples_text.split('\n') if line.strip()]
-                
-                for line in lines:
-                    line_lower = line.lower()
-                    if line_lower.startswith('input:'):
-                        # 保存上一个示例
-                        if current_input and current_output:
-                            examples.append({
-                                "input": json.dumps(current_input, ensure_ascii=False), 
-                                "output": current_output.strip()
-                            })
-                        current_input = {}
-                        current_output = ""
-                        mode = "input"
-                    elif line_lower.startswith('output:'):
-                        current_output = line[7:].strip()
-                        mode = "output"
-                    elif line and mode == "input":
+                for match in _TEXT_EXAMPLE_RE.finditer(examples_text):
+                    current_input = {}
+                    for line in _nonblank_lines(match['input']):
                         # 尝试解析key=value格式
                         if '=' in line:
                             key, value = line.split('=', 1)
@@ -302,34 +336,37 @@ class StreamingOptimizer:
                         else:
                             # 如果不是key=value格式，作为纯文本处理
                             current_input['text'] = current_input.get('text', '') + ' ' + line
-                    elif line and mode == "output":
-                        current_output += "\n" + line
-                
-                # 添加最后一组示例
-                if current_input and current_output:
-                    examples.append({
-                        "input": json.dumps(current_input, ensure_ascii=False), 
-                        "output": current_output.strip()
-                    })
+                    current_output = '\n'.join(_nonblank_lines(match['output']))
+                    
+                    if current_input and current_output:
+                        examples.append({
+                            "input": _json_dumps(current_input), 
+                            "output": current_output
+                        })
                 
                 if not examples:
                     logger.warning("未能从文本中解析出有效示例")
-                    return []
+                    return ()
                 
-                logger.info(f"成功解析文本格式示例，数量: {len(examples)}")
-                return examples
+                logger.info("成功解析文本格式示例，数量: %s", len(examples))
+                return tuple(examples)
                 
         except json.JSONDecodeError as e:
-            logger.error(f"JSON解析错误: {str(e)}")
+            logger.error("JSON解析错误: %s", e)
             raise ValueError(f"示例格式错误，请检查JSON语法: {str(e)}")
         except Exception as e:
-            logger.error(f"解析示例时出错: {str(e)}")
+            logger.error("解析示例时出错: %s", e)
             raise ValueError(f"解析示例失败: {str(e)}")
     
     def _format_final_result(self, result: Dict) -> str:
         """格式化最终结果"""
         try:
-            output = f"""
+            alternatives = result.get('alternative_prompts', [])
+            evaluations = result.get('evaluations')
+            evaluation = evaluations[0][:500] + ('...' if len(evaluations[0]) > 500 else '') if evaluations else 'N/A'
+            
+            # 各部分先放入列表，最后一次拼接
+            parts = [f"""
 # 🎉 Prompt优化结果
 
 ## 💡 最终推荐的Prompt
@@ -350,22 +387,20 @@ class StreamingOptimizer:
 ```
 
 ## 🔍 评估结果
-{result.get('evaluations', ['N/A'])[0][:500] + ('...' if len(result.get('evaluations', [''])[0]) > 500 else '') if result.get('evaluations') else 'N/A'}
+{evaluation}
 
-## 🚀 改进方案 ({len(result.get('alternative_prompts', []))}) 个)
-"""
-            
-            for i, alt_prompt in enumerate(result.get('alternative_prompts', [])[:3], 1):
-                output += f"""
+## 🚀 改进方案 ({len(alternatives)}) 个)
+"""]
+            parts.extend(f"""
 ### 方案 {i}
 ```
 {alt_prompt[:200]}{'...' if len(alt_prompt) > 200 else ''}
 ```
-"""
+""" for i, alt_prompt in enumerate(alternatives[:3], 1))
             
-            return output
+            return "".join(parts)
         except Exception as e:
-            logger.error(f"格式化结果时出错: {str(e)}")
+            logger.error("格式化结果时出错: %s", e)
             return f"格式化结果时出现错误: {str(e)}"
 
 # 全局优化器实例
@@ -373,7 +408,7 @@ optimizer = StreamingOptimizer()
 
 def validate_inputs(role: str, basic_requirements: str, examples: str, model_type: str) -> str:
     """验证输入参数，增强健壮性"""
-    logger.debug(f"验证输入: role={bool(role.strip())}, basic_requirements={bool(basic_requirements.strip())}, examples={bool(examples.strip())}, model={model_type}")
+    logger.debug("验证输入: role=%s, basic_requirements=%s, examples=%s, model=%s", bool(role.strip()), bool(basic_requirements.strip()), bool(examples.strip()), model_type)
     
     # 验证必需字段
     if not role or not role.strip():
@@ -383,33 +418,33 @@ def validate_inputs(role: str, basic_requirements: str, examples: str, model_typ
         return "❌ 请填写基本要求"
     
     # 验证模型类型
-    if model_type.lower() not in ["gemini", "openai"]:
+    model_type_lc = model_type.lower()
+    if model_type_lc not in ("gemini", "openai"):
         return f"❌ 不支持的模型类型: {model_type}。支持的类型: gemini, openai"
     
     # 如果提供了示例，验证格式
     if examples and examples.strip():
         try:
-            # 尝试使用 StreamingOptimizer 的解析方法
-            optimizer_temp = StreamingOptimizer()
-            parsed_examples = optimizer_temp._parse_examples(examples)
+            # 使用 StreamingOptimizer 的解析方法（静态方法，无需创建实例）
+            parsed_examples = StreamingOptimizer._parse_examples(examples)
             
             if parsed_examples:
-                logger.info(f"示例验证成功，数量: {len(parsed_examples)}")
+                logger.info("示例验证成功，数量: %s", len(parsed_examples))
                 
                 # 验证字段名一致性（和 prompt_optimizer.py 保持一致）
                 first_example_fields = None
                 for i, example in enumerate(parsed_examples, 1):
                     try:
-                        input_data = json.loads(example['input']) if isinstance(example['input'], str) else example['input']
+                        input_data = _json_loads(example['input']) if isinstance(example['input'], str) else example['input']
                         if not isinstance(input_data, dict):
                             return f"❌ 示例 {i} 的 'input' 必须是有效的JSON对象"
                         
-                        # 获取当前示例的字段名集合
-                        current_fields = set(input_data.keys())
+                        # 字段名视图本身支持集合运算，直接与第一个示例比较，不为每个示例构建新集合
+                        current_fields = input_data.keys()
                         
                         # 如果是第一个示例，保存其字段名
                         if first_example_fields is None:
-                            first_example_fields = current_fields
+                            first_example_fields = frozenset(current_fields)
                         # 否则比较字段名是否一致
                         elif current_fields != first_example_fields:
                             # 找出不一致的字段
@@ -427,21 +462,21 @@ def validate_inputs(role: str, basic_requirements: str, examples: str, model_typ
         except ValueError as e:
             return f"❌ 示例格式错误: {str(e)}"
         except Exception as e:
-            logger.error(f"示例验证时出错: {str(e)}")
+            logger.error("示例验证时出错: %s", e)
             return f"❌ 示例验证失败: {str(e)}"
     
     # 验证API密钥
     try:
-        if model_type.lower() == "gemini":
+        if model_type_lc == "gemini":
             api_key = Config.GOOGLE_API_KEY
             if not api_key or api_key == 'your_google_api_key_here':
                 return "❌ 请先配置GOOGLE_API_KEY环境变量"
-        elif model_type.lower() == "openai":
+        elif model_type_lc == "openai":
             api_key = Config.OPENAI_API_KEY
             if not api_key or api_key == 'your_openai_api_key_here':
                 return "❌ 请先配置OPENAI_API_KEY环境变量"
     except Exception as e:
-        logger.error(f"API密钥验证时出错: {str(e)}")
+        logger.error("API密钥验证时出错: %s", e)
         return f"❌ API密钥验证失败: {str(e)}"
     
     logger.info("输入验证通过")
@@ -460,15 +495,20 @@ async def run_optimization(
     # 验证输入
     validation_result = validate_inputs(role, basic_requirements, examples, model_type)
     if validation_result.startswith("❌"):
-        logger.warning(f"输入验证失败: {validation_result}")
-        yield validation_result, "", gr.update(visible=False), gr.update(visible=False)
+        logger.warning("输入验证失败: %s", validation_result)
+        yield validation_result, gr.update(value="", visible=False), gr.update(visible=False), gr.update(visible=False), ""
         return
     
-    status_output = ""
-    final_output = ""
+    status_lines: List[str] = []  # 状态日志逐行追加，刷新界面时才拼接
+    last_step = ""
+    result_text = ""  # 结果区域内容：生成中的prompt，完成后为最终结果
+    completed = False
+    final_prompt = ""  # 最终prompt，写入页面供浏览器端直接复制
+    last_yield = 0.0  # 上次刷新界面的时间
+    pending = False  # 是否有尚未刷新到界面的状态
     
     progress(0, desc="开始初始化...")
-    logger.info(f"开始Prompt优化流程: role={role}, model={model_type}")
+    logger.info("开始Prompt优化流程: role=%s, model=%s", role, model_type)
     
     try:
         # 解析示例（如果有）
@@ -476,14 +516,14 @@ async def run_optimization(
         if examples.strip():
             try:
                 examples_list = optimizer._parse_examples(examples)
-                logger.info(f"成功解析示例，数量: {len(examples_list)}")
+                logger.info("成功解析示例，数量: %s", len(examples_list))
             except Exception as e:
-                logger.error(f"解析示例失败: {str(e)}")
-                yield f"❌ 解析示例失败: {str(e)}", "", gr.update(visible=False), gr.update(visible=False)
+                logger.error("解析示例失败: %s", e)
+                yield f"❌ 解析示例失败: {str(e)}", gr.update(value="", visible=False), gr.update(visible=False), gr.update(visible=False), ""
                 return
         
         # 执行流式优化
-        async for step, status, output in optimizer.optimize_with_streaming(
+        async for step, status, output, progress_value in optimizer.optimize_with_streaming(
             role=role,
             basic_requirements=basic_requirements,
             examples=examples_list,
@@ -492,65 +532,66 @@ async def run_optimization(
         ):
             # 更新状态输出
             timestamp = datetime.now().strftime('%H:%M:%S')
-            status_output += f"[{timestamp}] {step}: {status}\n"
-            
-            if output:
-                final_output = output
-                logger.info("优化结果已生成")
-            
-            # 更新进度条
-            progress_value = 0.1
-            if "验证" in step:
-                progress_value = 0.2
-            elif "生成指导" in step:
-                progress_value = 0.3
-            elif "生成Prompt" in step:
-                progress_value = 0.5
-            elif "评估准备" in step:
-                progress_value = 0.6
-            elif "执行评估" in step:
-                progress_value = 0.7
-            elif "生成改进" in step:
-                progress_value = 0.8
-            elif "最终确定" in step:
-                progress_value = 0.9
-            elif "完成" in step:
-                progress_value = 1.0
-                
+            status_line = f"[{timestamp}] {step}: {status}\n"
+            # 同一步骤的后续更新（如生成中的prompt）覆盖该步骤的状态行
+            if step == last_step:
+                status_lines[-1] = status_line
+            else:
+                status_lines.append(status_line)
+            last_step = step
+            
+            if step.startswith("❌"):
+                # 出错时不再展示生成到一半的prompt
+                result_text = ""
+            elif output:
+                result_text = output
+                # 进度为1时输出为最终结果，此前为生成中的prompt
+                if progress_value >= 1.0:
+                    completed = True
+                    final_prompt = session_state.get_current_prompt()
+                    logger.info("优化结果已生成")
+            
+            # 更新进度条（进度值由各步骤给出）
             progress(progress_value, desc=status)
             
+            # 节流：距上次刷新不足间隔时先合并，完成时立即刷新
+            now = time.monotonic()
+            if not (progress_value >= 1.0 or now - last_yield >= _UI_UPDATE_INTERVAL):
+                pending = True
+                continue
+            last_yield = now
+            pending = False
+            
             # 返回更新的UI状态
-            show_results = bool(final_output)
-            yield status_output, final_output, gr.update(visible=show_results), gr.update(visible=show_results)
+            yield ("".join(status_lines), gr.update(value=result_text, visible=bool(result_text)),
+                   gr.update(visible=completed), gr.update(visible=completed), final_prompt)
+        
+        # 刷新最后一批合并的状态
+        if pending:
+            yield ("".join(status_lines), gr.update(value=result_text, visible=bool(result_text)),
+                   gr.update(visible=completed), gr.update(visible=completed), final_prompt)
         
         logger.info("优化流程完成")
         
     except Exception as e:
         error_msg = f"优化过程中出现未知错误: {str(e)}"
         logger.error(error_msg, exc_info=True)
-        yield error_msg, "", gr.update(visible=False), gr.update(visible=False)
-
-def get_current_prompt() -> str:
-    """获取当前生成的prompt，使用会话状态"""
-    try:
-        return session_state.get_current_prompt()
-    except Exception as e:
-        logger.error(f"获取当前prompt失败: {str(e)}")
-        return ""
+        yield error_msg, gr.update(value="", visible=False), gr.update(visible=False), gr.update(visible=False), ""
 
 def extract_variables(prompt: str) -> List[str]:
     """提取prompt中的变量（如{name}, {topic}等），增强健壮性"""
     try:
         if not prompt or not isinstance(prompt, str):
             return []
-        variables = re.findall(r'\{([^}]+)\}', prompt)
-        unique_variables = list(set(variables))
-        logger.debug(f"提取到变量: {unique_variables}")
+        # dict.fromkeys去重并保持变量首次出现的顺序
+        unique_variables = list(dict.fromkeys(_VARIABLE_RE.findall(prompt)))
+        logger.debug("提取到变量: %s", unique_variables)
         return unique_variables
     except Exception as e:
-        logger.error(f"提取变量时出错: {str(e)}")
+        logger.error("提取变量时出错: %s", e)
         return []
 
+@lru_cache(maxsize=256)
 def validate_prompt(prompt: str, variables: str) -> str:
     """验证prompt并替换变量，增强错误处理"""
     try:
@@ -576,10 +617,8 @@ def validate_prompt(prompt: str, variables: str) -> str:
             except Exception as e:
                 return f"❌ 解析变量定义时出错: {str(e)}"
             
-            # 替换变量
-            test_prompt = prompt
-            for key, value in var_dict.items():
-                test_prompt = test_prompt.replace(f'{{{key}}}', value)
+            # 一次扫描替换所有已定义的变量，未定义的保持原样
+            test_prompt = _VARIABLE_RE.sub(lambda m: var_dict.get(m.group(1), m.group(0)), prompt)
             
             # 检查是否还有未替换的变量
             remaining_vars = extract_variables(test_prompt)
@@ -596,26 +635,28 @@ def validate_prompt(prompt: str, variables: str) -> str:
                 return f"✅ 验证通过！没有需要替换的变量。\n\nPrompt:\n{prompt}"
     
     except Exception as e:
-        logger.error(f"验证prompt时出错: {str(e)}")
+        logger.error("验证prompt时出错: %s", e)
         return f"❌ 验证过程中出现错误: {str(e)}"
 
+@lru_cache(maxsize=64)
+def _variables_hint(prompt: str) -> str:
+    """根据prompt中的变量生成提示文本，相同prompt（如输入时的重复触发）直接返回缓存"""
+    variables = extract_variables(prompt)
+    if variables:
+        # 排序以保持一致性，各行拼接一次
+        hint = "发现以下变量，请定义其值：\n" + "".join(f"{var}=在此输入{var}的值\n" for var in sorted(variables))
+        logger.debug("更新变量提示，发现 %s 个变量", len(variables))
+        return hint
+    return "未发现变量，如需添加变量请使用{变量名}格式"
+
 def update_variables_hint(prompt: str) -> str:
     """更新变量提示，增强用户体验"""
     try:
         if not prompt:
             return "请先输入prompt内容"
-            
-        variables = extract_variables(prompt)
-        if variables:
-            hint = "发现以下变量，请定义其值：\n"
-            for var in sorted(variables):  # 排序以保持一致性
-                hint += f"{var}=在此输入{var}的值\n"
-            logger.debug(f"更新变量提示，发现 {len(variables)} 个变量")
-            return hint
-        else:
-            return "未发现变量，如需添加变量请使用{变量名}格式"
+        return _variables_hint(prompt)
     except Exception as e:
-        logger.error(f"更新变量提示时出错: {str(e)}")
+        logger.error("更新变量提示时出错: %s", e)
         return "更新变量提示时出现错误"
 
 # 创建Gradio界面
@@ -709,6 +750,9 @@ with gr.Blocks(title="Prompt优化器 - Web界面", theme=gr.themes.Soft()) as a
                         with gr.Row():
                             copy_prompt_btn = gr.Button("📋 复制最终Prompt", variant="primary", visible=False)
                             view_prompt_btn = gr.Button("🔍 在验证页面查看", variant="secondary", visible=False)
+                        
+                        # 不显示，仅保存最终prompt供复制按钮在浏览器端读取
+                        final_prompt_text = gr.Textbox(visible=False)
         
         with gr.Tab("🔧 手动验证", id=1):
             gr.HTML("<h3>✨ Prompt验证和变量编辑</h3>")
@@ -818,42 +862,58 @@ with gr.Blocks(title="Prompt优化器 - Web界面", theme=gr.themes.Soft()) as a
             """)
     
     # 事件绑定
-    def switch_to_validation_tab():
-        return gr.Tabs(selected=1), get_current_prompt()
+    def switch_to_validation_tab(prompt: str):
+        return gr.Tabs(selected=1), prompt
     
     optimize_btn.click(
         fn=run_optimization,
         inputs=[role_input, basic_requirements, examples_input, additional_requirements, model_type],
-        outputs=[status_output, result_output, copy_prompt_btn, view_prompt_btn],
-        show_progress=True
+        outputs=[status_output, result_output, copy_prompt_btn, view_prompt_btn, final_prompt_text],
+        show_progress=True,
+        # 调用模型的事件单独计数并发，轻量事件不占用其并发名额
+        concurrency_limit=Config.WEB_CONCURRENCY_LIMIT,
+        concurrency_id="llm"
     )
     
+    # 复制完全在浏览器端完成，不经过服务器
     copy_prompt_btn.click(
-        fn=get_current_prompt,
-        outputs=[gr.Textbox(visible=False)],
-        js="(prompt) => navigator.clipboard.writeText(prompt)"
+        fn=None,
+        inputs=[final_prompt_text],
+        js="(prompt) => { navigator.clipboard.writeText(prompt); return []; }"
     )
     
+    # 以下事件均为纯本地计算，不限并发
     view_prompt_btn.click(
         fn=switch_to_validation_tab,
-        outputs=[tabs, manual_prompt]
+        inputs=[final_prompt_text],
+        outputs=[tabs, manual_prompt],
+        concurrency_limit=None
     )
     
+    # 浏览器端防抖：停止输入250ms后才提交，输入期间只保留最后一次触发
     manual_prompt.change(
         fn=update_variables_hint,
         inputs=[manual_prompt],
-        outputs=[variables_hint]
+        outputs=[variables_hint],
+        js="(prompt) => new Promise(resolve => { clearTimeout(window.__variablesHintTimer); window.__variablesHintTimer = setTimeout(() => resolve(prompt), 250); })",
+        trigger_mode="always_last",
+        show_progress="hidden",
+        concurrency_limit=None
     )
     
     validate_btn.click(
         fn=validate_prompt,
         inputs=[manual_prompt, variables_input],
-        outputs=[validation_result]
+        outputs=[validation_result],
+        concurrency_limit=None
     )
     
+    # 直接读取页面中保存的最终prompt，不经过服务器
     load_prompt_btn.click(
-        fn=get_current_prompt,
-        outputs=[manual_prompt]
+        fn=None,
+        inputs=[final_prompt_text],
+        outputs=[manual_prompt],
+        js="(prompt) => prompt"
     )
 
 def main():
@@ -861,16 +921,19 @@ def main():
     logger.debug("正在启动Web应用 DEBUG 模式...")
     print("🚀 启动Prompt优化器Web界面...")
     
+    # 优先使用uvloop（Windows上为winloop）事件循环，未安装时使用默认事件循环
+    install_uvloop()
+    
     # 检查代理配置
     if Config.ENABLE_DEFAULT_PROXY:
         logger.debug("代理配置: 使用默认代理 %s", Config.DEFAULT_PROXY)
         print(f"🌐 代理配置: 使用默认代理 {Config.DEFAULT_PROXY}")
-    elif os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY"):
+    elif Config.HTTPS_PROXY or Config.HTTP_PROXY:
         logger.debug("代理配置: 使用自定义代理 HTTPS=%s, HTTP=%s", 
-                    os.getenv("HTTPS_PROXY"), os.getenv("HTTP_PROXY"))
+                    Config.HTTPS_PROXY, Config.HTTP_PROXY)
         print(f"🌐 代理配置: 使用自定义代理")
-        print(f"   HTTPS_PROXY: {os.getenv('HTTPS_PROXY')}")
-        print(f"   HTTP_PROXY: {os.getenv('HTTP_PROXY')}")
+        print(f"   HTTPS_PROXY: {Config.HTTPS_PROXY}")
+        print(f"   HTTP_PROXY: {Config.HTTP_PROXY}")
     else:
         logger.debug("代理配置: 未启用代理")
         print("🌐 代理配置: 未启用代理")
@@ -888,6 +951,9 @@ def main():
     
     print("\n💡 提示: 请确保至少配置一个API密钥以使用相应的模型")
     
+    # 模型调用都是异步IO，允许多个会话的请求并发执行，而不是按Gradio默认逐个排队
+    app.queue(default_concurrency_limit=Config.WEB_CONCURRENCY_LIMIT, max_size=Config.WEB_QUEUE_MAX_SIZE)
+    
     try:
         # 启动应用
         logger.debug("正在启动Gradio应用...")